@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""Parse latency benchmark.
+
+Measures how long it takes to parse a corpus of representative queries in a
+fresh process:
+
+  ll      Full LL prediction only (how sqlhild used to parse)
+  sll     SLL prediction with LL fallback, cold DFA
+  cached  SLL prediction with LL fallback, DFA loaded from the DFA cache
+  fast    fastparse, falling back to SLL/LL with the DFA cache
+
+Usage:
+  python benchmarks/parse_latency.py
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+CORPUS = [
+    "SELECT 1",
+    "SELECT * FROM OneToTen",
+    "SELECT val FROM OneToTen WHERE val > 3",
+    "SELECT * FROM OneToTen WHERE val > 3 AND val < 8",
+    "SELECT * FROM OneToTen WHERE val = 1 OR val = 2 OR val = 3",
+    "SELECT * FROM OneToTen WHERE (val = 1 OR val = 2) AND val != 3",
+    "SELECT * FROM OneToTen WHERE val IN (1, 2, 3, 4)",
+    "SELECT name FROM Process WHERE name LIKE 'py%'",
+    "SELECT DISTINCT name FROM Process LIMIT 5",
+    "SELECT * FROM OneToTen LIMIT 2, 3",
+    "SELECT a.val, b.val FROM OneToTen a, ThreeToSeven b WHERE a.val = b.val",
+    "SELECT * FROM OneToTen INNER JOIN ThreeToSeven ON OneToTen.val = ThreeToSeven.val",
+    "SELECT * FROM OneToTen LEFT OUTER JOIN ThreeToSeven ON OneToTen.val = ThreeToSeven.val",
+    "SELECT OneToTen.val AS v FROM OneToTen WHERE OneToTen.val >= '4'",
+]
+
+
+def child(mode):
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.dirname(here))
+
+    start = time.perf_counter()
+    from antlr4 import CommonTokenStream
+    from sqlhild import dfa_cache
+    from sqlhild import fastparse
+    from sqlhild.antlr2ra import (
+        CaseChangingCharStream,
+        MySqlLexer,
+        MySqlParser,
+        parse_tree,
+    )
+    import_time = time.perf_counter() - start
+
+    load_time = 0.0
+    if mode in ('cached', 'fast'):
+        start = time.perf_counter()
+        assert dfa_cache.load()
+        load_time = time.perf_counter() - start
+
+    def parse_ll(sql_text):
+        lexer = MySqlLexer(CaseChangingCharStream(sql_text))
+        return MySqlParser(CommonTokenStream(lexer)).root()
+
+    def parse_fast(sql_text):
+        try:
+            return fastparse.parse(sql_text)
+        except fastparse.Unsupported:
+            return parse_tree(sql_text)
+
+    parse = {
+        'll': parse_ll,
+        'sll': parse_tree,
+        'cached': parse_tree,
+        'fast': parse_fast,
+    }[mode]
+
+    timings = []
+    for sql_text in CORPUS:
+        start = time.perf_counter()
+        parse(sql_text)
+        timings.append(time.perf_counter() - start)
+
+    # A second pass shows the steady state once the DFA is warm
+    warm_timings = []
+    for sql_text in CORPUS:
+        start = time.perf_counter()
+        parse(sql_text)
+        warm_timings.append(time.perf_counter() - start)
+
+    print(json.dumps({
+        'import': import_time,
+        'load': load_time,
+        'cold': timings,
+        'warm': warm_timings,
+    }))
+
+
+def run(mode, env):
+    output = subprocess.check_output(
+        [sys.executable, __file__, '--child', mode], env=env)
+    return json.loads(output.decode())
+
+
+def ms(seconds):
+    return '{:8.1f}ms'.format(seconds * 1000)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = dict(os.environ)
+        env['SQLHILD_DFA_CACHE'] = os.path.join(tmp_dir, 'dfa.pickle')
+
+        # Build the DFA cache the same way `sqlhild --warm-parser` does
+        subprocess.check_call([sys.executable, '-c', (
+            'import sys; sys.path.insert(0, {!r});'
+            'from sqlhild import dfa_cache;'
+            'dfa_cache.warm(); dfa_cache.save()'
+        ).format(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))], env=env)
+
+        print('{:8} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+            'mode', 'load', 'first', 'cold p50', 'cold tot', 'warm p50'))
+        for mode in ('ll', 'sll', 'cached', 'fast'):
+            result = run(mode, env)
+            print('{:8} {} {} {} {} {}'.format(
+                mode,
+                ms(result['load']),
+                ms(result['cold'][0]),
+                ms(statistics.median(result['cold'])),
+                ms(sum(result['cold'])),
+                ms(statistics.median(result['warm'])),
+            ))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""Planning time benchmark.
+
+Measures how long the optimizer takes to rewrite queries with more and more
+predicates in their WHERE clause:
+
+  optimize     the compiled, memoized rewriter that sqlhild uses
+  replace_all  matchpy's replace_all with the same rules (how sqlhild used to
+               optimize). It's exponential in the number of predicates, so
+               it's only timed up to --replace-all-max predicates.
+
+Usage:
+  python benchmarks/planning.py [--replace-all-max N] [PREDICATES ...]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matchpy import replace_all  # noqa: E402
+
+from sqlhild import example  # noqa: E402,F401
+from sqlhild import relational_algebra_optimizers  # noqa: E402
+from sqlhild import sql2ra  # noqa: E402
+from sqlhild import table  # noqa: E402
+
+
+OPERATORS = ['val > {}', 'val < {}', 'val != {}']
+
+
+def query(predicates):
+    # The bounds don't contradict each other, otherwise the whole WHERE
+    # clause is planned away
+    values = [lambda i: i, lambda i: 1000 - i, lambda i: 500 + i]
+    return 'SELECT val FROM OneToTen WHERE ' + ' AND '.join(
+        OPERATORS[i % len(OPERATORS)].format(values[i % len(OPERATORS)](i))
+        for i in range(predicates))
+
+
+def timed(func, sql_text, repeat):
+    timings = []
+    for _ in range(repeat):
+        ra = sql2ra.sql2ra(sql_text, table)
+        start = time.perf_counter()
+        func(ra)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def ms(seconds):
+    if seconds is None:
+        return '{:>10}'.format('-')
+    return '{:8.1f}ms'.format(seconds * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('predicates', nargs='*', type=int, default=[1, 10, 100])
+    parser.add_argument('--replace-all-max', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print('{:>10} {:>10} {:>12}'.format('predicates', 'optimize', 'replace_all'))
+    for predicates in args.predicates:
+        sql_text = query(predicates)
+        optimize = timed(relational_algebra_optimizers.optimize, sql_text, args.repeat)
+        old = None
+        if predicates <= args.replace_all_max:
+            old = timed(
+                lambda ra: replace_all(ra, relational_algebra_optimizers.RULES),
+                sql_text, 1)
+        print('{:>10} {} {:>12}'.format(predicates, ms(optimize), ms(old)))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""CLI cold start benchmark.
+
+Runs `sqlhild` on a simple query in fresh processes and reports the median
+wall clock time. Exits with an error if the median is over the threshold.
+
+Usage:
+  python benchmarks/startup.py [--runs=<n>] [--threshold=<ms>]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+TABLES = '''
+from sqlhild.table import Table
+
+
+class Numbers(Table):
+    @property
+    def column_metadata(self):
+        return [('val', int)]
+
+    def produce(self):
+        return [(i,) for i in range(10)]
+'''
+
+QUERY = 'SELECT val FROM Numbers WHERE val > 7'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--threshold', type=float, default=200, help='milliseconds')
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tables = os.path.join(tmp_dir, 'tables.py')
+        with open(tables, 'w') as f:
+            f.write(TABLES)
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = root
+        env['SQLHILD_DFA_CACHE'] = os.path.join(tmp_dir, 'dfa.pickle')
+
+        def run():
+            subprocess.check_call(
+                [sys.executable, '-m', 'sqlhild', '-m', tables, QUERY],
+                cwd=tmp_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        # Warm up the filesystem cache and byte code
+        run()
+
+        timings = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - start) * 1000)
+
+    median = statistics.median(timings)
+    print('median {:.1f}ms min {:.1f}ms max {:.1f}ms (threshold {:.0f}ms)'.format(
+        median, min(timings), max(timings), args.threshold))
+
+    if args.threshold < median:
+        sys.exit('Cold start regressed')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,17 @@
 import logging
 
-from sqlhild.query import go
-from sqlhild.table import Table
-
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
 
 __all__ = ['Table', 'go', 'logger']
+
+
+def __getattr__(name):
+    # The query engine is slow to import and the daemon client doesn't need it
+    if name == 'go':
+        from sqlhild.query import go
+        return go
+    elif name == 'Table':
+        from sqlhild.table import Table
+        return Table
+    raise AttributeError("module 'sqlhild' has no attribute '{}'".format(name))
@@ -2,21 +2,33 @@
 """sqlhild.
 
 Usage:
-  sqlhild [-q -a -v --csv -m=<MODULES> -c=<CONFIG> --sqlite -O=<level>] <query>
-  sqlhild [-q -a -v --csv -m=<MODULES> -c=<CONFIG> -O=<level>] --file=<sqlfile>
+  sqlhild [-q -a -v --csv -m=<MODULES> -c=<CONFIG> --sqlite -O=<level>]
+          [-d --idle-timeout=<seconds> --trace-optimizer=<file>] <query>
+  sqlhild [-q -a -v --csv -m=<MODULES> -c=<CONFIG> -O=<level>]
+          [-d --idle-timeout=<seconds> --trace-optimizer=<file>] --file=<sqlfile>
   sqlhild --server HOST [-a -v -m=<MODULES> --show-ra]
+  sqlhild --warm-parser [-v --file=<sqlfile>]
+  sqlhild --daemon-serve [-v -c=<CONFIG> --idle-timeout=<seconds>]
+  sqlhild --stop-daemon
   sqlhild --help
   sqlhild --version
 
 Options:
-  -f --file=<sqlfile>        SQL file to parse.
+  -f --file=<sqlfile>        Run every statement in this SQL file.
   --csv                      Output CSV.
   -q --queryplan             Output queryplan.
   -a --dumpast               Output AST.
   -m --modules=<MODULES>     Import these modules.
   -O=<level>                 Optimization level [default: 5].
+  --trace-optimizer=<file>   Write the optimizer's rewrites as JSON, - is stderr.
   -c --config=<CONFIG>       Load config.
   -s --server HOST           Run as a server.
+  --warm-parser              Warm up and save the parser's DFA cache.
+  -d --daemon                Run in a background daemon, starting it if needed.
+                             Also enabled by $SQLHILD_DAEMON.
+  --idle-timeout=<seconds>   Stop the daemon when idle this long [default: 600].
+  --daemon-serve             Run as the daemon.
+  --stop-daemon              Stop the daemon.
   -l --log-level=<LOGLEVEL>  Set default log level.
   -v --verbose               Debug mode.
   -h --help                  Show this screen.
@@ -29,13 +41,11 @@ Options:
 import addict
 import docopt
 import importlib
+import importlib.util
 import logging
-import logging.config
 import os
 import sys
-import yaml
 
-from .query import go
 from . import logger
 
 
@@ -55,7 +65,11 @@ def load_modules(modules):
 
 
 def load_config(config_filename):
-    config = yaml.load(open(config_filename, 'r').read())
+    config_text = open(config_filename, 'r').read()
+
+    import logging.config
+    import yaml
+    config = yaml.load(config_text)
     try:
         logging.config.dictConfig(config['logging'])
     except KeyError:
@@ -86,22 +100,70 @@ def main():
     if args['--verbose']:
         logger.setLevel(level=logging.DEBUG)
 
+    if args['--daemon-serve']:
+        from . import daemon
+        daemon.serve(load_modules, idle_timeout=float(args['--idle-timeout']))
+        exit()
+
+    if args['--stop-daemon']:
+        from . import daemon
+        daemon.stop()
+        exit()
+
+    if args['--daemon'] or os.environ.get('SQLHILD_DAEMON'):
+        from . import daemon
+        modules = (args['--modules'] or '').split()
+        sys.exit(daemon.request(
+            {
+                'cwd': os.getcwd(),
+                # Module paths are relative to us, not the daemon
+                'modules': [os.path.abspath(m) if os.path.exists(m) else m for m in modules],
+                'optimization_level': args['-O'] or os.environ.get('SQLHILD_OPTIMIZATION_LEVEL', 5),
+                'query': args['<query>'],
+                'script': open(args['--file'], 'r').read() if args['--file'] else None,
+                'queryplan': bool(args['--queryplan']),
+                'dumpast': bool(args['--dumpast']),
+                'csv': bool(args['--csv']),
+                'sqlite': bool(args['--sqlite']),
+                'verbose': bool(args['--verbose']),
+                'trace_optimizer': args['--trace-optimizer'],
+            },
+            idle_timeout=float(args['--idle-timeout'] or daemon.IDLE_TIMEOUT),
+        ))
+
     if args['--modules']:
         load_modules(args['--modules'])
 
+    if args['--warm-parser']:
+        from . import dfa_cache
+        dfa_cache.warm()
+        if args['--file']:
+            dfa_cache.warm([open(args['--file'], 'r').read()])
+        logger.info('Saved DFA cache to {}'.format(dfa_cache.save()))
+        exit()
+
     if args['--server']:
         from sqlhild.postgres.server import start_server
         start_server(args['--server'])
         exit()
 
-    if args['--file']:
-        sql_text = open(args['--file'], 'r').read()
-    else:
-        sql_text = args['<query>']
-
     if args['-O']:
         os.environ['SQLHILD_OPTIMIZATION_LEVEL'] = args['-O']
 
+    from .query import go, go_script
+
+    if args['--file']:
+        go_script(
+            open(args['--file'], 'r').read(),
+            pretty_print=True,
+            queryplan=args['--queryplan'],
+            output_csv=args['--csv'],
+            trace_optimizer=args['--trace-optimizer'],
+        )
+        exit()
+
+    sql_text = args['<query>']
+
     go(
         sql_text,
         pretty_print=True,
@@ -109,6 +171,7 @@ def main():
         dumpast=args['--dumpast'],
         output_csv=args['--csv'],
         sqlite_run=args['--sqlite'],
+        trace_optimizer=args['--trace-optimizer'],
     )
 
 
@@ -0,0 +1,237 @@
+"""ANTLR parse tree to Relational Algebra.
+
+The generated MySQL lexer and parser take a long time to import, so this is
+only imported when fastparse can't handle a query.
+"""
+
+import logging
+
+from antlr4 import CommonTokenStream, InputStream, Token
+from antlr4.atn.PredictionMode import PredictionMode
+from antlr4.error.ErrorListener import ErrorListener
+from antlr4.error.ErrorStrategy import BailErrorStrategy, DefaultErrorStrategy
+from antlr4.error.Errors import ParseCancellationException
+
+from . import dfa_cache
+from .grammar.mysql.MySqlLexer import MySqlLexer
+from .grammar.mysql.MySqlParser import MySqlParser
+from .relational_algebra import (
+    BoolFalse,
+    BoolTrue,
+    Equal,
+    Function,
+    In,
+    Like,
+    List,
+    Null,
+    Number,
+    Select,
+    String,
+    exp2op,
+    value_set,
+)
+from .relational_algebra import Value as V
+from .sql2ra import convert_where, logical, string_value
+
+
+logger = logging.getLogger(__name__)
+
+_dfa_cache_loaded = False
+
+
+class MyErrorListener(ErrorListener):
+    def __init__(self):
+        super(MyErrorListener, self).__init__()
+
+    def syntaxError(self, recognizer, offendingSymbol, line, column, msg, e):
+        logger.error('{} {} {} {}'.format(line, column, msg, e))
+        raise SyntaxError('{line}:{column}\n\t{msg}\n\t{sql}\n\t{error_cursor}'.format(
+            line=line,
+            column=column,
+            msg=msg,
+            sql=e.input.getText(),
+            error_cursor=' ' * column + '^',
+            ))
+
+    # def reportAmbiguity(self, recognizer, dfa, startIndex, stopIndex, exact, ambigAlts, configs):
+    #     raise Exception()
+
+    # def reportAttemptingFullContext(self, recognizer, dfa, startIndex, stopIndex, conflictingAlts, configs):
+    #     raise Exception()
+
+    # def reportContextSensitivity(self, recognizer, dfa, startIndex, stopIndex, prediction, configs):
+    #     raise Exception()
+
+
+class CaseChangingCharStream(InputStream):
+    """
+    Allows grammar to parse case-insensitively
+    """
+    def LA(self, offset: int):
+        if offset == 0:
+            return 0  # undefined
+        if offset < 0:
+            offset += 1  # e.g., translate LA(-1) to use offset=0
+        pos = self._index + offset - 1
+        if pos < 0 or pos >= self._size:  # invalid
+            return Token.EOF
+        return ord(chr(self.data[pos]).upper())
+
+
+def parse_tree(sql_txt):
+    """
+    Parse SQL into an ANTLR parse tree
+
+    SLL prediction is much cheaper than full LL prediction and is enough for
+    nearly every query. If SLL fails we can't tell if it's a syntax error or
+    SLL wasn't powerful enough, so we reparse with LL, which also reports the
+    syntax error.
+    """
+    # The persisted DFA has to be loaded before the first parse
+    global _dfa_cache_loaded
+    if not _dfa_cache_loaded:
+        _dfa_cache_loaded = True
+        dfa_cache.load()
+
+    input = CaseChangingCharStream(sql_txt)
+    lexer = MySqlLexer(input)
+    stream = CommonTokenStream(lexer)
+    parser = MySqlParser(stream)
+    parser._interp.predictionMode = PredictionMode.SLL
+    parser._errHandler = BailErrorStrategy()
+    parser._listeners = []
+
+    try:
+        return parser.root()
+    except ParseCancellationException:
+        logger.debug('SLL parse failed, retrying with LL')
+
+    parser._errHandler = DefaultErrorStrategy()
+    parser._listeners = [MyErrorListener()]
+    parser._interp.predictionMode = PredictionMode.LL
+    parser.reset()
+    return parser.root()
+
+
+@convert_where.register
+def _(where: MySqlParser.BinaryComparasionPredicateContext, ctx):
+    left, op, right = where.getChildren()
+    func = exp2op(op.getText())
+    func = func(
+        convert_where(left, ctx),
+        convert_where(right, ctx),
+    )
+    return Select(ctx.relation, func)
+
+
+@convert_where.register
+def _(where: MySqlParser.PredicateExpressionContext, ctx):
+    return convert_where(where.predicate(), ctx)
+
+
+@convert_where.register
+def _(where: MySqlParser.ExpressionAtomPredicateContext, ctx):
+    return convert_where(where.expressionAtom(), ctx)
+
+
+@convert_where.register
+def _(where: MySqlParser.FullColumnNameExpressionAtomContext, ctx):
+    column = where.fullColumnName()
+    assert(isinstance(column, MySqlParser.FullColumnNameContext))
+    # HAVING can refer to the aliases of aggregates
+    if ctx.aggregates and column.getText() in ctx.aggregates:
+        return ctx.aggregates[column.getText()]
+    return ctx.instance._parse_column(column.getText(), ctx.relation)
+
+
+@convert_where.register
+def _(where: MySqlParser.FunctionCallExpressionAtomContext, ctx):
+    return convert_where(where.functionCall(), ctx)
+
+
+@convert_where.register
+def _(where: MySqlParser.AggregateFunctionCallContext, ctx):
+    if ctx.aggregates is None:
+        raise Exception('Invalid use of group function')
+    return ctx.instance._parse_aggregate_call(where)
+
+
+@convert_where.register
+def _(where: MySqlParser.ConstantExpressionAtomContext, ctx):
+    constant = where.constant()
+    if constant.decimalLiteral():
+        return Number(V(constant.getText()))
+
+    elif constant.stringLiteral():
+        return String(V(string_value(constant.getText())))
+
+    elif constant.booleanLiteral():
+        if constant.booleanLiteral().FALSE():
+            return BoolFalse()
+        elif constant.booleanLiteral().TRUE():
+            return BoolTrue()
+        else:
+            raise NotImplementedError
+
+    elif constant.nullLiteral:
+        return Null()
+    else:
+        raise NotImplementedError
+
+
+@convert_where.register
+def _(where: MySqlParser.LogicalExpressionContext, ctx):
+    left, right = where.expression()
+    if where.orLogicalOperator():
+        op = 'OR'
+    elif where.andLogicalOperator():
+        op = 'AND'
+    else:
+        raise NotImplementedError
+    return logical(op, convert_where(left, ctx), convert_where(right, ctx))
+
+
+@convert_where.register
+def _(where: MySqlParser.NestedExpressionAtomContext, ctx):
+    expression = where.expression()
+    assert(len(expression) == 1)
+    return convert_where(expression[0], ctx)
+
+
+@convert_where.register
+def _(where: MySqlParser.InPredicateContext, ctx):
+    """
+    X in (...)
+    """
+    left = convert_where(where.predicate(), ctx)
+    items = [
+        convert_where(exp, ctx)
+        for exp in where.expressions().expression()
+    ]
+    right = value_set(items)
+    if right is None:
+        right = List(*items)
+    return Select(ctx.relation, In(left, right))
+
+
+@convert_where.register
+def _(where: MySqlParser.LikePredicateContext, ctx):
+    """
+    eg. relname like '%'
+    """
+
+    left = convert_where(where.predicate()[0], ctx)
+    right = convert_where(where.predicate()[1], ctx)
+
+    # Optimization: If the right has no wildcard convert to Equal
+    if '%' not in right.val:
+        return Select(ctx.relation, Equal(left, right))
+
+    return Select(ctx.relation, Like(left, right))
+
+
+@convert_where.register
+def _(where: MySqlParser.ScalarFunctionCallContext, ctx):
+    func_name = where.scalarFunctionName().getText()
+    # TODO: parse args
+    return Function(String(V(func_name)))
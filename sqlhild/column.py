@@ -6,9 +6,8 @@ Responsible for managing columns inside a query plan.
 
 import ctypes
 import datetime
-import numpy
 import re
-import typeguard
+import sys
 
 from ctypes import Structure, c_int64
 
@@ -58,6 +57,12 @@ def columnidentifier_to_columnname(name):
     return name
 
 
+def _is_numpy_int64(provided_type):
+    # Don't import numpy for tables that don't use it
+    numpy = sys.modules.get('numpy')
+    return numpy is not None and provided_type is numpy.int64
+
+
 class DataType(object):
     def __init__(self, provided_type, length=None):
 
@@ -67,7 +72,7 @@ class DataType(object):
             length = 255
         elif provided_type is int:
             derived_name = 'int'
-        elif provided_type is numpy.int64:
+        elif _is_numpy_int64(provided_type):
             derived_name = 'int'
         elif provided_type is float:
             derived_name = 'float'
@@ -165,6 +170,7 @@ class ColumnRegistry(object):
             '_fields_': [(column.name, c_int64)] + list(self.row_struct._fields_)})
 
     def append(self, column_identifier, data_type: DataType):
+        import typeguard
         assert typeguard.check_argument_types()
 
         column = ColumnMetaData(column_identifier, data_type)
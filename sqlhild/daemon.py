@@ -0,0 +1,341 @@
+"""Background daemon.
+
+Keeps a warm sqlhild process behind a Unix socket so that CLI calls don't
+pay for starting the interpreter, loading modules and warming up the parser,
+plan cache and JIT every time.
+
+The client sends one JSON request per connection. The daemon streams back
+JSON lines with the stdout/stderr output of the query and finishes with the
+exit status.
+"""
+
+import contextlib
+import fcntl
+import importlib
+import importlib.util
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds without a request before the daemon exits
+IDLE_TIMEOUT = 600
+
+
+def default_path():
+    """
+    SQLHILD_DAEMON_SOCKET environment variable, otherwise the user's runtime
+    directory, or a private directory inside the temporary directory
+    """
+    try:
+        return os.environ['SQLHILD_DAEMON_SOCKET']
+    except KeyError:
+        pass
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or private_dir(
+        os.path.join(tempfile.gettempdir(), 'sqlhild-{}'.format(os.getuid())))
+    return os.path.join(runtime_dir, 'sqlhild-{}.sock'.format(os.getuid()))
+
+
+def private_dir(path):
+    """
+    Create a directory only this user can use. Other users can write to the
+    shared temporary directory, so they might have created it first.
+    """
+    with contextlib.suppress(FileExistsError):
+        os.mkdir(path, 0o700)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise PermissionError('{} is not a directory owned by this user'.format(path))
+    if st.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+
+def module_mtime(module_name):
+    """
+    Returns:
+        The modification time of the module's file, None if it doesn't have one
+    """
+    if os.path.exists(module_name):
+        return os.path.getmtime(module_name)
+    try:
+        spec = importlib.util.find_spec(module_name)
+    except (ImportError, ValueError):
+        return None
+    if spec and spec.origin and os.path.exists(spec.origin):
+        return os.path.getmtime(spec.origin)
+    return None
+
+
+class Stream(object):
+    """
+    File-like object that forwards what is written to the client
+    """
+    def __init__(self, wfile, name):
+        self.wfile = wfile
+        self.name = name
+
+    def write(self, text):
+        if text:
+            self.wfile.write(json.dumps({self.name: text}).encode('utf8') + b'\n')
+        return len(text)
+
+    def flush(self):
+        self.wfile.flush()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline().decode('utf8'))
+
+        if request.get('stop'):
+            self.server.idle = True
+            status = 0
+        else:
+            stderr = Stream(self.wfile, 'stderr')
+
+            # Log messages go to the client too
+            log_handler = logging.StreamHandler(stderr)
+            sqlhild_logger = logging.getLogger('sqlhild')
+            level = sqlhild_logger.level
+            sqlhild_logger.addHandler(log_handler)
+            sqlhild_logger.setLevel(logging.DEBUG if request.get('verbose') else logging.INFO)
+            try:
+                with contextlib.redirect_stdout(Stream(self.wfile, 'stdout')), \
+                        contextlib.redirect_stderr(stderr):
+                    status = self.server.run(request)
+            except BrokenPipeError:
+                logger.debug('Client went away')
+                return
+            finally:
+                sqlhild_logger.removeHandler(log_handler)
+                sqlhild_logger.setLevel(level)
+
+        self.wfile.write(json.dumps({'exit': status}).encode('utf8') + b'\n')
+
+
+class Daemon(socketserver.UnixStreamServer):
+    """
+    Runs queries for clients one at a time, until it has been idle for too long
+    """
+    def __init__(self, path, load_module, idle_timeout=IDLE_TIMEOUT):
+        self.load_module = load_module
+        self.timeout = idle_timeout
+        self.idle = False
+
+        # Module name to modification time at the time it was loaded
+        self.modules = {}
+
+        super().__init__(path, RequestHandler)
+
+    def handle_timeout(self):
+        self.idle = True
+
+    def serve_until_idle(self):
+        while not self.idle:
+            self.handle_request()
+
+    def load_modules(self, modules):
+        """
+        Load new modules and reload the ones that have changed since they
+        were loaded
+        """
+        modules = list(self.modules) + [m for m in modules if m not in self.modules]
+        for module_name in modules:
+            mtime = module_mtime(module_name)
+            if module_name in self.modules:
+                if self.modules[module_name] == mtime:
+                    continue
+                logger.debug('Reloading {}'.format(module_name))
+
+            if module_name in sys.modules:
+                importlib.reload(sys.modules[module_name])
+            else:
+                self.load_module(module_name)
+            self.modules[module_name] = mtime
+
+    def run(self, request):
+        """
+        Run the query like the CLI would
+
+        Returns:
+            The exit status
+        """
+        from .query import go, go_script
+
+        try:
+            os.chdir(request['cwd'])
+            os.environ['SQLHILD_OPTIMIZATION_LEVEL'] = str(request['optimization_level'])
+            self.load_modules(request['modules'])
+
+            if request.get('script') is not None:
+                go_script(
+                    request['script'],
+                    pretty_print=True,
+                    queryplan=request.get('queryplan'),
+                    output_csv=request.get('csv'),
+                    trace_optimizer=request.get('trace_optimizer'),
+                )
+            else:
+                go(
+                    request['query'],
+                    pretty_print=True,
+                    queryplan=request.get('queryplan'),
+                    dumpast=request.get('dumpast'),
+                    output_csv=request.get('csv'),
+                    sqlite_run=request.get('sqlite'),
+                    trace_optimizer=request.get('trace_optimizer'),
+                )
+        except Exception:
+            traceback.print_exc()
+            return 1
+        return 0
+
+
+def serve(load_module, path=None, idle_timeout=IDLE_TIMEOUT):
+    """
+    Run the daemon until it is idle
+
+    Returns:
+        False if another daemon is already serving on this path
+    """
+    path = path or default_path()
+
+    # The lock tells us if the socket belongs to a running daemon
+    lock = os.open(path + '.lock', os.O_WRONLY | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        logger.debug('Daemon already running on {}'.format(path))
+        os.close(lock)
+        return False
+
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+
+    from . import relational_algebra_optimizers
+    relational_algebra_optimizers.collect_rule_stats()
+
+    # Only this user can connect
+    umask = os.umask(0o177)
+    try:
+        server = Daemon(path, load_module, idle_timeout)
+    finally:
+        os.umask(umask)
+
+    logger.debug('Daemon listening on {}'.format(path))
+    try:
+        server.serve_until_idle()
+    finally:
+        os.unlink(path)
+        server.server_close()
+        os.close(lock)
+    return True
+
+
+def start(path, idle_timeout=IDLE_TIMEOUT):
+    """
+    Start a daemon in the background
+    """
+    env = dict(os.environ)
+    env['SQLHILD_DAEMON_SOCKET'] = path
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_dir, env.get('PYTHONPATH')]))
+
+    subprocess.Popen(
+        [sys.executable, '-m', 'sqlhild', '--daemon-serve',
+         '--idle-timeout={}'.format(idle_timeout)],
+        cwd='/',
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def connect(path, timeout=0):
+    """
+    Connect to the daemon, waiting up to timeout seconds for it to start
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+            return sock
+        except (FileNotFoundError, ConnectionRefusedError):
+            sock.close()
+            if deadline < time.monotonic():
+                raise
+        time.sleep(0.01)
+
+
+def send(sock, request):
+    """
+    Write the output of the request to stdout/stderr as it arrives
+
+    Returns:
+        The exit status, None if the daemon hung up without replying
+    """
+    with sock, sock.makefile('rwb') as f:
+        f.write(json.dumps(request).encode('utf8') + b'\n')
+        f.flush()
+        replied = False
+        for line in f:
+            replied = True
+            message = json.loads(line.decode('utf8'))
+            if 'exit' in message:
+                return message['exit']
+            for name, text in message.items():
+                getattr(sys, name).write(text)
+    if replied:
+        raise ConnectionError('Daemon hung up while running the query')
+    return None
+
+
+def request(request, path=None, idle_timeout=IDLE_TIMEOUT, start_timeout=10):
+    """
+    Run the request on the daemon, starting the daemon if it isn't running
+
+    Returns:
+        The exit status
+    """
+    path = path or default_path()
+
+    # The daemon might go idle just as we connect
+    for attempt in range(2):
+        try:
+            sock = connect(path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            start(path, idle_timeout)
+            sock = connect(path, timeout=start_timeout)
+
+        status = send(sock, request)
+        if status is not None:
+            return status
+
+    raise ConnectionError('Daemon hung up on {}'.format(path))
+
+
+def stop(path=None):
+    """
+    Returns:
+        False if no daemon was running
+    """
+    try:
+        sock = connect(path or default_path())
+    except (FileNotFoundError, ConnectionRefusedError):
+        return False
+    send(sock, {'stop': True})
+    return True
@@ -0,0 +1,203 @@
+"""ANTLR prediction DFA cache.
+
+ANTLR builds the DFA it uses for prediction lazily while it parses. A cold
+process pays for building it on every query shape it sees for the first time,
+which for the MySQL grammar is hundreds of milliseconds.
+
+The DFA can be warmed up with a corpus of representative queries and pickled
+to disk so that CLI invocations and fresh server processes start warm. It's
+loaded before the first ANTLR parse (see antlr2ra).
+
+The DFA refers to the ATN's states and a few runtime singletons that are
+compared by identity, so these are pickled as references instead of copies.
+"""
+
+import logging
+import os
+import pickle
+import sys
+import tempfile
+
+from antlr4.PredictionContext import PredictionContext
+from antlr4.atn.ATNSimulator import ATNSimulator
+from antlr4.atn.ATNState import ATNState
+from antlr4.atn.LexerATNSimulator import LexerATNSimulator
+from antlr4.atn.SemanticContext import SemanticContext
+
+from .grammar.mysql.MySqlLexer import MySqlLexer
+from .grammar.mysql.MySqlParser import MySqlParser
+
+
+logger = logging.getLogger(__name__)
+
+
+# Queries that cover the statement shapes we support
+WARMUP_QUERIES = [
+    "SELECT 1",
+    "SELECT 'a', 1, NULL",
+    "SELECT * FROM t",
+    "SELECT DISTINCT t.a FROM t",
+    "SELECT a, b FROM t WHERE a = 1",
+    "SELECT * FROM t WHERE a > 1 AND b < 2",
+    "SELECT * FROM t WHERE a >= 1 OR b <= 2 OR c != 3",
+    "SELECT * FROM t WHERE a = 'x' AND (b = 1 OR c = 2)",
+    "SELECT * FROM t WHERE a IN (1, 2, 3)",
+    "SELECT * FROM t WHERE a LIKE 'x%'",
+    "SELECT * FROM t WHERE a = TRUE OR b = FALSE",
+    "SELECT a FROM t LIMIT 1",
+    "SELECT a FROM t LIMIT 1, 2",
+    "SELECT a FROM t LIMIT 1 OFFSET 2",
+    "SELECT t.a AS x FROM t AS s",
+    "SELECT * FROM t1, t2 WHERE t1.a = t2.a",
+    "SELECT * FROM t1 INNER JOIN t2 ON t1.a = t2.a",
+    "SELECT * FROM t1 JOIN t2 ON t1.a = t2.a WHERE t1.b > 3",
+    "SELECT * FROM t1 LEFT OUTER JOIN t2 ON t1.a = t2.a",
+    "SELECT * FROM t1 RIGHT JOIN t2 ON t1.a = t2.a",
+    "SELECT COUNT(*) FROM t",
+    "SELECT a, COUNT(b) FROM t GROUP BY a HAVING COUNT(b) > 1",
+    "SELECT a FROM t ORDER BY a DESC, b",
+    "SELECT `a` FROM `t` WHERE `a` = \"x\";",
+]
+
+
+_singletons = {
+    'SemanticContext.NONE': SemanticContext.NONE,
+    'ATNSimulator.ERROR': ATNSimulator.ERROR,
+    'LexerATNSimulator.ERROR': LexerATNSimulator.ERROR,
+    'PredictionContext.EMPTY': PredictionContext.EMPTY,
+}
+
+_singleton_ids = {id(obj): name for name, obj in _singletons.items()}
+
+_atns = {
+    'parser': MySqlParser.atn,
+    'lexer': MySqlLexer.atn,
+}
+
+
+def default_path():
+    """
+    SQLHILD_DFA_CACHE environment variable, otherwise the user's cache directory
+    """
+    try:
+        return os.environ['SQLHILD_DFA_CACHE']
+    except KeyError:
+        pass
+    cache_dir = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(cache_dir, 'sqlhild', 'mysql_dfa.pickle')
+
+
+def signature():
+    """
+    A cache is only valid for the grammar and runtime it was made with
+    """
+    return (
+        sys.version_info[:2],
+        MySqlParser.grammarFileName,
+        len(MySqlParser.atn.states),
+        len(MySqlParser.decisionsToDFA),
+        len(MySqlLexer.atn.states),
+        len(MySqlLexer.decisionsToDFA),
+    )
+
+
+class _DFAPickler(pickle.Pickler):
+    def persistent_id(self, obj):
+        try:
+            return _singleton_ids[id(obj)]
+        except KeyError:
+            pass
+        if isinstance(obj, ATNState):
+            for name, atn in _atns.items():
+                if obj.atn is atn:
+                    return (name, obj.stateNumber)
+        return None
+
+
+class _DFAUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        if isinstance(pid, str):
+            return _singletons[pid]
+        name, state_number = pid
+        return _atns[name].states[state_number]
+
+
+def warm(queries=WARMUP_QUERIES):
+    """
+    Grow the DFA by parsing these queries
+    """
+    from .antlr2ra import parse_tree
+
+    for sql_text in queries:
+        try:
+            parse_tree(sql_text)
+        except SyntaxError:
+            logger.warning('Unable to warm up with: {}'.format(sql_text))
+
+
+def save(path=None):
+    """
+    Persist the DFA. The file is replaced atomically so that concurrent
+    readers never see a partial file.
+    """
+    path = path or default_path()
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+
+    # The DFA is a deeply linked graph
+    recursion_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(recursion_limit, 100000))
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickler = _DFAPickler(f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickler.dump((
+                    signature(),
+                    MySqlParser.decisionsToDFA,
+                    MySqlLexer.decisionsToDFA,
+                ))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+
+    logger.debug('Saved DFA cache to {}'.format(path))
+    return path
+
+
+def load(path=None):
+    """
+    Replace the DFA with a persisted one. This should be done before
+    parsing anything, otherwise the states built up so far are lost.
+
+    Returns:
+        True if the cache was loaded
+    """
+    path = path or default_path()
+
+    recursion_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(recursion_limit, 100000))
+    try:
+        with open(path, 'rb') as f:
+            cache_signature, parser_dfa, lexer_dfa = _DFAUnpickler(f).load()
+    except FileNotFoundError:
+        return False
+    except Exception as e:
+        logger.warning('Unable to load DFA cache {}: {}'.format(path, e))
+        return False
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+
+    if cache_signature != signature():
+        logger.warning('Ignoring stale DFA cache {}'.format(path))
+        return False
+
+    # The simulators hold references to these lists
+    MySqlParser.decisionsToDFA[:] = parser_dfa
+    MySqlLexer.decisionsToDFA[:] = lexer_dfa
+
+    logger.debug('Loaded DFA cache from {}'.format(path))
+    return True
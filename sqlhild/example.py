@@ -4,10 +4,21 @@ from . import table
 
 
 class Process(table.Table):
+    attrs = ['pid', 'name', 'username', 'status']
+
+    @property
+    def column_metadata(self):
+        return [('pid', int), ('name', str), ('username', str), ('status', str)]
+
+    def push_down_columns(self, columns):
+        # Each attribute is another lookup in /proc
+        self.attrs = [name for name in Process.attrs if name in columns]
+
     def produce(self):
         import psutil
-        return [p.as_dict(attrs=['pid', 'name', 'username', 'status'])
-                for p in psutil.process_iter()]
+        for p in psutil.process_iter():
+            row = p.as_dict(attrs=self.attrs)
+            yield tuple(row.get(name) for name in Process.attrs)
 
 
 class Users(table.Table):
@@ -24,6 +35,7 @@ class DiskPartitions(table.Table):
 
 class TestA(table.Table):
     sorted = True
+    sort_order = ['id']
     tuples = True
 
     @property
@@ -39,6 +51,7 @@ class TestA(table.Table):
 
 class TestC(table.Table):
     sorted = True
+    sort_order = ['val']
     tuples = True
 
     @property
@@ -56,6 +69,7 @@ class TestC(table.Table):
 
 class TestD(table.Table):
     sorted = True
+    sort_order = ['val']
 
     @property
     def column_metadata(self):
@@ -76,6 +90,7 @@ class TestD(table.Table):
 
 class TestB(table.Table):
     sorted = True
+    sort_order = ['id']
 
     @property
     def column_metadata(self):
@@ -90,6 +105,7 @@ class TestB(table.Table):
 
 class ThreeToSeven(table.Table):
     sorted = True
+    sort_order = ['val']
 
     @property
     def column_metadata(self):
@@ -101,6 +117,7 @@ class ThreeToSeven(table.Table):
 
 class OneToTen(table.Table):
     sorted = True
+    sort_order = ['val']
 
     @property
     def column_metadata(self):
@@ -112,6 +129,7 @@ class OneToTen(table.Table):
 
 class TwoToTwentyInTwos(table.Table):
     sorted = True
+    sort_order = ['val']
 
     @property
     def column_metadata(self):
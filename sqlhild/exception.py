@@ -38,3 +38,11 @@ class JoinHasNoOnClause(Exception):
     Example: from a inner join b
     """
     pass
+
+
+class NotGrouped(Exception):
+    """
+    A column is selected alongside aggregates without being grouped by
+    Example: select name, count(*) from a
+    """
+    pass
@@ -0,0 +1,414 @@
+"""Fast path SQL parser.
+
+A small recursive descent parser for the common subset of SELECT:
+
+    SELECT [DISTINCT] *|columns|constants|aggregates
+    FROM t [AS a] [, ...] [[INNER|CROSS|{LEFT|RIGHT|FULL} [OUTER]] JOIN u ON x = y ...]
+    WHERE comparisons, IN lists and TRUE/FALSE combined with AND, OR and parentheses
+    GROUP BY columns
+    HAVING like WHERE, with aggregates
+    ORDER BY columns|aggregates [ASC|DESC] [NULLS FIRST|NULLS LAST]
+    LIMIT n [, m | OFFSET m]
+
+This only checks syntax and builds a small tree, sql2ra turns it into the
+same Relational Algebra as the ANTLR parse tree. Anything outside of the
+subset raises Unsupported so that the caller can fall back to ANTLR, which
+also takes care of reporting syntax errors.
+
+FULL [OUTER] JOIN and NULLS FIRST/LAST aren't MySQL, so they're only
+understood here.
+
+The tokens follow MySqlLexer. Identifiers that are keywords to MySqlLexer
+aren't supported, even if MySqlParser would accept them as identifiers.
+"""
+
+import collections
+import os
+import re
+
+
+class Unsupported(Exception):
+    """
+    The query is outside of what the fast path understands
+    """
+    pass
+
+
+ColumnRef = collections.namedtuple('ColumnRef', ['text'])
+Constant = collections.namedtuple('Constant', ['kind', 'text'])
+Comparison = collections.namedtuple('Comparison', ['op', 'left', 'right'])
+InList = collections.namedtuple('InList', ['left', 'items'])
+# An IN list of only literals, its numbers as ints and the text of its strings
+InValues = collections.namedtuple('InValues', ['left', 'numbers', 'strings'])
+Logical = collections.namedtuple('Logical', ['op', 'left', 'right'])
+TableRef = collections.namedtuple('TableRef', ['name', 'alias'])
+JoinRef = collections.namedtuple('JoinRef', ['kind', 'table', 'left', 'right'])
+StarElement = collections.namedtuple('StarElement', ['alias'])
+# nulls_first is None unless NULLS FIRST or NULLS LAST is given
+SortRef = collections.namedtuple('SortRef', ['column', 'descending', 'nulls_first'])
+# COUNT(*) has no column
+AggregateRef = collections.namedtuple('AggregateRef', ['function', 'distinct', 'column'])
+# An aggregate in the SELECT list with its alias, if any
+AggregateElement = collections.namedtuple('AggregateElement', ['aggregate', 'alias'])
+Query = collections.namedtuple('Query', [
+    'distinct',
+    'elements',
+    'tables',
+    'joins',
+    'where',
+    'group_by',
+    'having',
+    'order_by',
+    'limit',
+])
+
+
+_token_re = re.compile(r"""
+    (?P<space>[ \t\r\n]+)
+    # Identifiers can't be directly followed by a quote, eg. X'1F' or _utf8'a'
+    |(?P<name>(?:[A-Za-z_$][\w$]*|`[^`]+`)(?:\.(?:[A-Za-z_$][\w$]*|`[^`]+`))*)(?![\w$'"`])
+    # MySqlLexer reads 1abc as an identifier and 1.5 as a real
+    |(?P<number>\d+)(?![\w$.])
+    |(?P<string>'(?:[^'\\\n]|\\[^\n]|'')*')
+    |(?P<op><=|>=|!=|[=<>(),*;.])
+    """, re.VERBOSE | re.ASCII)
+
+# The same literals as the number and string tokens, the string's loop is
+# unrolled as it's a lot faster on long lists
+_literal = r"""(\d+)(?![\w$.])|('[^'\\\n]*(?:(?:\\[^\n]|'')[^'\\\n]*)*')"""
+
+# An IN list of literals is a single token, as lists can be very long.
+# Lists of numbers are the most common and can be checked a lot faster.
+_numbers_re = re.compile(r'\([0-9, \t\r\n]*\)')
+_values_re = re.compile(
+    r"""\([ \t\r\n]*(?:{0})(?:[ \t\r\n]*,[ \t\r\n]*(?:{0}))*[ \t\r\n]*\)""".format(_literal),
+    re.ASCII)
+_literal_re = re.compile(_literal, re.ASCII)
+
+_comparison_ops = {'=', '<', '>', '<=', '>=', '!='}
+
+_aggregate_functions = {'AVG', 'COUNT', 'MAX', 'MIN', 'SUM'}
+
+_keywords = None
+
+
+def keywords():
+    """
+    Words that MySqlLexer turns into keyword tokens
+    """
+    global _keywords
+    if _keywords is None:
+        path = os.path.join(os.path.dirname(__file__), 'grammar', 'mysql', 'MySqlLexer.tokens')
+        with open(path, 'r') as f:
+            _keywords = frozenset(re.findall(r"^'([A-Z_][A-Z_0-9]*)'=", f.read(), re.MULTILINE))
+    return _keywords
+
+
+def tokenize(sql_txt):
+    """
+    Returns:
+        A list of (kind, text) tuples
+    """
+    tokens = []
+    pos = 0
+    while pos < len(sql_txt):
+        if tokens and tokens[-1] == ('keyword', 'IN'):
+            match = _numbers_re.match(sql_txt, pos) or _values_re.match(sql_txt, pos)
+            if match:
+                pos = match.end()
+                tokens.append(('values', match.group()))
+                continue
+
+        match = _token_re.match(sql_txt, pos)
+        if not match:
+            raise Unsupported(sql_txt[pos:])
+        pos = match.end()
+
+        kind = match.lastgroup
+        text = match.group()
+        if kind == 'space':
+            continue
+
+        if kind == 'name':
+            first = text.split('.')[0]
+            if not first.startswith('`') and first.upper() in keywords():
+                if text != first:
+                    raise Unsupported(text)
+                kind = 'keyword'
+                text = text.upper()
+
+        tokens.append((kind, text))
+
+    tokens.append(('eof', ''))
+    return tokens
+
+
+class Parser(object):
+    def __init__(self, sql_txt):
+        self.tokens = tokenize(sql_txt)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos]
+
+    def next(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def accept(self, kind, text=None):
+        token = self.tokens[self.pos]
+        if token[0] == kind and (text is None or token[1] == text):
+            self.pos += 1
+            return token
+        return None
+
+    def expect(self, kind, text=None):
+        token = self.accept(kind, text)
+        if not token:
+            raise Unsupported(self.peek())
+        return token
+
+    def name(self, max_parts=2):
+        text = self.expect('name')[1]
+        if max_parts < len(text.split('.')):
+            raise Unsupported(text)
+        return text
+
+    def alias(self):
+        """
+        [AS] uid
+        """
+        if self.accept('keyword', 'AS'):
+            return self.name(max_parts=1)
+        if self.peek()[0] == 'name':
+            return self.name(max_parts=1)
+        return ''
+
+    def query(self):
+        self.expect('keyword', 'SELECT')
+
+        distinct = bool(self.accept('keyword', 'DISTINCT'))
+
+        elements = []
+        if not self.accept('op', '*'):
+            elements.append(self.select_element())
+            while self.accept('op', ','):
+                elements.append(self.select_element())
+
+        tables = []
+        joins = []
+        where = None
+        if self.accept('keyword', 'FROM'):
+            tables.append(self.table())
+            joins.extend(self.joins())
+            while self.accept('op', ','):
+                tables.append(self.table())
+
+                # sql2ra only looks at the JOINs of the first table
+                if self.joins():
+                    raise Unsupported('JOIN')
+
+            if self.accept('keyword', 'WHERE'):
+                where = self.expression()
+
+        group_by = []
+        if self.accept('keyword', 'GROUP'):
+            self.expect('keyword', 'BY')
+            group_by.append(self.name())
+            while self.accept('op', ','):
+                group_by.append(self.name())
+
+        having = None
+        if self.accept('keyword', 'HAVING'):
+            having = self.expression()
+
+        order_by = []
+        if self.accept('keyword', 'ORDER'):
+            self.expect('keyword', 'BY')
+            order_by.append(self.sort_key())
+            while self.accept('op', ','):
+                order_by.append(self.sort_key())
+
+        limit = []
+        if self.accept('keyword', 'LIMIT'):
+            limit.append(self.expect('number')[1])
+            if self.accept('op', ','):
+                limit.append(self.expect('number')[1])
+            elif self.accept('keyword', 'OFFSET'):
+                # Same order as LIMIT offset, limit
+                limit.insert(0, self.expect('number')[1])
+
+        self.accept('op', ';')
+        self.expect('eof')
+
+        return Query(distinct, elements, tables, joins, where, group_by, having, order_by, limit)
+
+    def sort_key(self):
+        column = self.aggregate() if self.at_aggregate() else self.name()
+        descending = bool(self.accept('keyword', 'DESC'))
+        if not descending:
+            self.accept('keyword', 'ASC')
+
+        nulls_first = None
+        if self.peek()[0] == 'name' and self.peek()[1].upper() == 'NULLS':
+            self.next()
+            if self.accept('keyword', 'FIRST'):
+                nulls_first = True
+            else:
+                self.expect('keyword', 'LAST')
+                nulls_first = False
+        return SortRef(column, descending, nulls_first)
+
+    def at_aggregate(self):
+        kind, text = self.peek()
+        return kind == 'keyword' and text in _aggregate_functions and self.tokens[self.pos + 1] == ('op', '(')
+
+    def aggregate(self):
+        """
+        COUNT(*) or FUNCTION([DISTINCT|ALL] column)
+        """
+        function = self.next()[1]
+        self.expect('op', '(')
+        if function == 'COUNT' and self.accept('op', '*'):
+            self.expect('op', ')')
+            return AggregateRef(function, False, None)
+        distinct = bool(self.accept('keyword', 'DISTINCT'))
+        if not distinct:
+            self.accept('keyword', 'ALL')
+        column = self.name()
+        self.expect('op', ')')
+        return AggregateRef(function, distinct, column)
+
+    def select_element(self):
+        if self.at_aggregate():
+            return AggregateElement(self.aggregate(), self.alias())
+        elif self.peek()[0] == 'name':
+            text = self.name()
+            if self.accept('op', '.'):
+                self.expect('op', '*')
+                if '.' in text:
+                    raise Unsupported(text)
+                return StarElement(text)
+            element = ColumnRef(text)
+        else:
+            element = self.constant()
+
+        # Aliases are ignored by sql2ra
+        self.alias()
+        return element
+
+    def table(self):
+        name = self.name()
+        return TableRef(name, self.alias())
+
+    def joins(self):
+        joins = []
+        while True:
+            if self.accept('keyword', 'JOIN'):
+                kind = 'INNER'
+            elif self.peek() in (('keyword', 'INNER'), ('keyword', 'CROSS')):
+                kind = self.next()[1]
+                self.expect('keyword', 'JOIN')
+            elif self.peek() in (('keyword', 'LEFT'), ('keyword', 'RIGHT'), ('keyword', 'FULL')):
+                kind = self.next()[1]
+                self.accept('keyword', 'OUTER')
+                self.expect('keyword', 'JOIN')
+            else:
+                return joins
+
+            table = self.table()
+
+            # sql2ra treats a JOIN without ON (or a complicated ON) as a cross
+            # join that doesn't chain onto the next JOIN, leave those to ANTLR
+            self.expect('keyword', 'ON')
+            left = self.name()
+            self.expect('op', '=')
+            right = self.name()
+            joins.append(JoinRef(kind, table, left, right))
+
+    def expression(self):
+        """
+        AND binds tighter than OR, both are left associative
+        """
+        left = self.and_expression()
+        while self.accept('keyword', 'OR'):
+            left = Logical('OR', left, self.and_expression())
+        return left
+
+    def and_expression(self):
+        left = self.primary()
+        while self.accept('keyword', 'AND'):
+            left = Logical('AND', left, self.primary())
+        return left
+
+    def primary(self):
+        if self.accept('op', '('):
+            expression = self.expression()
+            self.expect('op', ')')
+            return expression
+
+        left = self.atom()
+
+        if self.accept('keyword', 'IN'):
+            values = self.accept('values')
+            if values:
+                return self.in_values(left, values[1])
+
+            self.expect('op', '(')
+            items = [self.atom()]
+            while self.accept('op', ','):
+                items.append(self.atom())
+            self.expect('op', ')')
+            return InList(left, items)
+
+        kind, op = self.peek()
+        if kind == 'op' and op in _comparison_ops:
+            self.next()
+            return Comparison(op, left, self.atom())
+
+        # eg. WHERE FALSE
+        if isinstance(left, Constant) and left.kind == 'bool':
+            return left
+
+        raise Unsupported(op)
+
+    def in_values(self, left, text):
+        if "'" not in text:
+            try:
+                return InValues(left, list(map(int, text[1:-1].split(','))), [])
+            except ValueError:
+                # eg. (1,,2) or (1 2)
+                raise Unsupported(text)
+
+        literals = _literal_re.findall(text)
+        return InValues(
+            left,
+            [int(number) for number, _ in literals if number],
+            [string for _, string in literals if string])
+
+    def atom(self):
+        if self.peek()[0] == 'name':
+            return ColumnRef(self.name())
+        elif self.at_aggregate():
+            return self.aggregate()
+        return self.constant()
+
+    def constant(self):
+        kind, text = self.peek()
+        if kind in ('number', 'string'):
+            return Constant(*self.next())
+        elif (kind, text) in (('keyword', 'TRUE'), ('keyword', 'FALSE')):
+            return Constant('bool', self.next()[1])
+        raise Unsupported(text)
+
+
+def parse(sql_txt):
+    """
+    Returns:
+        The Query
+
+    Raises:
+        Unsupported: if the query isn't part of the fast path's subset
+    """
+    return Parser(sql_txt).query()
@@ -0,0 +1,422 @@
+"""Interval analysis.
+
+The comparisons of a column against literals (=, !=, <, <=, > and >=) that
+are ANDed together are combined into the interval of values that can pass
+all of them, eg.
+
+    val > 3 AND val <= 9 AND val > 5    is    5 < val <= 9
+    val > 5 AND val < 3                 is    false
+
+and the intervals of a column's ORed conditions are merged when they overlap,
+eg. val > 3 OR val < 7 is true.
+
+Literals that are only known when the query is run (ie. Params) are left
+alone by the optimizer, ra2iter checks them for contradictions once they're
+bound.
+"""
+
+from .relational_algebra import (
+    And,
+    BoolTrue,
+    Column,
+    Equal,
+    GreaterThan,
+    GreaterThanEqual,
+    LessThan,
+    LessThanEqual,
+    NotEqual,
+    Number,
+    Or,
+    String,
+    Value,
+    literal,
+)
+
+
+class Interval(object):
+    """
+    Values between low and high. None is unbounded.
+    """
+    def __init__(self, low=None, high=None, low_closed=True, high_closed=True):
+        self.low = low
+        self.high = high
+        self.low_closed = low_closed and low is not None
+        self.high_closed = high_closed and high is not None
+
+    @classmethod
+    def point(cls, value):
+        return cls(value, value)
+
+    @property
+    def empty(self):
+        if self.low is None or self.high is None:
+            return False
+        if self.low == self.high:
+            return not (self.low_closed and self.high_closed)
+        return self.high < self.low
+
+    @property
+    def unbounded(self):
+        return self.low is None and self.high is None
+
+    @property
+    def is_point(self):
+        return self.low_closed and self.high_closed and self.low == self.high
+
+    def __contains__(self, value):
+        if self.low is not None:
+            if value < self.low or (value == self.low and not self.low_closed):
+                return False
+        if self.high is not None:
+            if self.high < value or (value == self.high and not self.high_closed):
+                return False
+        return True
+
+    def intersection(self, other):
+        low, low_closed = _tighter(
+            (self.low, self.low_closed), (other.low, other.low_closed), lambda a, b: b < a)
+        high, high_closed = _tighter(
+            (self.high, self.high_closed), (other.high, other.high_closed), lambda a, b: a < b)
+        return Interval(low, high, low_closed, high_closed)
+
+    def union(self, other):
+        """
+        Returns:
+            None if there's a gap between the intervals
+        """
+        first, second = sorted([self, other], key=_low_key)
+        if first.high is not None and second.low is not None:
+            if first.high < second.low:
+                return None
+            if first.high == second.low and not (first.high_closed or second.low_closed):
+                return None
+        low, low_closed = first.low, first.low_closed
+        if second.low == low:
+            low_closed = low_closed or second.low_closed
+        high, high_closed = _looser(
+            (first.high, first.high_closed), (second.high, second.high_closed))
+        return Interval(low, high, low_closed, high_closed)
+
+    def __eq__(self, other):
+        return isinstance(other, Interval) and vars(self) == vars(other)
+
+    def __repr__(self):
+        return '{}{}, {}{}'.format(
+            '[' if self.low_closed else '(',
+            '-inf' if self.low is None else repr(self.low),
+            'inf' if self.high is None else repr(self.high),
+            ']' if self.high_closed else ')')
+
+
+def _tighter(a, b, is_tighter):
+    """
+    The tighter of two bounds, ie. (value, closed) pairs
+    """
+    if a[0] is None:
+        return b
+    if b[0] is None:
+        return a
+    if a[0] == b[0]:
+        return a[0], a[1] and b[1]
+    return a if is_tighter(a[0], b[0]) else b
+
+
+def _looser(a, b):
+    """
+    The looser of two upper bounds
+    """
+    if a[0] is None or b[0] is None:
+        return None, False
+    if a[0] == b[0]:
+        return a[0], a[1] or b[1]
+    return b if a[0] < b[0] else a
+
+
+def _low_key(interval):
+    # Unbounded sorts first
+    return (interval.low is not None, interval.low, not interval.low_closed)
+
+
+def plan_time_value(a):
+    """
+    Python value of a literal
+
+    Raises:
+        ValueError: a isn't a literal or it's a Param
+    """
+    if isinstance(a, (Number, String)) and isinstance(a.operands[0], Value):
+        if isinstance(a, Number):
+            return int(a.operands[0].val)
+        return a.operands[0].val
+    raise ValueError(a)
+
+
+# The interval that `column <op> value` allows
+_intervals = {
+    Equal: Interval.point,
+    LessThan: lambda v: Interval(high=v, high_closed=False),
+    LessThanEqual: lambda v: Interval(high=v),
+    GreaterThan: lambda v: Interval(low=v, low_closed=False),
+    GreaterThanEqual: lambda v: Interval(low=v),
+}
+
+# The operator when the literal is on the left, eg. 1 < x is x > 1
+_flipped = {
+    Equal: Equal,
+    NotEqual: NotEqual,
+    LessThan: GreaterThan,
+    LessThanEqual: GreaterThanEqual,
+    GreaterThan: LessThan,
+    GreaterThanEqual: LessThanEqual,
+}
+
+
+def comparison(conjunct, value_of):
+    """
+    Returns:
+        (operator, Column, value) of a comparison between a column and a
+        literal, None for anything else
+    """
+    operator = type(conjunct)
+    if operator not in _flipped:
+        return None
+    column, value = conjunct.operands
+    if not isinstance(column, Column):
+        column, value = value, column
+        operator = _flipped[operator]
+    if not isinstance(column, Column):
+        return None
+    try:
+        return operator, column, value_of(value)
+    except ValueError:
+        return None
+
+
+def column_intervals(conjuncts, value_of=plan_time_value):
+    """
+    The interval of each column that the ANDed conjuncts compare with
+    literals. A column is left out if it's compared with values that can't
+    be compared with each other.
+
+    Returns:
+        {Column: (Interval, [conjuncts it came from])}
+    """
+    found = {}
+    excluded = {}
+    incomparable = set()
+    for conjunct in conjuncts:
+        found_comparison = comparison(conjunct, value_of)
+        if found_comparison is None:
+            continue
+        operator, column, value = found_comparison
+        if operator is NotEqual:
+            excluded.setdefault(column, []).append((conjunct, value))
+            continue
+        if column in incomparable:
+            continue
+        interval, sources = found.get(column, (Interval(), []))
+        try:
+            interval = interval.intersection(_intervals[operator](value))
+        except TypeError:
+            incomparable.add(column)
+            found.pop(column, None)
+            continue
+        found[column] = (interval, sources + [conjunct])
+
+    intervals = {}
+    for column, (interval, sources) in found.items():
+        for conjunct, value in excluded.get(column, []):
+            try:
+                if interval.is_point and interval.low == value:
+                    interval = Interval(value, value, False, False)
+                elif value not in interval:
+                    # It can't be equal, it's outside the interval
+                    sources.append(conjunct)
+            except TypeError:
+                pass
+        intervals[column] = (interval, sources)
+    return intervals
+
+
+def conditions(column, interval):
+    """
+    The comparisons that check a value is in the interval
+    """
+    if interval.is_point:
+        return [Equal(column, literal(interval.low))]
+    comparisons = []
+    if interval.low is not None:
+        comparison = GreaterThanEqual if interval.low_closed else GreaterThan
+        comparisons.append(comparison(column, literal(interval.low)))
+    if interval.high is not None:
+        comparison = LessThanEqual if interval.high_closed else LessThan
+        comparisons.append(comparison(column, literal(interval.high)))
+    return comparisons
+
+
+def _conjunction(conjuncts):
+    """
+    The conjuncts ANDed, without making an And of fewer than two
+    """
+    if not conjuncts:
+        return BoolTrue()
+    if len(conjuncts) == 1:
+        return conjuncts[0]
+    return And(*conjuncts)
+
+
+def _disjunction(disjuncts):
+    """
+    The disjuncts ORed, without making an Or of fewer than two
+    """
+    if len(disjuncts) == 1:
+        return disjuncts[0]
+    return Or(*disjuncts)
+
+
+def simplify(condition):
+    """
+    Combine the comparisons in the condition
+
+    Returns:
+        The simplified condition, None if nothing can pass it. BoolTrue if
+        everything can.
+    """
+    if isinstance(condition, Or):
+        return _simplify_or(condition)
+    if isinstance(condition, And):
+        conjuncts = list(condition.operands)
+    else:
+        conjuncts = [condition]
+
+    changed = False
+    for i, conjunct in enumerate(conjuncts):
+        if isinstance(conjunct, Or):
+            simplified = _simplify_or(conjunct)
+            if simplified is None:
+                return None
+            changed = changed or simplified != conjunct
+            conjuncts[i] = simplified
+    conjuncts = [c for c in conjuncts if not isinstance(c, BoolTrue)]
+
+    for column, (interval, sources) in column_intervals(conjuncts).items():
+        if interval.empty:
+            return None
+        # Leave a column alone if there's nothing to combine, the literal's
+        # text might not be how literal() writes it
+        if len(sources) == 1:
+            continue
+        replacement = conditions(column, interval)
+        if len(replacement) == len(sources) and all(r in sources for r in replacement):
+            continue
+        conjuncts = [c for c in conjuncts if c not in sources] + replacement
+        changed = True
+
+    if not changed:
+        return condition
+    return _conjunction(conjuncts)
+
+
+def _interval_of(disjunct):
+    """
+    Returns:
+        (Column, Interval) if the disjunct only compares one column with
+        literals, None otherwise
+    """
+    conjuncts = disjunct.operands if isinstance(disjunct, And) else [disjunct]
+    intervals = column_intervals(conjuncts)
+    if len(intervals) != 1:
+        return None
+    [(column, (interval, sources))] = intervals.items()
+    if len(sources) != len(conjuncts):
+        return None
+    return column, interval
+
+
+def _simplify_or(condition):
+    disjuncts = []
+    changed = False
+    for disjunct in condition.operands:
+        simplified = simplify(disjunct)
+        if simplified is None:
+            changed = True
+            continue
+        if isinstance(simplified, BoolTrue):
+            return simplified
+        changed = changed or simplified != disjunct
+        disjuncts.append(simplified)
+
+    # Merge the overlapping intervals of each column
+    merged = {}
+    others = []
+    for disjunct in disjuncts:
+        found = _interval_of(disjunct)
+        if found is None:
+            others.append(disjunct)
+            continue
+        column, interval = found
+        merged.setdefault(column, []).append((interval, disjunct))
+
+    for column, intervals in merged.items():
+        if len(intervals) == 1:
+            others.append(intervals[0][1])
+            continue
+        try:
+            intervals = sorted(intervals, key=lambda i: _low_key(i[0]))
+        except TypeError:
+            others.extend(d for _, d in intervals)
+            continue
+        current, current_disjunct = intervals[0]
+        for interval, disjunct in intervals[1:]:
+            try:
+                union = current.union(interval)
+            except TypeError:
+                union = None
+            if union is None:
+                others.append(current_disjunct)
+                current, current_disjunct = interval, disjunct
+            elif union.unbounded:
+                # eg. x > 3 OR x < 7
+                return BoolTrue()
+            else:
+                current, current_disjunct = union, _conjunction(conditions(column, union))
+                changed = True
+        others.append(current_disjunct)
+
+    if not others:
+        return None
+    if not changed:
+        return condition
+    return _disjunction(others)
+
+
+# The interval that a table Predicate's operator allows
+_predicate_intervals = {
+    '=': Interval.point,
+    '<': _intervals[LessThan],
+    '<=': _intervals[LessThanEqual],
+    '>': _intervals[GreaterThan],
+    '>=': _intervals[GreaterThanEqual],
+}
+
+
+def predicate_intervals(predicates):
+    """
+    The interval of each column that table Predicates allow, for tables that
+    can seek, eg. a table sorted by a column can skip to the start of its
+    interval and stop at the end.
+
+    Returns:
+        {column name: Interval}, empty intervals mean no row can match
+    """
+    found = {}
+    for predicate in predicates:
+        try:
+            interval = _predicate_intervals[predicate.operator](predicate.value)
+        except KeyError:
+            continue
+        try:
+            found[predicate.column] = found.get(predicate.column, Interval()).intersection(interval)
+        except TypeError:
+            pass
+    return found
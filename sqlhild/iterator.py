@@ -3,15 +3,20 @@
 Iterators that are yielded from to derive rows from the query plan.
 """
 
+import bisect
+import collections
 import csv
 import functools
 import heapq
+import io
 import itertools
-import numba
+import logging
 import operator
+import os
+import pickle
+import tempfile
 
 from ctypes import pointer
-from terminaltables import GithubFlavoredMarkdownTable
 
 from . import function  # NOQA - called by generated functions
 from . import relational_algebra
@@ -20,6 +25,16 @@ from .exception import UnknownColumn
 from .utils import StructTuple, TupleTuple
 
 
+logger = logging.getLogger(__name__)
+
+# A column that rows are ordered by, by its position in the rows
+SortKey = collections.namedtuple('SortKey', ['index', 'descending'])
+
+# An aggregate function of a group's rows. column_identifier is None for
+# COUNT(*), identifier is the aggregate's column in the grouped rows.
+AggregateCall = collections.namedtuple('AggregateCall', ['function', 'column_identifier', 'distinct', 'identifier'])
+
+
 class Iterator(object):
     def __init__(self):
         self.sorted = False
@@ -31,10 +46,32 @@ class Iterator(object):
         self.columns = ColumnRegistry()
         self.seen = 0
 
+        # The SortKeys that rows come out in the order of
+        self.ordering = ()
+
     @property
     def label(self):
         return str(id(self))
 
+    def sort_keys(self, column_identifiers, descending=False):
+        return tuple(
+            SortKey(self.columns.get_column_idx_from_identifier(c), descending)
+            for c in column_identifiers)
+
+    def ordered_by(self, keys):
+        """
+        True if rows already come out in the order of the SortKeys
+        """
+        return tuple(self.ordering[:len(keys)]) == tuple(keys)
+
+    def grouped_by(self, indexes):
+        """
+        True if rows with the same values in these columns come out next to
+        each other
+        """
+        indexes = set(indexes)
+        return {key.index for key in self.ordering[:len(indexes)]} == indexes
+
     def set_sources(self, sources):
         table_names = set([s.table_name for s in sources if hasattr(s, 'table_name')])
         if len(table_names) == 1:
@@ -73,6 +110,13 @@ class Iterator(object):
             for s in self.sources:
                 s.finalize()
 
+    def close(self):
+        """
+        No more rows are wanted, stop the sources from producing them.
+        """
+        for s in getattr(self, 'sources', []):
+            s.close()
+
 
 class SingleSourceIterator(Iterator):
     def __init__(self, source):
@@ -80,6 +124,7 @@ class SingleSourceIterator(Iterator):
         self.set_sources([source])
         self.sorted = getattr(source, 'sorted', False)
         self.columns = source.columns.clone()
+        self.ordering = getattr(source, 'ordering', ())
 
 
 class Null(Iterator):
@@ -88,9 +133,11 @@ class Null(Iterator):
 
 
 class EmptySet(Iterator):
-    def __init__(self):
+    def __init__(self, columns=None):
         super(EmptySet, self).__init__()
         self.sorted = True
+        if columns is not None:
+            self.columns = columns
 
     def produce(self):
         return []
@@ -119,6 +166,7 @@ class Filter(Iterator):
         self.set_sources([source])
         self.sorted = getattr(self.sources[0], 'sorted', False)
         self.columns = self.sources[0].columns.clone()
+        self.ordering = self.sources[0].ordering
 
     def __repr__(self):
         return '{0}-{1}'.format(self.__class__.__name__, self.test)
@@ -180,29 +228,89 @@ class FuncBuilder(object):
 
 class HashJoin(Iterator):
     """
-    Joins 2 streams into 1
+    Equi-join 2 streams (with different columns) by holding the rows of one
+    of them, the build side, in a hash table and streaming the other past it.
+    Rows come out in the order of the streamed side.
 
-    The join uses the document ID
+    keep_left and keep_right keep the rows of that side that match nothing,
+    with NULLs for the other side's columns, for outer joins.
 
     See:
      - Sort vs. Hash Revisited: Fast Join Implementation on Modern Multi-Core CPUs, Changkyu Kim et all
     """
 
-    def __init__(self, a, b, column_a=0, column_b=0):
+    def __init__(self, a, b, col_identifier1, col_identifier2, build=1, keep_left=False, keep_right=False):
         super(HashJoin, self).__init__()
         self.set_sources([a, b])
-        assert a.columns == b.columns
-        self.columns = a.columns.clone()
-        self.column_a = column_b
-        self.sorted = all([source.sorted for source in self.sources])
+        self.columns = self.sources[0].columns + self.sources[1].columns
+        self.col_identifier1 = col_identifier1
+        self.col_identifier2 = col_identifier2
+        self.build = build
+        self.keep = (keep_left, keep_right)
+        self.sorted = self.sources[1 - build].sorted
+
+        # Unmatched build rows come out last, out of order
+        probe = self.sources[1 - build]
+        if not self.keep[build]:
+            offset = len(self.sources[0].columns) if build == 0 else 0
+            self.ordering = tuple(SortKey(k.index + offset, k.descending) for k in probe.ordering)
+
+    def pretty_print(self):
+        return '{0}\n {1} = {2}\n build: {3}\n {4}'.format(
+            self.__class__.__name__,
+            self.col_identifier1,
+            self.col_identifier2,
+            self.build,
+            self.seen,
+        )
 
     def produce(self):
-        ids = set()
-        for a in self.sources[0].produce():
-            ids.add(a[self.column_a])
-        for b in self.sources[1].produce():
-            if b[self.column_b] in ids:
-                yield b
+        build, probe = self.sources[self.build], self.sources[1 - self.build]
+        identifiers = (self.col_identifier1, self.col_identifier2)
+        build_idx = build.columns.get_column_idx_from_identifier(identifiers[self.build])
+        probe_idx = probe.columns.get_column_idx_from_identifier(identifiers[1 - self.build])
+        keep_build, keep_probe = self.keep[self.build], self.keep[1 - self.build]
+        build_nulls = tuple(None for _ in range(len(build.columns)))
+        probe_nulls = tuple(None for _ in range(len(probe.columns)))
+
+        if self.build:
+            def joined(probe_row, build_row):
+                return TupleTuple(probe_row, build_row)
+        else:
+            def joined(probe_row, build_row):
+                return TupleTuple(build_row, probe_row)
+
+        hashed = {}
+        # NULLs don't equal anything
+        unmatched = []
+        for row in build.produce():
+            key = row[build_idx]
+            if key is None:
+                unmatched.append(row)
+            else:
+                hashed.setdefault(key, []).append(row)
+
+        matched = set()
+        for row in probe.produce():
+            key = row[probe_idx]
+            rows = None if key is None else hashed.get(key)
+            if rows:
+                if keep_build:
+                    matched.add(key)
+                for build_row in rows:
+                    self.seen += 1
+                    yield joined(row, build_row)
+            elif keep_probe:
+                self.seen += 1
+                yield joined(row, build_nulls)
+
+        if keep_build:
+            for key, rows in hashed.items():
+                if key not in matched:
+                    unmatched.extend(rows)
+            for build_row in unmatched:
+                self.seen += 1
+                yield joined(probe_nulls, build_row)
 
 
 class HashFilter(Iterator):
@@ -247,6 +355,7 @@ class Cross(Iterator):
         self.set_sources([a, b])
         self.columns = a.columns + b.columns
         self.sorted = all([source.sorted for source in self.sources])
+        self.ordering = a.ordering
 
     def produce(self):
         bs = list(self.sources[1].produce())
@@ -366,6 +475,7 @@ class MergeJoin(Iterator):
 
         func = locals()[func_name]
 
+        import numba
         jitted_func = numba.jit()(func)
 
         self.cmp = jitted_func
@@ -412,6 +522,7 @@ class Idize(SingleSourceIterator):
         super(Idize, self).__init__(source)
         assert not source.has_column_identifier('id')
         self.columns.prepend(source.table_name + '.' + 'id', int)
+        self.ordering = (SortKey(0, False),)
 
     def produce(self):
         for i, row in enumerate(self.sources[0].produce()):
@@ -527,6 +638,14 @@ class SelectColumns(Iterator):
         self.columns = self.sources[0].columns.clone_only_these_columns(columns_to_filter_for)
         self.column_id_to_select = self.sources[0].columns.columnidentifiers_to_columnidxs(self.columns_to_filter_for)
 
+        # The source's order holds up to the first key that isn't selected
+        ordering = []
+        for key in self.sources[0].ordering:
+            if key.index not in self.column_id_to_select:
+                break
+            ordering.append(SortKey(self.column_id_to_select.index(key.index), key.descending))
+        self.ordering = tuple(ordering)
+
     def produce(self):
         try:
             for row in self.sources[0].produce():
@@ -653,7 +772,7 @@ class Distinct(SingleSourceIterator):
     """
     def __init__(self, source):
         super(Distinct, self).__init__(source)
-        assert(self.sorted)
+        assert(self.sorted or self.grouped_by(range(len(self.columns))))
         assert(len(self.sources) == 1)
 
     def produce(self):
@@ -667,6 +786,29 @@ class Distinct(SingleSourceIterator):
             previous_row = row
 
 
+class HashDistinct(SingleSourceIterator):
+    """
+    Only distinct rows, each one as soon as it's first seen
+    The rows seen so far are kept in a set, so they don't need to be sorted
+    """
+    def produce(self):
+        seen = set()
+        # Rows with unhashable values, eg. lists, are compared one by one
+        unhashable = []
+        for row in self.sources[0].produce():
+            key = tuple(row)
+            try:
+                if key in seen:
+                    continue
+                seen.add(key)
+            except TypeError:
+                if key in unhashable:
+                    continue
+                unhashable.append(key)
+            self.seen += 1
+            yield row
+
+
 class Limit(SingleSourceIterator):
     """
     Only first N rows
@@ -677,12 +819,25 @@ class Limit(SingleSourceIterator):
         assert(len(self.sources) == 1)
 
     def produce(self):
+        if self.limit <= 0:
+            self.close()
+            return
+
+        # Stop as soon as we have enough rows, pulling another one could mean
+        # fetching another page
+        rows = iter(self.sources[0].produce())
         count = 0
-        for row in self.sources[0].produce():
-            if self.limit <= count:
-                break
-            yield row
-            count += 1
+        try:
+            for row in rows:
+                yield row
+                count += 1
+                if self.limit <= count:
+                    break
+        finally:
+            if hasattr(rows, 'close'):
+                rows.close()
+        if self.limit <= count:
+            self.close()
 
 
 class Offset(SingleSourceIterator):
@@ -702,6 +857,94 @@ class Offset(SingleSourceIterator):
             count += 1
 
 
+# Rows a sort keeps in memory, past that it sorts them in runs spilled to
+# temporary files
+SORT_BUFFER_ROWS = int(os.environ.get('SQLHILD_SORT_BUFFER_ROWS', 1000000))
+
+# Runs merged at once, more are first merged into a single run
+SORT_MERGE_RUNS = 64
+
+# Rows pickled together in a run's file
+RUN_BATCH_ROWS = 1000
+
+
+def external_sort(rows, key=None, reverse=False, max_rows=None):
+    """
+    Yields the rows in the same order as sorted(rows, key=key, reverse=reverse).
+
+    Up to max_rows rows are sorted in memory. Past that each max_rows are
+    sorted into a run that is written to a temporary file in pickled batches,
+    and the runs are merged lazily. The files are closed when the sort ends,
+    fails or is closed early. Rows read back from a run are copies of the
+    originals, rows that can't be pickled are all sorted in memory.
+    """
+    max_rows = SORT_BUFFER_ROWS if max_rows is None else max_rows
+    runs = []
+    try:
+        spillable = True
+        buffer = []
+        for row in rows:
+            buffer.append(row)
+            if max_rows <= len(buffer) and spillable:
+                buffer.sort(key=key, reverse=reverse)
+                try:
+                    runs.append(_write_run(buffer))
+                except (pickle.PicklingError, TypeError, AttributeError, ValueError) as e:
+                    logger.warning('Rows of {} can\'t be spilled to disk: {}'.format(rows, e))
+                    spillable = False
+                    continue
+                buffer = []
+
+                if SORT_MERGE_RUNS <= len(runs):
+                    merged = heapq.merge(*[_read_run(run) for run in runs], key=key, reverse=reverse)
+                    run = _write_run(merged)
+                    for spilled in runs:
+                        spilled.close()
+                    runs = [run]
+
+        buffer.sort(key=key, reverse=reverse)
+        if not runs:
+            yield from buffer
+            return
+
+        # Ties come from the earliest run first, so the sort stays stable
+        yield from heapq.merge(*[_read_run(run) for run in runs], buffer, key=key, reverse=reverse)
+    finally:
+        for run in runs:
+            run.close()
+
+
+def _write_run(rows):
+    """
+    Returns:
+        A temporary file with the rows pickled in batches
+    """
+    run = tempfile.TemporaryFile(prefix='sqlhild-sort-')
+    try:
+        rows = iter(rows)
+        batch = list(itertools.islice(rows, RUN_BATCH_ROWS))
+        while batch:
+            pickle.dump(batch, run, protocol=pickle.HIGHEST_PROTOCOL)
+            batch = list(itertools.islice(rows, RUN_BATCH_ROWS))
+    except BaseException:
+        run.close()
+        raise
+    run.seek(0)
+    return run
+
+
+def _read_run(run):
+    """
+    Yields the rows of a run, a batch at a time
+    """
+    while True:
+        try:
+            batch = pickle.load(run)
+        except EOFError:
+            return
+        yield from batch
+
+
 class Sorted(SingleSourceIterator):
     """
     Sorted stream
@@ -709,24 +952,23 @@ class Sorted(SingleSourceIterator):
     def __init__(self, source):
         super(Sorted, self).__init__(source)
         self.sorted = True
-        self.heap = []
+        self.ordering = tuple(SortKey(i, False) for i in range(len(self.columns)))
 
     def produce(self):
-        for row in self.sources[0].produce():
-            heapq.heappush(self.heap, row)
-
-        for i in range(len(self.heap)):
-            yield heapq.heappop(self.heap)
+        yield from external_sort(self.sources[0].produce())
 
 
 class SortedById(SingleSourceIterator):
     """
     Sorted stream
+    Sorted in memory, as rows are compared by identity, which copies spilled
+    to disk wouldn't keep
     """
     def __init__(self, source):
         super().__init__(source)
         self.sorted = True
         self.heap = []
+        self.ordering = ()
 
     def produce(self):
         for row in self.sources[0].produce():
@@ -740,76 +982,279 @@ class SortedById(SingleSourceIterator):
             yield heapq.heappop(self.heap)[1]
 
 
+# Rows a shared scan keeps in memory before spooling them to a file
+BUFFER_ROWS = int(os.environ.get('SQLHILD_TEE_BUFFER_ROWS', 100000))
+
+
+class SharedScan(object):
+    """
+    The rows of one scan, read by several Tees at their own pace.
+
+    Rows are kept until every reader has read them. Past max_rows the oldest
+    are spooled to a temporary file in pickled batches, and readers that fall
+    behind replay them from there, so a reader that drains the scan before
+    the others start doesn't hold the whole table in memory. Rows replayed
+    from the file are copies of the originals.
+    """
+    def __init__(self, rows, max_rows=None):
+        self.rows = rows
+        self.max_rows = BUFFER_ROWS if max_rows is None else max_rows
+        self.trim_at = self.max_rows
+        self.spillable = True
+
+        # buffer[0] is the row at position start, the rows before it are
+        # spooled or have been read by everyone
+        self.buffer = []
+        self.start = 0
+        self.done = False
+        self.positions = {}
+        self.readers = itertools.count()
+
+        self.spool = None
+        self.batch_starts = []
+        self.batch_offsets = []
+
+    def reader(self):
+        assert self.start == 0 and not self.buffer
+        reader = next(self.readers)
+        self.positions[reader] = 0
+        return reader
+
+    def read(self, reader):
+        position = 0
+        batch, batch_start = (), 0
+        while reader in self.positions:
+            if position < self.start:
+                if not batch_start <= position < batch_start + len(batch):
+                    batch_start, batch = self._batch(position)
+                row = batch[position - batch_start]
+            elif position < self.start + len(self.buffer):
+                row = self.buffer[position - self.start]
+            elif self.done:
+                return
+            else:
+                try:
+                    row = next(self.rows)
+                except StopIteration:
+                    self.done = True
+                    return
+                self.buffer.append(row)
+            position += 1
+            self.positions[reader] = position
+            if self.trim_at < len(self.buffer):
+                self._trim()
+            yield row
+
+    def _trim(self):
+        """
+        Forget the rows every reader has read, and spool the oldest of the
+        rest if there are still too many
+        """
+        read = min(self.positions.values()) - self.start
+        if 0 < read:
+            del self.buffer[:read]
+            self.start += read
+
+        keep = self.max_rows // 2
+        if keep < len(self.buffer) and self.spillable:
+            self._spill(len(self.buffer) - keep)
+
+        # Rows that can't be spooled stay in memory, like itertools.tee
+        if self.max_rows < len(self.buffer):
+            self.trim_at = 2 * len(self.buffer)
+        else:
+            self.trim_at = self.max_rows
+
+    def _spill(self, count):
+        try:
+            data = pickle.dumps(self.buffer[:count], protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError, ValueError) as e:
+            logger.warning('Rows of {} can\'t be spooled to disk: {}'.format(self.rows, e))
+            self.spillable = False
+            return
+        if self.spool is None:
+            self.spool = tempfile.TemporaryFile(prefix='sqlhild-')
+        self.spool.seek(0, io.SEEK_END)
+        self.batch_starts.append(self.start)
+        self.batch_offsets.append(self.spool.tell())
+        self.spool.write(data)
+        del self.buffer[:count]
+        self.start += count
+
+    def _batch(self, position):
+        """
+        Returns:
+            (position of its first row, rows) of the spooled batch the row at
+            position is in
+        """
+        i = bisect.bisect_right(self.batch_starts, position) - 1
+        self.spool.seek(self.batch_offsets[i])
+        return self.batch_starts[i], pickle.load(self.spool)
+
+    def release(self, reader):
+        """
+        The reader doesn't want any more rows, the scan is stopped once no
+        reader is left
+        """
+        self.positions.pop(reader, None)
+        if not self.positions:
+            self.close()
+
+    def close(self):
+        if hasattr(self.rows, 'close'):
+            self.rows.close()
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+        self.buffer = []
+
+
 class Tee(Iterator):
     """
     Duplicate stream
     Used so that we don't scan a source table more than once
     """
-    def __init__(self, source=None, source_iterator=None):
+    def __init__(self, source=None, shared=None, max_rows=None):
         super(Tee, self).__init__()
         self.set_sources([source])
         self.sorted = True
         self.columns = self.sources[0].columns.clone()
+        self.ordering = self.sources[0].ordering
         self.heap = []
         self.teed = []
-        if source_iterator:
-            self.iter, self.original_iterator = itertools.tee(source_iterator)
-        else:
-            self.iter, self.original_iterator = itertools.tee(self.sources[0].produce())
+        if shared is None:
+            shared = SharedScan(self._scan(), max_rows)
+        self.shared = shared
+        self.reader = shared.reader()
+
+    def _scan(self):
+        # Don't start the scan until the rows are needed, a table can be told
+        # what to produce until every statement sharing it is planned
+        yield from self.sources[0].produce()
 
     def tee(self):
         assert self.seen == 0
-        tee = Tee(source=self, source_iterator=self.original_iterator)
+        tee = Tee(source=self, shared=self.shared)
         self.teed.append(tee)
         return tee
 
     def produce(self):
-        for i in self.iter:
+        for row in self.shared.read(self.reader):
             self.seen += 1
-            yield i
+            yield row
+
+    def close(self):
+        """
+        Only stop the scan if no other branch is reading from it
+        """
+        self.shared.release(self.reader)
+
+
+@functools.total_ordering
+class Descending(object):
+    """
+    Wraps a value so that it sorts in reverse, for the DESC columns of a key
+    that mixes directions
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
 
 
 class OrderBy(Iterator):
     """
-    Duplicate stream
+    Rows sorted by columns, spilling sorted runs to disk past
+    SORT_BUFFER_ROWS rows
     """
-    def __init__(self, source, column_identifiers):
+    def __init__(self, source, column_identifiers, descending=None, nulls_first=None):
         self.columns_to_order_by = column_identifiers
         super(OrderBy, self).__init__()
         self.set_sources([source])
         self.sorted = True
         self.columns = self.sources[0].columns.clone()
-        self.heap = []
 
         for ci in column_identifiers:
             if not self.columns.contains(ci):
                 raise Exception('{0} does not contain {1}'.format(self.columns.columns, ci))
 
+        # NULLs are smaller than any value by default
+        self.descending = list(descending or [False] * len(column_identifiers))
+        if nulls_first is None:
+            nulls_first = [not d for d in self.descending]
+        self.nulls_first = list(nulls_first)
+
+        self.ordering = tuple(
+            SortKey(key.index, desc)
+            for key, desc in zip(self.sort_keys(column_identifiers), self.descending))
+
     def __repr__(self):
         return '<{0}: {1}>'.format(self.__class__.__name__, self.columns_to_order_by)
 
     def pretty_print(self):
         return '{0}\n {1}'.format(self.__class__.__name__,  self.columns_to_order_by)
 
-    def produce(self):
-        column_id_to_select = [
-            self.sources[0].columns.get_column_idx_from_identifier(column_identifier)
-            for column_identifier in self.columns_to_order_by
-            ]
+    def sort_key(self):
+        """
+        Returns:
+            (key function, reverse) for sorting rows
+        """
+        indexes = [key.index for key in self.ordering]
+
+        # Flip the whole sort if every column is DESC, otherwise wrap the DESC
+        # columns
+        reverse = all(self.descending)
+        wrap = [d and not reverse for d in self.descending]
+
+        # NULLs go before or after the other values, so they're never compared
+        # with them
+        null_flags = [0 if first != reverse else 2 for first in self.nulls_first]
+
+        def key(row):
+            values = []
+            for i, wrapped, null_flag in zip(indexes, wrap, null_flags):
+                value = row[i]
+                if value is None:
+                    values.append((null_flag, None))
+                elif wrapped:
+                    values.append((1, Descending(value)))
+                else:
+                    values.append((1, value))
+            return tuple(values)
 
-        for row in self.sources[0].produce():
-            order_by_item = tuple(row[i] for i in column_id_to_select if row[i] is not None)
-            heapq.heappush(self.heap, (order_by_item, row))
+        return key, reverse
 
-        last = None
+    def produce(self):
+        key, reverse = self.sort_key()
+        for row in external_sort(self.sources[0].produce(), key=key, reverse=reverse):
+            self.seen += 1
+            yield row
 
-        for i in range(len(self.heap)):
-            k, row = heapq.heappop(self.heap)
 
-            if last:
-                assert last <= k
-            last = k
+class TopN(OrderBy):
+    """
+    The first N rows in order, kept in a bounded heap so only N rows are
+    held at a time
+    """
+    def __init__(self, source, column_identifiers, limit, descending=None, nulls_first=None):
+        super(TopN, self).__init__(source, column_identifiers, descending, nulls_first)
+        self.limit = limit
+
+    def pretty_print(self):
+        return '{0}\n {1}\n {2}'.format(self.__class__.__name__, self.columns_to_order_by, self.limit)
 
+    def produce(self):
+        key, reverse = self.sort_key()
+        # Both are stable, like sorted(rows, key=key, reverse=reverse)[:limit]
+        first = heapq.nlargest if reverse else heapq.nsmallest
+        for row in first(self.limit, self.sources[0].produce(), key=key):
+            self.seen += 1
             yield row
 
 
@@ -835,6 +1280,10 @@ class InnerMerge(Iterator):
         self.col_identifier2 = col_identifier2
 
         self.seen = 0
+        self.ordering = self._ordering()
+
+    def _ordering(self):
+        return self.sources[0].sort_keys([self.col_identifier1])
 
     def _get_next(self, it):
         try:
@@ -852,8 +1301,8 @@ class InnerMerge(Iterator):
 
     def produce(self):
         # TODO: pre-allocate space for new rows
-        _a = self.sources[0].produce()
-        _b = self.sources[1].produce()
+        _a = iter(self.sources[0].produce())
+        _b = iter(self.sources[1].produce())
         a = self._get_next(_a)
         b = self._get_next(_b)
         col_idx1 = self.sources[0].columns.get_column_idx_from_identifier(self.col_identifier1)
@@ -913,8 +1362,8 @@ class LeftMerge(InnerMerge):
 
     def produce(self):
         # TODO: pre-allocate space for new rows
-        _a = self.sources[0].produce()
-        _b = self.sources[1].produce()
+        _a = iter(self.sources[0].produce())
+        _b = iter(self.sources[1].produce())
         a = self._get_next(_a)
         b = self._get_next(_b)
         col_idx1 = self.sources[0].columns.get_column_idx_from_identifier(self.col_identifier1)
@@ -950,16 +1399,25 @@ class LeftMerge(InnerMerge):
                 a = self._get_next(_a)
                 b = self._get_next(_b)
 
+        while a:
+            self.seen += 1
+            yield TupleTuple(a, right_empty_tuple)
+            a = self._get_next(_a)
+
 
 class RightMerge(InnerMerge):
     """
     This is for RIGHT OUTER JOIN.
     """
 
+    def _ordering(self):
+        [key] = self.sources[1].sort_keys([self.col_identifier2])
+        return (SortKey(len(self.sources[0].columns) + key.index, key.descending),)
+
     def produce(self):
         # TODO: pre-allocate space for new rows
-        _a = self.sources[0].produce()
-        _b = self.sources[1].produce()
+        _a = iter(self.sources[0].produce())
+        _b = iter(self.sources[1].produce())
         a = self._get_next(_a)
         b = self._get_next(_b)
         col_idx1 = self.sources[0].columns.get_column_idx_from_identifier(self.col_identifier1)
@@ -971,7 +1429,7 @@ class RightMerge(InnerMerge):
             if a[col_idx1] < b[col_idx2]:
                 a = self._get_next(_a)
             elif a[col_idx1] > b[col_idx2]:
-                yield b
+                yield TupleTuple(left_empty_tuple, b)
                 self.seen += 1
                 b = self._get_next(_b)
             else:
@@ -1033,6 +1491,8 @@ class TableOutput(SingleSourceIterator):
     Output into a table format
     """
     def produce(self):
+        from terminaltables import GithubFlavoredMarkdownTable
+
         data = list(self.sources[0].produce())
         self.seen = len(data)
 
@@ -1046,13 +1506,39 @@ class TableOutput(SingleSourceIterator):
         yield GithubFlavoredMarkdownTable(data).table
 
 
+# For each aggregate function: the initial values of its state, the statement
+# that adds a value v to the state and the aggregate's value. s[{0}] is where
+# its state starts in the group's list.
+_ACCUMULATORS = {
+    'COUNT': (['0'], 'if v is not None: s[{0}] += 1', 's[{0}]'),
+    'SUM': (['None'], 'if v is not None: s[{0}] = v if s[{0}] is None else s[{0}] + v', 's[{0}]'),
+    'AVG': (
+        ['0', '0'],
+        'if v is not None: s[{0}] += v; s[{0} + 1] += 1',
+        's[{0}] / s[{0} + 1] if s[{0} + 1] else None'),
+    'MIN': (['None'], 'if v is not None and (s[{0}] is None or v < s[{0}]): s[{0}] = v', 's[{0}]'),
+    'MAX': (['None'], 'if v is not None and (s[{0}] is None or s[{0}] < v): s[{0}] = v', 's[{0}]'),
+}
+
+# DISTINCT aggregates collect the values in a set
+_DISTINCT_RESULTS = {
+    'COUNT': 'len(s[{0}])',
+    'SUM': 'sum(s[{0}]) if s[{0}] else None',
+    'AVG': 'sum(s[{0}]) / len(s[{0}]) if s[{0}] else None',
+    'MIN': 'min(s[{0}]) if s[{0}] else None',
+    'MAX': 'max(s[{0}]) if s[{0}] else None',
+}
+
+
 class GroupBy(Iterator):
     """
     Group By aggregation (AKA Stream Aggregate)
     Assumes the source table is sorted by the Group By columns
+    Rows are the Group By columns followed by the aggregates
     """
-    def __init__(self, source, column_identifiers):
+    def __init__(self, source, column_identifiers, aggregates=()):
         self.columns_to_order_by = column_identifiers
+        self.aggregates = list(aggregates)
         super().__init__()
         self.set_sources([source])
         self.sorted = getattr(self.sources[0], 'sorted', False)
@@ -1060,19 +1546,169 @@ class GroupBy(Iterator):
         for col_identifier in self.columns_to_order_by:
             col = self.sources[0].columns.get_column_from_identifier(col_identifier)
             self.columns.append(col_identifier, col.data_type)
+        for aggregate in self.aggregates:
+            self.columns.append(aggregate.identifier, self._data_type(aggregate))
         self.seen = 0
 
+        # Groups come out in the order of the source
+        indexes = [key.index for key in self.sources[0].sort_keys(column_identifiers)]
+        ordering = []
+        for key in self.sources[0].ordering:
+            if key.index not in indexes:
+                break
+            ordering.append(SortKey(indexes.index(key.index), key.descending))
+        self.ordering = tuple(ordering)
+
+    def _data_type(self, aggregate):
+        if aggregate.function == 'COUNT':
+            return DataType(int)
+        elif aggregate.function == 'AVG':
+            return DataType(float)
+        return self.sources[0].columns.get_column_from_identifier(aggregate.column_identifier).data_type
+
+    def _build(self, func_name, arg_names, lines):
+        code = FuncBuilder(func_name, arg_names)
+        for line in lines:
+            code.nl(line)
+        namespace = {}
+        exec(code.source, globals(), namespace)
+        return namespace[func_name]
+
+    def _accumulators(self):
+        """
+        Returns:
+            (the initial state of a group, the lines that add a row to a
+            group's state s, the aggregates' values)
+        """
+        columns = self.sources[0].columns
+        initial = []
+        updates = []
+        results = []
+        for aggregate in self.aggregates:
+            start = len(initial)
+            if aggregate.column_identifier is None:
+                initial.append('0')
+                updates.append('s[{0}] += 1'.format(start))
+                results.append('s[{0}]'.format(start))
+                continue
+
+            updates.append('v = row[{0}]'.format(
+                columns.get_column_idx_from_identifier(aggregate.column_identifier)))
+            if aggregate.distinct:
+                initial.append('set()')
+                updates.append('if v is not None: s[{0}].add(v)'.format(start))
+                results.append(_DISTINCT_RESULTS[aggregate.function].format(start))
+            else:
+                values, update, result = _ACCUMULATORS[aggregate.function]
+                initial.extend(values)
+                updates.append(update.format(start))
+                results.append(result.format(start))
+        return initial, updates, results
+
+    def finalize(self):
+        """
+        Generate the functions that pick a row's group and aggregate its
+        rows, with a line for each aggregate
+        """
+        super().finalize()
+
+        columns = self.sources[0].columns
+        self.key_expression = '({0})'.format(''.join(
+            'row[{0}],'.format(columns.get_column_idx_from_identifier(c))
+            for c in self.columns_to_order_by))
+        self.initial, self.updates, results = self._accumulators()
+
+        self.key = self._build('key', ['row'], ['return ' + self.key_expression])
+        self.new_state = self._build('new_state', [], ['return [{0}]'.format(', '.join(self.initial))])
+        self.update = self._build('update', ['s', 'row'], self.updates or ['pass'])
+        if results:
+            self.result = self._build('result', ['key', 's'], ['return key + ({0},)'.format(', '.join(results))])
+        else:
+            self.result = self._build('result', ['key', 's'], ['return key'])
+
     def produce(self):
-        column_id_to_select = [
-            self.sources[0].columns.get_column_idx_from_identifier(column_identifier)
-            for column_identifier in self.columns_to_order_by
-            ]
-        current_row = None
+        current = state = None
         for row in self.sources[0].produce():
-            new_row = tuple(row[i] for i in column_id_to_select)
-            if current_row != new_row:
-                yield new_row
-                current_row = new_row
+            key = self.key(row)
+            if state is None or key != current:
+                if state is not None:
+                    yield self.result(current, state)
+                current, state = key, self.new_state()
+            self.update(state, row)
+
+        if state is not None:
+            yield self.result(current, state)
+        elif not self.columns_to_order_by:
+            # Without GROUP BY there's a row even for no rows, eg. COUNT(*) is 0
+            yield self.result((), self.new_state())
+
+
+# Groups a hash aggregate keeps in memory, past that the rows of new groups are
+# partitioned to temporary files
+AGGREGATE_GROUPS = int(os.environ.get('SQLHILD_AGGREGATE_GROUPS', 1000000))
+
+# Partitions the rows that don't fit are split into
+AGGREGATE_PARTITIONS = 16
+
+# A partition that still has too many groups is split again, up to this depth
+AGGREGATE_SPILL_DEPTH = 8
+
+
+class SpilledPartitions(object):
+    """
+    Rows split by the hash of their group's key and written to temporary
+    files in pickled batches. The hash is salted with the depth, so that
+    splitting a partition again spreads its rows out. Rows that can't be
+    pickled are kept in memory.
+    """
+    def __init__(self, count, depth):
+        self.depth = depth
+        self.files = [None] * count
+        self.batches = [[] for _ in range(count)]
+        self.spillable = True
+
+    @property
+    def spilled(self):
+        return sum(1 for f in self.files if f is not None)
+
+    def add(self, key, row):
+        i = hash((self.depth, key)) % len(self.batches)
+        batch = self.batches[i]
+        batch.append(row)
+        if RUN_BATCH_ROWS <= len(batch) and self.spillable:
+            self._flush(i)
+
+    def _flush(self, i):
+        try:
+            data = pickle.dumps(self.batches[i], protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError, ValueError) as e:
+            logger.warning('Rows can\'t be spilled to disk: {}'.format(e))
+            self.spillable = False
+            return
+        if self.files[i] is None:
+            self.files[i] = tempfile.TemporaryFile(prefix='sqlhild-group-')
+        self.files[i].write(data)
+        self.batches[i] = []
+
+    def partitions(self):
+        """
+        Yields the rows of each partition that has any
+        """
+        for i, f in enumerate(self.files):
+            if f is not None and self.spillable and self.batches[i]:
+                self._flush(i)
+            if f is not None:
+                f.seek(0)
+                yield itertools.chain(_read_run(f), self.batches[i])
+            elif self.batches[i]:
+                yield self.batches[i]
+
+    def close(self):
+        for f in self.files:
+            if f is not None:
+                f.close()
+        self.files = [None] * len(self.files)
+        self.batches = []
 
 
 class GroupByHash(GroupBy):
@@ -1082,38 +1718,69 @@ class GroupByHash(GroupBy):
     https://mariadb.com/resources/blog/hash-based-group-strategy-mysql
     http://guyharrison.squarespace.com/blog/2009/8/5/optimizing-group-and-order-by.html
     https://blogs.msdn.microsoft.com/craigfr/2006/09/20/hash-aggregate/
-    """
-    def finalize(self):
-        super().finalize()
-
-        func_name = 'generated_func'
 
-        column_id_to_select = [
-            self.sources[0].columns.get_column_idx_from_identifier(column_identifier)
-            for column_identifier in self.columns_to_order_by
-            ]
+    Once the hash table has max_groups groups, the rows of the groups that
+    aren't in it are spilled to SpilledPartitions, and each partition is
+    aggregated on its own afterwards.
+    """
+    def __init__(self, source, column_identifiers, aggregates=(), max_groups=None):
+        super().__init__(source, column_identifiers, aggregates)
+        self.ordering = ()
+        self.max_groups = max_groups
+        self.spilled_partitions = 0
 
-        code = FuncBuilder(func_name, ['row'])
-        for i, col_id in enumerate(column_id_to_select):
-            varname = 'v{0}'.format(i)
-            code.nl('{0} = row[{1}]'.format(varname, col_id))
+    def pretty_print(self):
+        text = super().pretty_print()
+        if self.spilled_partitions:
+            text += '\nspilled partitions: {0}'.format(self.spilled_partitions)
+        return text
 
-        code.nl('return ({0},)'.format(
-            ','.join('v{0}'.format(i) for i, col_id in enumerate(column_id_to_select))))
+    def finalize(self):
+        """
+        The loop that adds rows to their group's state is generated in one
+        function, so there's no call for each row
+        """
+        super().finalize()
 
-        exec(code.source)
+        lines = [
+            'for row in rows:',
+            '\tkey = ' + self.key_expression,
+            '\ts = groups.get(key)',
+            '\tif s is None:',
+            '\t\tif max_groups <= len(groups):',
+            '\t\t\tspill(key, row)',
+            '\t\t\tcontinue',
+            '\t\ts = groups[key] = [{0}]'.format(', '.join(self.initial)),
+        ]
+        lines.extend('\t' + line for line in self.updates)
+        self.accumulate = self._build('accumulate', ['rows', 'groups', 'max_groups', 'spill'], lines)
 
-        func = locals()[func_name]
+    def produce(self):
+        yield from self._aggregate(self.sources[0].produce(), 0)
 
-        self.collect = func
+    def _aggregate(self, rows, depth):
+        max_groups = AGGREGATE_GROUPS if self.max_groups is None else self.max_groups
+        if AGGREGATE_SPILL_DEPTH <= depth:
+            max_groups = float('inf')
 
-    def produce(self):
         groups = {}
-        for row in self.sources[0].produce():
-            new_row = self.collect(row)
-            groups[new_row] = new_row
-        for row in groups.keys():
-            yield row
+        partitions = SpilledPartitions(AGGREGATE_PARTITIONS, depth)
+        try:
+            self.accumulate(rows, groups, max_groups, partitions.add)
+            if not groups and not self.columns_to_order_by:
+                groups[()] = self.new_state()
+            for key, state in groups.items():
+                yield self.result(key, state)
+            groups = None
+
+            spilled = partitions.spilled
+            if spilled:
+                logger.debug('{0} spilled {1} partitions at depth {2}'.format(self, spilled, depth))
+                self.spilled_partitions += spilled
+            for partition in partitions.partitions():
+                yield from self._aggregate(partition, depth + 1)
+        finally:
+            partitions.close()
 
 
 class JittedIterator(Iterator):
@@ -1133,6 +1800,8 @@ class JittedIterator(Iterator):
         assert(self.sorted)
 
         self.columns = functools.reduce(operator.add, [s.columns for s in self.sources])
+        if len(self.sources) == 1:
+            self.ordering = self.sources[0].ordering
 
         self.func = func
 
@@ -1151,6 +1820,7 @@ class PopulateFunctionData(Iterator):
         self.set_sources([source])
         self.sorted = getattr(source, 'sorted', False)
         self.columns = source.columns.clone()
+        self.ordering = source.ordering
         # TODO: set columns
         self.projection_items = projection_items
 
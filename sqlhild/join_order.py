@@ -0,0 +1,434 @@
+"""Cost based join ordering.
+
+The matchpy rules build joins in the order the tables appear in the query.
+This takes each cluster of inner joins in the optimized relational algebra
+and picks the cheapest order for it:
+
+ * Clusters of up to DP_LIMIT relations are enumerated exhaustively with
+   dynamic programming over subsets, bushy trees included.
+ * Larger clusters are ordered greedily by repeatedly joining the pair of
+   relations with the smallest result.
+
+Joins of only two relations are left as they are.
+
+Orders that need a cartesian product are never considered. The cost of a
+plan is the number of rows its joins read and produce. These are estimated
+from the table statistics (see sqlhild.statistics).
+
+The estimates also decide how every join is run. A hash join builds its hash
+table from the smaller input, unless even that is estimated at more than
+HASH_JOIN_ROWS rows, then both inputs are sorted and merge joined.
+"""
+
+import functools
+import itertools
+import logging
+import operator
+
+from matchpy import Operation
+
+from . import statistics
+from .relational_algebra import (
+    And,
+    Column,
+    Cross,
+    Distinct,
+    Equal,
+    FullJoin,
+    GreaterThan,
+    GreaterThanEqual,
+    In,
+    Intersection,
+    Join,
+    LeftJoin,
+    LessThan,
+    LessThanEqual,
+    Limit,
+    List,
+    Number,
+    Offset,
+    Or,
+    Project,
+    RightJoin,
+    Select,
+    Table,
+    Theta,
+    Union,
+    Value,
+    ValueSet,
+    pretty_print,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# Clusters with more relations than this are ordered greedily
+DP_LIMIT = 10
+
+# Row count of tables that don't tell us
+DEFAULT_ROW_COUNT = 1000
+
+# Selectivity of predicates we can't estimate
+DEFAULT_SELECTIVITY = 1 / 3
+
+# Joins whose smaller input is estimated at more rows than this are merge
+# joined, rather than holding that input in a hash table
+HASH_JOIN_ROWS = 1000000
+
+JOINS = (Join, LeftJoin, RightJoin, FullJoin)
+
+
+def product(values):
+    return functools.reduce(operator.mul, values, 1)
+
+
+class Statistics(object):
+    """
+    Row count and column estimates for the tables of a query
+    """
+    def __init__(self, algebra, available_tables):
+        self.available_tables = available_tables
+        self.table_names = {
+            identifier: metadata.name
+            for identifier, metadata in algebra._tables.items()
+        }
+        self.tables = {}
+
+    def table(self, identifier):
+        """
+        Statistics of the table with this identifier
+        """
+        try:
+            return self.tables[identifier]
+        except KeyError:
+            pass
+        tabl = self.available_tables.get(self.table_names.get(identifier, identifier))
+        stats = statistics.get(tabl)
+        self.tables[identifier] = stats
+        return stats
+
+    def row_count(self, identifier):
+        return self.table(identifier).row_count or DEFAULT_ROW_COUNT
+
+    def column(self, column):
+        return self.table(column.table_identifier).column(column.operands[1].name)
+
+    def distinct_count(self, column):
+        """
+        Number of distinct values in the Column.
+        Columns are assumed to be unique unless the table says otherwise.
+        """
+        distinct_count = self.column(column).distinct_count
+        if distinct_count is None:
+            return self.row_count(column.table_identifier)
+        return max(1, distinct_count)
+
+
+def literal(operand):
+    """
+    Value of a numeric literal, None for anything else (including Params)
+    """
+    if isinstance(operand, Number) and isinstance(operand.operands[0], Value):
+        try:
+            return float(operand.operands[0].val)
+        except ValueError:
+            pass
+    return None
+
+
+def range_selectivity(predicate, stats):
+    """
+    Fraction of the column's range that `column < number` and friends cover
+    """
+    column, value = predicate.operands
+    if not isinstance(column, Column):
+        return DEFAULT_SELECTIVITY
+    value = literal(value)
+    column_stats = stats.column(column)
+    low, high = column_stats.min, column_stats.max
+    try:
+        if value is None or low is None or high is None or high <= low:
+            return DEFAULT_SELECTIVITY
+        below = min(1, max(0, (value - low) / (high - low)))
+    except TypeError:
+        return DEFAULT_SELECTIVITY
+    if isinstance(predicate, (LessThan, LessThanEqual)):
+        fraction = below
+    else:
+        fraction = 1 - below
+    return fraction * (1 - (column_stats.null_fraction or 0))
+
+
+def selectivity(predicate, stats):
+    """
+    Estimated fraction of rows that satisfy the predicate
+    """
+    if isinstance(predicate, Equal):
+        columns = [o for o in predicate.operands if isinstance(o, Column)]
+        if columns:
+            not_null = min(1 - (stats.column(column).null_fraction or 0) for column in columns)
+            return not_null / max(stats.distinct_count(column) for column in columns)
+    elif isinstance(predicate, In):
+        column, items = predicate.operands
+        if isinstance(column, Column) and isinstance(items, List):
+            return min(1, len(items.operands) / stats.distinct_count(column))
+        if isinstance(column, Column) and isinstance(items, ValueSet):
+            return min(1, len(items.values) / stats.distinct_count(column))
+    elif isinstance(predicate, (LessThan, LessThanEqual, GreaterThan, GreaterThanEqual)):
+        return range_selectivity(predicate, stats)
+    elif isinstance(predicate, And):
+        return product(selectivity(o, stats) for o in predicate.operands)
+    elif isinstance(predicate, Or):
+        return min(1, sum(selectivity(o, stats) for o in predicate.operands))
+    return DEFAULT_SELECTIVITY
+
+
+def estimate_rows(relation, stats):
+    """
+    Estimated number of rows the relation produces
+    """
+    if isinstance(relation, Table):
+        return stats.row_count(relation.table_identifier)
+    elif isinstance(relation, Select):
+        return estimate_rows(relation.operands[0], stats) * selectivity(relation.operands[1], stats)
+    elif isinstance(relation, JOINS):
+        left, right = relation.operands
+        left_rows = estimate_rows(left.operands[0], stats)
+        right_rows = estimate_rows(right.operands[0], stats)
+        rows = left_rows * right_rows * selectivity(Equal(left.operands[1], right.operands[1]), stats)
+        if isinstance(relation, (LeftJoin, FullJoin)):
+            rows = max(rows, left_rows)
+        if isinstance(relation, (RightJoin, FullJoin)):
+            rows = max(rows, right_rows)
+        return rows
+    elif isinstance(relation, Cross):
+        return product(estimate_rows(o, stats) for o in relation.operands)
+    elif isinstance(relation, Union):
+        return sum(estimate_rows(o, stats) for o in relation.operands)
+    elif isinstance(relation, Intersection):
+        return min(estimate_rows(o, stats) for o in relation.operands)
+    elif isinstance(relation, (Distinct, Limit, Offset, Project)):
+        return estimate_rows(relation.operands[0], stats)
+    return DEFAULT_ROW_COUNT
+
+
+class Plan(object):
+    """
+    A join tree over some of the relations of a cluster
+    """
+    def __init__(self, mask, rows, cost, relation=None, left=None, right=None, predicates=()):
+        # Bit mask of the cluster's relations that are in this plan
+        self.mask = mask
+        self.rows = rows
+        self.cost = cost
+        self.relation = relation
+        self.left = left
+        self.right = right
+        self.predicates = predicates
+
+    def build(self, stats):
+        """
+        Relational algebra for the plan.
+        Join on the most selective predicate, filter on the rest.
+        """
+        if self.relation is not None:
+            return self.relation
+
+        left_tables = self.left.tables
+        predicates = sorted(self.predicates, key=lambda p: p.selectivity)
+
+        key = predicates[0]
+        left_column, right_column = key.columns
+        if left_column.table_identifier not in left_tables:
+            left_column, right_column = right_column, left_column
+
+        relation = Join(
+            Theta(self.left.build(stats), left_column),
+            Theta(self.right.build(stats), right_column))
+
+        for predicate in predicates[1:]:
+            relation = Select(relation, Equal(*predicate.columns))
+
+        self.relation = relation
+        return relation
+
+    @property
+    def tables(self):
+        if self.left is None:
+            return tables_of(self.relation)
+        return self.left.tables | self.right.tables
+
+
+class Predicate(object):
+    """
+    An equi-join between two of the cluster's relations
+    """
+    def __init__(self, columns, mask_a, mask_b, selectivity):
+        self.columns = columns
+        self.mask_a = mask_a
+        self.mask_b = mask_b
+        self.selectivity = selectivity
+
+    def connects(self, mask_a, mask_b):
+        return bool(
+            (self.mask_a & mask_a and self.mask_b & mask_b) or
+            (self.mask_a & mask_b and self.mask_b & mask_a))
+
+
+def tables_of(relation):
+    return frozenset(
+        node.table_identifier
+        for node, _ in relation.preorder_iter()
+        if isinstance(node, Table))
+
+
+def join_plans(left, right, predicates):
+    connecting = [p for p in predicates if p.connects(left.mask, right.mask)]
+    if not connecting:
+        return None
+
+    rows = left.rows * right.rows * product(p.selectivity for p in connecting)
+    cost = left.cost + right.cost + left.rows + right.rows + rows
+    return Plan(left.mask | right.mask, rows, cost, left=left, right=right, predicates=connecting)
+
+
+def dynamic_programming(plans, predicates):
+    """
+    Cheapest plan for each connected subset of relations, built up from the
+    smaller subsets
+    """
+    best = {plan.mask: plan for plan in plans}
+    everything = (1 << len(plans)) - 1
+
+    # Subsets are always numerically smaller than their superset
+    for mask in range(1, everything + 1):
+        # Single relation
+        if not mask & (mask - 1):
+            continue
+
+        lowest = mask & -mask
+        sub = (mask - 1) & mask
+        while sub:
+            # Only look at each split once
+            if sub & lowest and sub in best and mask ^ sub in best:
+                plan = join_plans(best[sub], best[mask ^ sub], predicates)
+                if plan and (mask not in best or plan.cost < best[mask].cost):
+                    best[mask] = plan
+            sub = (sub - 1) & mask
+
+    return best.get(everything)
+
+
+def greedy(plans, predicates):
+    """
+    Keep joining the two plans with the smallest result
+    """
+    plans = list(plans)
+    while 1 < len(plans):
+        candidates = [
+            plan
+            for plan in (join_plans(a, b, predicates) for a, b in itertools.combinations(plans, 2))
+            if plan
+        ]
+        if not candidates:
+            return None
+        plan = min(candidates, key=lambda plan: (plan.rows, plan.cost))
+        plans = [p for p in plans if p is not plan.left and p is not plan.right]
+        plans.append(plan)
+    return plans[0]
+
+
+def flatten(join, relations, join_columns):
+    """
+    Collect the relations and equi-join columns of a cluster of inner joins
+    """
+    for theta in join.operands:
+        relation = theta.operands[0]
+        if isinstance(relation, Join):
+            flatten(relation, relations, join_columns)
+        else:
+            relations.append(relation)
+    join_columns.append(tuple(theta.operands[1] for theta in join.operands))
+
+
+def reorder_cluster(join, stats):
+    relations = []
+    join_columns = []
+    flatten(join, relations, join_columns)
+
+    # Two relations can only be joined one way
+    if len(relations) < 3:
+        return Join(*[
+            Theta(reorder_relation(theta.operands[0], stats), theta.operands[1])
+            for theta in join.operands
+        ])
+
+    plans = []
+    owners = {}
+    for i, relation in enumerate(relations):
+        relation = reorder_relation(relation, stats)
+        plans.append(Plan(1 << i, estimate_rows(relation, stats), 0, relation=relation))
+        for identifier in tables_of(relation):
+            owners[identifier] = 1 << i
+
+    predicates = []
+    for columns in join_columns:
+        try:
+            masks = [owners[column.table_identifier] for column in columns]
+        except KeyError:
+            logger.debug('Unable to reorder joins on {}'.format(columns))
+            return join
+        predicates.append(Predicate(columns, masks[0], masks[1], selectivity(Equal(*columns), stats)))
+
+    if len(plans) <= DP_LIMIT:
+        plan = dynamic_programming(plans, predicates)
+    else:
+        plan = greedy(plans, predicates)
+
+    if plan is None:
+        return join
+
+    logger.debug('Join cost estimate {:.0f} for {:.0f} rows'.format(plan.cost, plan.rows))
+    return plan.build(stats)
+
+
+def reorder_relation(relation, stats):
+    if isinstance(relation, Join):
+        return reorder_cluster(relation, stats)
+    elif isinstance(relation, Operation):
+        return type(relation)(*[reorder_relation(o, stats) for o in relation.operands])
+    return relation
+
+
+def choose_join_methods(algebra, stats):
+    """
+    Remember how to run each join on it as _hash_build, the operand to build
+    the hash table from, or None for a merge join. There's no merge join for
+    FULL OUTER JOINs.
+    """
+    for node, _ in algebra.preorder_iter():
+        if isinstance(node, JOINS):
+            rows = [estimate_rows(theta.operands[0], stats) for theta in node.operands]
+            build = 0 if rows[0] < rows[1] else 1
+            if HASH_JOIN_ROWS < rows[build] and not isinstance(node, FullJoin):
+                build = None
+            node._hash_build = build
+
+
+def reorder(algebra, available_tables):
+    """
+    Reorder the inner joins of the relational algebra, and choose how each
+    join is run
+    """
+    if not any(isinstance(node, JOINS) for node, _ in algebra.preorder_iter()):
+        return algebra
+
+    stats = Statistics(algebra, available_tables)
+    new_algebra = reorder_relation(algebra, stats)
+    new_algebra._tables = algebra._tables
+    choose_join_methods(new_algebra, stats)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Reordered joins:\n{}".format(pretty_print(new_algebra)))
+
+    return new_algebra
@@ -14,7 +14,7 @@ from . import iterator
 class TeeRemover(object):
     """
     Remove iterators that use tee when it isn't required, ie. there is only
-    one source.
+    one source and nothing has been teed from it.
     """
 
     def process(self, plan):
@@ -24,7 +24,7 @@ class TeeRemover(object):
         self._process(plan, tee_count, tee_direction)
 
         for tee, count in tee_count.items():
-            if count == 1:
+            if count == 1 and not tee.teed:
                 assert(len(tee_direction[tee]) == 1)
                 assert(len(tee.sources) == 1)
                 tee_direction[tee][0].replace_source(tee, tee.sources[0])
@@ -0,0 +1,201 @@
+"""Query parameterization.
+
+Lifts the literals out of a query's WHERE clause so that queries that only
+differ by their constants share one optimized and compiled plan. The literals
+are bound into the plan when it is run.
+
+eg. these two queries share a plan:
+    SELECT * FROM OneToTen WHERE val > 3
+    SELECT * FROM OneToTen WHERE val > 7
+"""
+
+import re
+
+from .relational_algebra import (
+    Number,
+    Param,
+    Select,
+    String,
+    Value,
+)
+
+
+_token_re = re.compile(r"""
+    # IN lists become a set that is part of the plan (see ValueSet), so their
+    # literals stay in the query's text
+    (?P<in_list>(?i:\bIN)\s*\((?:[0-9,\s]*|\s*(?:{0})(?:\s*,\s*(?:{0}))*\s*)\))
+    |(?P<string>'(?:[^'\\]|\\.|'')*')
+    |(?P<quoted>"(?:[^"\\]|\\.|"")*"|`[^`]*`)
+    |(?P<real>\d+\.\d*|\.\d+)
+    |(?P<word>[\w$]+)
+    |(?P<space>\s+)
+    |(?P<other>.)
+    """.format(r"\d+\b|'[^'\\]*(?:(?:\\.|'')[^'\\]*)*'"), re.VERBOSE | re.DOTALL)
+
+# Keywords that finish a WHERE clause
+_where_terminators = {
+    'FOR',
+    'GROUP',
+    'HAVING',
+    'INTO',
+    'LIMIT',
+    'LOCK',
+    'ORDER',
+    'PROCEDURE',
+    'UNION',
+    'WINDOW',
+}
+
+
+def _is_parameterizable_string(val):
+    # LIKE patterns decide whether we get a Like or an Equal so they stay
+    # part of the query's text
+    return '%' not in val
+
+
+def scan(sql_text):
+    """
+    Replace the literals in the WHERE clause with placeholders.
+    Numbers become ? and strings become '?'
+
+    Returns:
+        The SQL text with placeholders, and the literals that were replaced
+    """
+    template = []
+    literals = []
+    in_where = False
+
+    for match in _token_re.finditer(sql_text):
+        kind = match.lastgroup
+        token = match.group()
+
+        if kind == 'word':
+            keyword = token.upper()
+            if keyword == 'WHERE':
+                in_where = True
+            elif keyword in _where_terminators:
+                in_where = False
+            elif in_where and token.isdigit():
+                literals.append(token)
+                token = '?'
+
+        elif kind == 'string' and in_where:
+            val = re.sub(r"^'(.*)'$", r'\1', token, flags=re.DOTALL)
+            if _is_parameterizable_string(val):
+                literals.append(val)
+                # Strings get their own placeholder so they don't share a
+                # plan with numbers, which are bound differently
+                token = "'?'"
+
+        elif kind == 'other' and token == ';':
+            in_where = False
+
+        template.append(token)
+
+    return ''.join(template), literals
+
+
+def _is_literal(ra):
+    if not isinstance(ra, (Number, String)):
+        return False
+    if not isinstance(ra.operands[0], Value):
+        return False
+    if isinstance(ra, String):
+        return _is_parameterizable_string(ra.operands[0].val)
+    return True
+
+
+class LiteralMismatch(Exception):
+    """
+    The literals found in the Relational Algebra aren't the ones scanned from
+    the SQL text
+    """
+    pass
+
+
+def _substitute(ra, literals, used, in_predicate):
+    if in_predicate and _is_literal(ra):
+        try:
+            index = literals.index(ra.operands[0].val)
+        except ValueError:
+            raise LiteralMismatch(ra)
+        if index in used:
+            raise LiteralMismatch(ra)
+        used.add(index)
+        return type(ra)(Param(index))
+
+    if not hasattr(ra, 'operands'):
+        return ra
+
+    if isinstance(ra, Select):
+        return Select(
+            _substitute(ra.operands[0], literals, used, in_predicate),
+            _substitute(ra.operands[1], literals, used, True))
+
+    return type(ra)(*[
+        _substitute(operand, literals, used, in_predicate)
+        for operand in ra.operands
+    ])
+
+
+def parameterize(ra, literals):
+    """
+    Replace the literals inside Select predicates with Params
+
+    Literals are matched up by value because commutative operators don't
+    keep the order of their operands. If the same value appears twice we
+    can't tell which Param is which.
+
+    Returns:
+        The Relational Algebra template or None if the literals inside the
+        Relational Algebra don't line up with the literals from scan()
+    """
+    if len(set(literals)) != len(literals):
+        return None
+
+    used = set()
+    try:
+        template = _substitute(ra, literals, used, False)
+    except LiteralMismatch:
+        return None
+
+    if len(used) != len(literals):
+        return None
+
+    template._tables = ra._tables
+    return template
+
+
+def param_types(ra):
+    """
+    Returns:
+        The literal type (ie. Number or String) of each Param.
+        The optimizer may have changed it, eg. coerce_to_int
+    """
+    try:
+        return ra._param_types
+    except AttributeError:
+        pass
+
+    types = {}
+    for node, _ in ra.preorder_iter():
+        if isinstance(node, (Number, String)) and isinstance(node.operands[0], Param):
+            types[node.operands[0].index] = type(node)
+
+    ra._param_types = types
+    return types
+
+
+def bind(ra, literals):
+    """
+    Returns:
+        The values for the Params inside this Relational Algebra
+    """
+    types = param_types(ra)
+    params = []
+    for i, literal in enumerate(literals):
+        if types.get(i) is Number:
+            params.append(int(literal))
+        else:
+            params.append(literal)
+    return params
@@ -0,0 +1,173 @@
+"""Plan cache.
+
+Keeps the optimized relational algebra of recently run queries so that
+repeated queries skip parsing, optimization and code generation.
+
+Compiled filter/merge functions are kept on the relational algebra nodes
+themselves (see ra2iter), so they are cached along with the plan.
+"""
+
+import collections
+import logging
+import re
+import sys
+
+from . import table
+
+
+logger = logging.getLogger(__name__)
+
+
+_token_re = re.compile(r"""
+    '(?:[^'\\]|\\.|'')*'    # 'string'
+    |"(?:[^"\\]|\\.|"")*"   # "string"
+    |`[^`]*`                # `identifier`
+    |\s+                    # whitespace
+    |[^'"`\s]+              # everything else
+    """, re.VERBOSE)
+
+
+# Whitespace other than a space
+_whitespace_re = re.compile(r'[^\S ]')
+
+
+def normalize(sql_text):
+    """
+    Collapse whitespace outside of strings and quoted identifiers so that
+    cosmetically different SQL text shares a cache entry
+    """
+    # Nothing to collapse if there are only single spaces. Saves tokenizing
+    # long queries, eg. with big IN lists.
+    if '  ' not in sql_text and not _whitespace_re.search(sql_text):
+        return sql_text.strip().rstrip(';').strip()
+
+    tokens = []
+    for token in _token_re.findall(sql_text):
+        if token.isspace():
+            tokens.append(' ')
+        else:
+            tokens.append(token)
+    return ''.join(tokens).strip().rstrip(';').strip()
+
+
+def schema_signature(tables, identifiers):
+    """
+    Returns:
+        A hashable description of the columns of these tables in the registry
+    """
+    return tuple(sorted(
+        (identifier, tuple(
+            (c.identifier, c.data_type.name, c.data_type.length)
+            for c in tables.get(identifier).columns.columns))
+        for identifier in identifiers
+    ))
+
+
+def estimate_size(key, ra):
+    """
+    Rough number of bytes held by a cache entry
+    """
+    size = sys.getsizeof(key)
+    for node, _ in ra.preorder_iter():
+        size += sys.getsizeof(node) + sys.getsizeof(getattr(node, 'name', None))
+    return size
+
+
+class CachedPlan(object):
+    def __init__(self, ra, schema, size, literals=None):
+        self.ra = ra
+        self.schema = schema
+        self.size = size
+
+        # Literals that are baked into the plan because they couldn't be
+        # turned into Params
+        self.literals = literals
+
+
+class PlanCache(object):
+    """
+    LRU cache of query plans, bounded by number of entries and bytes
+    """
+    def __init__(self, max_entries=256, max_bytes=16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.tables_version = table._tables_version
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _check_tables_version(self):
+        """
+        Registering (or re-registering) a table may change what a table name
+        refers to, so every plan is suspect.
+        """
+        if self.tables_version != table._tables_version:
+            if self.entries:
+                self.invalidations += len(self.entries)
+                logger.debug('Table registry changed, clearing plan cache')
+            self.clear()
+            self.tables_version = table._tables_version
+
+    def get(self, key, literals=None):
+        self._check_tables_version()
+        try:
+            plan = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        if plan.literals is not None and plan.literals != literals:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return plan
+
+    def put(self, key, ra, schema, literals=None):
+        self._check_tables_version()
+        self._remove(key)
+
+        plan = CachedPlan(ra, schema, estimate_size(key, ra), literals)
+        if self.max_bytes < plan.size:
+            return plan
+
+        self.entries[key] = plan
+        self.size += plan.size
+
+        while self.max_entries < len(self.entries) or self.max_bytes < self.size:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.size
+
+        return plan
+
+    def _remove(self, key):
+        try:
+            plan = self.entries.pop(key)
+        except KeyError:
+            return False
+        self.size -= plan.size
+        return True
+
+    def invalidate(self, key):
+        if self._remove(key):
+            self.invalidations += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+        }
+
+
+plan_cache = PlanCache()
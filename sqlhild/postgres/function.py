@@ -1,4 +1,4 @@
-import sqlhild
+import sqlhild.function
 
 
 class current_schema(sqlhild.function.Function):
@@ -25,6 +25,7 @@ from .message import (
     al,
 )
 
+from sqlhild import relational_algebra_optimizers
 from sqlhild.postgres import table  # NOQA: register postgress tables
 from sqlhild.query import QueryPlan
 
@@ -142,4 +143,5 @@ class PostgresHandler(TCPHandler):
 def start_server(host):
     # TODO: validate host string
     host, port = host.split(':')
+    relational_algebra_optimizers.collect_rule_stats()
     LoggingTCPServer((host, int(port)), PostgresHandler).serve_forever()
@@ -1,16 +1,20 @@
 import attr
 import collections
 import json
-import lmdb
 import logging
 import os
+import sys
 import uuid
 import typing
 
 from . import column
 from . import iterator
+from . import join_order
 from . import optimizer
+from . import parameterize
+from . import plan_cache
 from . import sql2ra
+from . import statistics
 from . import relational_algebra_optimizers
 from . import ra2iter
 from . import table
@@ -27,6 +31,15 @@ logger = logging.getLogger(__name__)
 class TableRegistry(dict):
     tables: typing.Dict[str, table.Table] = attr.Factory(dict)
     table_aliases: typing.Dict[str, str] = attr.Factory(dict)
+    params: typing.List = attr.Factory(list)
+
+    # Columns that the planned statements read from each table, None if
+    # they could read any column (see ra2iter.columns_read)
+    columns_read: typing.Dict[str, typing.Optional[set]] = attr.Factory(dict)
+
+    # The most rows that they read from each table, None if unbounded (see
+    # ra2iter.row_budgets)
+    row_budgets: typing.Dict[str, typing.Optional[int]] = attr.Factory(dict)
 
     def __setitem__(self, key, item):
         self.tables[key] = item
@@ -56,6 +69,11 @@ class TableRegistry(dict):
 
         # logger.debug("Registering table: {0} (AKA {1}) as {2}".format(identifier, name, alias))
 
+        # Statements in a script share the registry, keep the existing table
+        # as it might be Tee'd already
+        if identifier in self.tables:
+            return
+
         tabl = table.get(name)
 
         # Check if we're provided a row of dicts
@@ -78,14 +96,47 @@ class TableRegistry(dict):
     def get(self, identifier):
         return self.tables[identifier]
 
+    def read_columns(self, columns_read):
+        for identifier, columns in columns_read.items():
+            if identifier not in self.columns_read:
+                self.columns_read[identifier] = None if columns is None else set(columns)
+            elif columns is None:
+                self.columns_read[identifier] = None
+            elif self.columns_read[identifier] is not None:
+                self.columns_read[identifier] |= columns
+
+    def read_rows(self, row_budgets):
+        for identifier, rows in row_budgets.items():
+            if identifier not in self.row_budgets:
+                self.row_budgets[identifier] = rows
+            elif rows is None or self.row_budgets[identifier] is None:
+                self.row_budgets[identifier] = None
+            else:
+                self.row_budgets[identifier] = max(rows, self.row_budgets[identifier])
+
+
+def optimization_level():
+    return int(os.environ.get('SQLHILD_OPTIMIZATION_LEVEL', 5))
+
 
 class QueryPlan(object):
-    def __init__(self):
+    def __init__(self, cache=None, tables=None, trace=False):
         self.ast = None
         self.source = None
         self.table_aliases = {}
-        self.tables = TableRegistry()
-        self.db = lmdb.open('sqlhild.lmdb', max_dbs=255)
+        self.tables = TableRegistry() if tables is None else tables
+        self._db = None
+        self.plan_cache = plan_cache.plan_cache if cache is None else cache
+
+        # The optimizer's Trace of each statement planned, if tracing
+        self.traces = [] if trace else None
+
+    @property
+    def db(self):
+        # Most queries never touch LMDB
+        if self._db is None:
+            self._db = table.open_db()
+        return self._db
 
     @property
     def columns(self):
@@ -104,13 +155,16 @@ class QueryPlan(object):
             else:
                 return None
 
-    def _select(self, ra, dumpast=False):
-        # if dumpast:
-        #     logger.debug(json.dumps(ast.asjson(), indent=2))
-
+    def _register_tables(self, ra):
         for table_name, tabl in ra._tables.items():
             self.tables.append(tabl.identifier, tabl.name, tabl.alias)
 
+    def _select(self, ra, dumpast=False, optimize=True):
+        # if dumpast:
+        #     logger.debug(json.dumps(ast.asjson(), indent=2))
+
+        self.tables.read_columns(ra2iter.columns_read(ra))
+        self.tables.read_rows(ra2iter.row_budgets(ra))
         source = ra2iter.ra2iter(ra, self.tables)
 
         source = iterator.Stringify(source)
@@ -132,6 +186,14 @@ class QueryPlan(object):
 
         self.source = source
 
+        if optimize:
+            self.optimize()
+
+    def optimize(self):
+        """
+        Optimize the iterators.
+        Statements that share tables have to be planned before this is done.
+        """
         # TODO: optimizer should run multiple times
         optimizers = [
             optimizer.TeeRemover,
@@ -233,19 +295,79 @@ class QueryPlan(object):
                 txn.put(key.bytes, row_data, db=table_db)
                 # TODO: calculate max length of item
 
-    def process(self, sql_text, dumpast=False):
-        """
-        Process SQL string and prepare Query Plan
+    def _plan(self, sql_text, literals):
         """
+        Convert SQL string into optimized Relational Algebra
 
+        Returns:
+            The Relational Algebra and the literals baked into it. The
+            literals are None if they were replaced with Params.
+        """
         ra = sql2ra.sql2ra(sql_text, table)
 
-        if 0 < int(os.environ.get('SQLHILD_OPTIMIZATION_LEVEL', 5)):
-            ra = relational_algebra_optimizers.optimize(ra)
+        template = parameterize.parameterize(ra, literals)
+        if template is None:
+            logger.debug('Unable to parameterize: {}'.format(sql_text))
+        else:
+            ra, literals = template, None
+
+        if 0 < optimization_level():
+            ra = relational_algebra_optimizers.optimize(ra, self._trace(sql_text))
+            ra = join_order.reorder(ra, table)
+
+        return ra, literals
+
+    def _trace(self, sql_text):
+        """
+        Returns:
+            A new Trace for planning the statement, None if not tracing
+        """
+        if self.traces is None:
+            return None
+        trace = relational_algebra_optimizers.Trace(sql_text)
+        self.traces.append(trace)
+        return trace
+
+    def _cached_plan(self, sql_text):
+        """
+        Reuse the Relational Algebra of a previous run of this query as long as
+        the tables it uses still have the same columns.
+        Queries that only differ by the literals in their WHERE clause share
+        the same plan.
+        """
+        template_text, literals = parameterize.scan(sql_text)
+        key = (plan_cache.normalize(template_text), optimization_level())
+
+        cached = self.plan_cache.get(key, literals)
+        if cached:
+            self._register_tables(cached.ra)
+            if cached.schema == plan_cache.schema_signature(self.tables, cached.ra._tables):
+                self.tables.params = parameterize.bind(cached.ra, literals)
+                trace = self._trace(sql_text)
+                if trace is not None:
+                    trace.cached = True
+                return cached.ra
+            logger.debug('Schema changed, replanning: {}'.format(key[0]))
+            self.plan_cache.invalidate(key)
+
+        ra, baked_literals = self._plan(sql_text, literals)
+        self._register_tables(ra)
+        self.plan_cache.put(
+            key, ra, plan_cache.schema_signature(self.tables, ra._tables), baked_literals)
+        if baked_literals is None:
+            self.tables.params = parameterize.bind(ra, literals)
+        return ra
+
+    def process(self, sql_text, dumpast=False, optimize=True):
+        """
+        Process SQL string and prepare Query Plan
+        """
+
+        ra = self._cached_plan(sql_text)
 
         # self.ast = ast
 
-        self._select(ra, dumpast=dumpast)
+        self._select(ra, dumpast=dumpast, optimize=optimize)
 
         # if ast.get('select', None):
         #     self._select(ra, dumpast=dumpast)
@@ -291,6 +413,11 @@ class QueryPlan(object):
         for f in direction.keys():
             dot.node(f.label, f.pretty_print())
 
+        # Leaves are tables, show what the planner knew about them
+        for f in set().union(*direction.values()) - set(direction):
+            if isinstance(f, table.AbstractTable):
+                dot.node(f.label, '{}\n{}'.format(f.name, statistics.peek(f) or 'rows: ?'))
+
         for k, v in direction.items():
             for other in v:
                 dot.edge(k.label, other.label)
@@ -335,24 +462,10 @@ def do_sqlite_run(sql_text):
     return r
 
 
-def go(
-        sql_text,
-        pretty_print=False,
-        queryplan=False,
-        dumpast=False,
-        output_csv=False,
-        sqlite_run=False,
-        ):
-
-    if sqlite_run:
-        return do_sqlite_run(sql_text)
-
-    q = QueryPlan()
-    q.process(sql_text, dumpast=dumpast)
-
-    if not pretty_print:
-        return list(q.produce())
-
+def output(q, queryplan=False, output_csv=False):
+    """
+    Write the query's rows in the chosen output format
+    """
     # Figure out final iterator for the destination
     try:
         get_ipython  # NOQA
@@ -362,8 +475,6 @@ def go(
             q.source = iterator.CSVOutput(iterator.Tuple2Dict(q.source))
         else:
             q.source = iterator.TableOutput(q.source)
-        if not pretty_print:
-            return list(q.produce())
 
     # Output
     try:
@@ -384,4 +495,91 @@ def go(
 
     logger.info('{0} row(s)'.format(q.source.seen))
 
+
+def write_traces(plans, filename):
+    """
+    Write the optimizer traces of the plans as JSON, - is stderr
+    """
+    traces = [trace.to_dict() for q in plans for trace in q.traces]
+    if filename == '-':
+        json.dump(traces, sys.stderr, indent=2)
+        sys.stderr.write('\n')
+    else:
+        with open(filename, 'w') as f:
+            json.dump(traces, f, indent=2)
+
+
+def go(
+        sql_text,
+        pretty_print=False,
+        queryplan=False,
+        dumpast=False,
+        output_csv=False,
+        sqlite_run=False,
+        trace_optimizer=None,
+        ):
+    """
+    Args:
+        trace_optimizer: File to write the optimizer's trace to, see
+            write_traces()
+    """
+
+    if sqlite_run:
+        return do_sqlite_run(sql_text)
+
+    q = QueryPlan(trace=trace_optimizer is not None)
+    q.process(sql_text, dumpast=dumpast)
+    logger.debug('Plan cache: {}'.format(q.plan_cache.stats()))
+
+    if trace_optimizer is not None:
+        write_traces([q], trace_optimizer)
+
+    if not pretty_print:
+        return list(q.produce())
+
+    output(q, queryplan=queryplan, output_csv=output_csv)
+
+    return None
+
+
+def go_script(
+        sql_text,
+        pretty_print=False,
+        queryplan=False,
+        output_csv=False,
+        trace_optimizer=None,
+        ):
+    """
+    Run every statement in a SQL script in this process.
+
+    The statements share a TableRegistry, so a table that is used by several
+    statements is scanned once and Tee'd to each of them. This means every
+    statement is planned before any of them are run.
+
+    Returns:
+        A list of rows for each statement, if not pretty printing
+    """
+    tables = TableRegistry()
+    plans = []
+    for statement in sql2ra.split_statements(sql_text):
+        q = QueryPlan(tables=tables, trace=trace_optimizer is not None)
+        q.process(statement, optimize=False)
+        plans.append(q)
+
+    for q in plans:
+        q.optimize()
+
+    logger.debug('Plan cache: {}'.format(plan_cache.plan_cache.stats()))
+
+    if trace_optimizer is not None:
+        write_traces(plans, trace_optimizer)
+
+    if not pretty_print:
+        return [list(q.produce()) for q in plans]
+
+    for i, q in enumerate(plans):
+        if i:
+            print()
+        output(q, queryplan=queryplan, output_csv=output_csv)
+
     return None
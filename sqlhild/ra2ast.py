@@ -20,18 +20,27 @@ from ast import (
 
 from . import relational_algebra as ras
 from . import ast_transformer
+from . import intervals
 
 
 logger = logging.getLogger(__name__)
 
 
 class Context:
-    def __init__(self, tables):
+    def __init__(self, tables, columns=None):
         self.tables = tables
+
+        # The ColumnRegistry of each row variable, eg. the left and right
+        # rows of a join. Without these we assume the row is a table's row.
+        self.columns = columns or {}
+
         self.imports_required = []
 
+        # Values that the generated code refers to by name, eg. IN sets
+        self.constants = {}
+
 
-def FILTER_FUNC(rows):
+def FILTER_FUNC(rows, params=()):
     """
     Loop through data and yield rows that meet criteria
     """
@@ -85,13 +94,18 @@ def unique_name(prefix):
     return '{}_{}'.format(prefix, str(uuid.uuid4())).replace('-', '_')
 
 
-def ast2pyfunc(astbody):
+def ast2pyfunc(astbody, constants=None):
     """
     Compile and retrieve Python function
+
+    Args:
+        constants: Globals for the function, see Context.constants
     """
     code_object = compile(astbody, filename="<ast>", mode="exec")
-    exec(code_object)
-    return locals()[astbody.body[-1].name]
+    namespace = dict(globals())
+    namespace.update(constants or {})
+    exec(code_object, namespace)
+    return namespace[astbody.body[-1].name]
 
 
 def single_row_expression_func(ra, ctx: Context):
@@ -117,7 +131,8 @@ def single_row_expression_func(ra, ctx: Context):
 
     ast.fix_missing_locations(func_def)
 
-    logger.debug(astor.to_source(func_def))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(astor.to_source(func_def))
 
     return func_def
 
@@ -132,7 +147,11 @@ def convert(ra, ctx: Context):
 
 @convert.register
 def _(ra: ras.Column, ctx: Context, var_name='row'):
-    column_idx = ctx.tables[ra.operands[0].name].columns.get_column_idx_from_identifier(ra.column_identifier)
+    try:
+        columns = ctx.columns[var_name]
+    except KeyError:
+        columns = ctx.tables[ra.operands[0].name].columns
+    column_idx = columns.get_column_idx_from_identifier(ra.column_identifier)
     return ast.Subscript(
         value=Name(id=var_name, ctx=Load()),
         slice=ast.Index(value=ast.Num(column_idx)),
@@ -140,6 +159,19 @@ def _(ra: ras.Column, ctx: Context, var_name='row'):
     )
 
 
+@convert.register
+def _(ra: ras.Aggregate, ctx: Context):
+    """
+    An aggregate in HAVING is a column of the grouped rows
+    """
+    column_idx = ctx.columns['row'].get_column_idx_from_identifier(ra.column_identifier)
+    return ast.Subscript(
+        value=Name(id='row', ctx=Load()),
+        slice=ast.Index(value=ast.Num(column_idx)),
+        ctx=Load()
+    )
+
+
 def comparison(ra, ctx, op):
     return Compare(
         left=convert(ra[0], ctx),
@@ -173,6 +205,31 @@ def _(ra: ras.Equal, ctx: Context):
     return comparison(ra, ctx, ast.Eq())
 
 
+@convert.register
+def _(ra: ras.NotEqual, ctx: Context):
+    return comparison(ra, ctx, ast.NotEq())
+
+
+@convert.register
+def _(ra: ras.In, ctx: Context):
+    return comparison(ra, ctx, ast.In())
+
+
+@convert.register
+def _(ra: ras.ValueSet, ctx: Context):
+    """
+    The set is built once, rather than written out in the function
+    """
+    name = unique_name('values')
+    ctx.constants[name] = ra.values
+    return Name(id=name, ctx=Load())
+
+
+@convert.register
+def _(ra: ras.List, ctx: Context):
+    return ast.Tuple(elts=[convert(o, ctx) for o in ra.operands], ctx=Load())
+
+
 @convert.register
 def _(ra: ras.Like, ctx: Context):
     # The wildcard function
@@ -189,28 +246,89 @@ def _(ra: ras.Like, ctx: Context):
 
 @convert.register
 def _(ra: ras.Number, ctx: Context):
+    if isinstance(ra[0], ras.Param):
+        return convert(ra[0], ctx)
     return ast.Num(int(ra[0].val))
 
 
 @convert.register
 def _(ra: ras.String, ctx: Context):
+    if isinstance(ra[0], ras.Param):
+        return convert(ra[0], ctx)
     return ast.Str(ra[0].val)
 
 
+@convert.register
+def _(ra: ras.Param, ctx: Context):
+    """
+    Params are passed into the filter function when the query is run
+    """
+    return ast.Subscript(
+        value=Name(id='params', ctx=Load()),
+        slice=ast.Index(value=ast.Num(ra.index)),
+        ctx=Load()
+    )
+
+
+def _bound(conjunct):
+    """
+    Returns:
+        (Column, is lower bound, operator, literal) if the conjunct bounds a
+        column by a literal or Param, None otherwise
+    """
+    found = intervals.comparison(conjunct, lambda v: v)
+    if found is None:
+        return None
+    operator, column, value = found
+    if not isinstance(value, (ras.Number, ras.String)):
+        return None
+    if operator in (ras.GreaterThan, ras.GreaterThanEqual):
+        return column, True, ast.Lt() if operator is ras.GreaterThan else ast.LtE(), value
+    if operator in (ras.LessThan, ras.LessThanEqual):
+        return column, False, ast.Lt() if operator is ras.LessThan else ast.LtE(), value
+    return None
+
+
+def range_checks(conjuncts, ctx):
+    """
+    Check a column's lower and upper bound with one chained comparison, eg.
+    1 < row[0] <= 5, so the column is only read once
+    """
+    bounds = {}
+    for conjunct in conjuncts:
+        bound = _bound(conjunct)
+        if bound is not None:
+            bounds.setdefault(bound[:2], (conjunct, bound))
+
+    checks = []
+    for conjunct in conjuncts:
+        bound = _bound(conjunct)
+        lower = bound and bounds.get((bound[0], True))
+        upper = bound and bounds.get((bound[0], False))
+        if not lower or not upper or conjunct not in (lower[0], upper[0]):
+            checks.append(convert(conjunct, ctx))
+        elif conjunct is lower[0]:
+            column, _, lower_op, low = lower[1]
+            _, _, upper_op, high = upper[1]
+            checks.append(Compare(
+                left=convert(low, ctx),
+                ops=[lower_op, upper_op],
+                comparators=[convert(column, ctx), convert(high, ctx)],
+            ))
+    return checks
+
+
 @convert.register
 def _(ra: ras.And, ctx: Context):
-    return ast.BoolOp(op=And(), values=[
-        convert(ra[0], ctx),
-        convert(ra[1], ctx),
-      ])
+    checks = range_checks(ra.operands, ctx)
+    if len(checks) == 1:
+        return checks[0]
+    return ast.BoolOp(op=And(), values=checks)
 
 
 @convert.register
 def _(ra: ras.Or, ctx: Context):
-    return ast.BoolOp(op=Or(), values=[
-        convert(ra[0], ctx),
-        convert(ra[1], ctx),
-      ])
+    return ast.BoolOp(op=Or(), values=[convert(o, ctx) for o in ra.operands])
 
 
 @convert.register
@@ -235,7 +353,8 @@ def _(ra: ras.Select, ctx: Context):
 
     ast.fix_missing_locations(filter_ast)
 
-    logger.debug(astor.to_source(filter_ast))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(astor.to_source(filter_ast))
 
     return filter_ast
 
@@ -294,6 +413,7 @@ def _(ra: ras.Join, ctx: Context):
 
     ast.fix_missing_locations(body_ast)
 
-    logger.debug(astor.to_source(body_ast))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(astor.to_source(body_ast))
 
     return body_ast
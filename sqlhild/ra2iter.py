@@ -2,12 +2,65 @@
 Convert relational algebra to an iterator
 """
 
-from functools import reduce, singledispatch
+import copy
+
+from functools import partial, reduce, singledispatch
+
+from matchpy import Operation
 
 from . import exception
+from . import intervals
 from . import iterator
 from . import ra2ast
 from . import relational_algebra as ra
+from .table import AbstractTable, Predicate
+
+
+# Comparisons that tables can handle in push_down()
+_push_down_operators = {
+    ra.Equal: '=',
+    ra.NotEqual: '!=',
+    ra.LessThan: '<',
+    ra.LessThanEqual: '<=',
+    ra.GreaterThan: '>',
+    ra.GreaterThanEqual: '>=',
+}
+
+# The operator when the literal is on the left, eg. 1 < x is x > 1
+_flipped_operators = {
+    '=': '=',
+    '!=': '!=',
+    '<': '>',
+    '<=': '>=',
+    '>': '<',
+    '>=': '<=',
+}
+
+
+def _compile(a, tables, **columns):
+    """
+    Convert Relational Algebra into a Python function.
+    The function is kept on the node so that cached plans skip code generation.
+
+    Args:
+        columns: The ColumnRegistry of each of the function's row arguments
+    """
+    try:
+        return a._py_func
+    except AttributeError:
+        ctx = ra2ast.Context(tables, columns)
+        ast = ra2ast.convert(a, ctx)
+        a._py_func = ra2ast.ast2pyfunc(ast, ctx.constants)
+        return a._py_func
+
+
+def _order_by(source, column_identifiers):
+    """
+    Sort the rows, unless they already come out in that order
+    """
+    if source.ordered_by(source.sort_keys(column_identifiers)):
+        return source
+    return iterator.OrderBy(source, column_identifiers)
 
 
 def _do_join(a, tables, join_type):
@@ -15,8 +68,8 @@ def _do_join(a, tables, join_type):
     source2 = ra2iter(a.operands[1].operands[0], tables)
     col_identifiers = a.get_column_identifiers()
     return join_type(
-        iterator.OrderBy(source1, [col_identifiers[0]]),
-        iterator.OrderBy(source2, [col_identifiers[1]]),
+        _order_by(source1, [col_identifiers[0]]),
+        _order_by(source2, [col_identifiers[1]]),
         col_identifiers[0],
         col_identifiers[1],
         )
@@ -35,47 +88,358 @@ def _(a: ra.Table, tables):
     identifier = a.table_identifier
     table = tables[identifier]
     if not hasattr(table, 'tee'):
+        _push_down_hints(table, identifier, tables)
         table = iterator.Tee(table)
         tables[identifier] = table
     else:
-        tables[identifier] = table.tee()
+        # The scan is shared, every statement planned so far can read it
+        while isinstance(table.sources[0], iterator.Tee):
+            table = table.sources[0]
+        _push_down_hints(table.sources[0], identifier, tables)
+        tables[identifier] = tables[identifier].tee()
     return tables[identifier]
 
 
+def _output_relation(algebra):
+    while isinstance(algebra, (ra.Distinct, ra.Limit, ra.Offset, ra.OrderBy)):
+        algebra = algebra.operands[0]
+    return algebra
+
+
+def columns_read(algebra):
+    """
+    The columns of each table that the query reads.
+    Cached on the node like the compiled functions.
+
+    Returns:
+        {table identifier: set of column names}, None instead of a set when
+        every column could be read
+    """
+    try:
+        return algebra._columns_read
+    except AttributeError:
+        pass
+
+    identifiers = {
+        identifier: {identifier, metadata.alias}
+        for identifier, metadata in getattr(algebra, '_tables', {}).items()
+    }
+    columns = {identifier: set() for identifier in identifiers}
+
+    def read(column_identifier):
+        qualifier, _, name = column_identifier.rpartition('.')
+        owners = [i for i, names in identifiers.items() if qualifier in names]
+        for identifier in owners or identifiers:
+            if columns.get(identifier) is not None:
+                columns[identifier].add(name)
+
+    if not isinstance(_output_relation(algebra), ra.Project):
+        columns = dict.fromkeys(identifiers)
+
+    # Aggregates are selected by name, but aren't a table's columns
+    aggregates = {
+        node.column_identifier for node, _ in algebra.preorder_iter() if isinstance(node, ra.Aggregate)}
+
+    for node, _ in algebra.preorder_iter():
+        if isinstance(node, ra.Column):
+            read(node.column_identifier.replace('`', ''))
+        elif isinstance(node, ra.Project):
+            for o in node.operands[1:]:
+                if isinstance(o, ra.ColumnName) and o.name not in aggregates:
+                    read(o.name)
+
+    algebra._columns_read = columns
+    return columns
+
+
+def row_budgets(algebra):
+    """
+    The most rows that the query reads from each table, which is only known
+    when a LIMIT is above the table with nothing but projections and
+    OFFSETs in between.
+    A LIMIT above a Select of a table is remembered on the Select, the
+    table's budget then depends on whether it can filter on its own. A LIMIT
+    above an ORDER BY is remembered on the OrderBy, which then only keeps
+    that many rows.
+
+    Returns:
+        {table identifier: rows}, None instead of rows when unbounded
+    """
+    try:
+        return algebra._row_budgets
+    except AttributeError:
+        pass
+
+    budgets = {}
+
+    def record(identifier, budget):
+        if identifier not in budgets:
+            budgets[identifier] = budget
+        elif budget is None or budgets[identifier] is None:
+            budgets[identifier] = None
+        else:
+            budgets[identifier] = max(budget, budgets[identifier])
+
+    def walk(node, budget):
+        if isinstance(node, ra.Limit):
+            limit = _limit_literal(node.operands[1])
+            if limit is not None and budget is not None:
+                limit = min(limit, budget)
+            walk(node.operands[0], limit)
+        elif isinstance(node, ra.Offset):
+            offset = _limit_literal(node.operands[1])
+            walk(node.operands[0], None if offset is None or budget is None else budget + offset)
+        elif isinstance(node, ra.Project):
+            walk(node.operands[0], budget)
+        elif isinstance(node, ra.OrderBy):
+            # Every row is read to find the first ones
+            node._row_budget = budget
+            walk(node.operands[0], None)
+        elif isinstance(node, ra.Select) and isinstance(node.operands[0], ra.Table):
+            node._row_budget = budget
+            record(node.operands[0].table_identifier, None)
+        elif isinstance(node, ra.Table):
+            record(node.table_identifier, budget)
+        elif isinstance(node, Operation) and not isinstance(node, ra.Column):
+            for o in node.operands:
+                walk(o, None)
+
+    walk(algebra, None)
+    algebra._row_budgets = budgets
+    return budgets
+
+
+def _limit_literal(a):
+    try:
+        return int(a.operands[0].val)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _push_down_hints(tabl, identifier, tables):
+    """
+    Tell the table what the query reads from it
+    """
+    push_down_columns = getattr(tabl, 'push_down_columns', None)
+    columns = tables.columns_read.get(identifier)
+    if push_down_columns and columns is not None:
+        push_down_columns(frozenset(columns))
+
+    push_down_limit = getattr(tabl, 'push_down_limit', None)
+    if push_down_limit:
+        push_down_limit(tables.row_budgets.get(identifier))
+
+
+def _literal(a, tables):
+    """
+    Python value of a literal, using the bound value of Params
+
+    Raises:
+        ValueError: a isn't a literal
+    """
+    if isinstance(a, (ra.Number, ra.String)):
+        value = a.operands[0]
+        if isinstance(value, ra.Param):
+            return tables.params[value.index]
+        elif isinstance(a, ra.Number):
+            return int(value.val)
+        return value.val
+    raise ValueError(a)
+
+
+def _table_predicate(conjunct, tables):
+    """
+    Returns:
+        The conjunct as a Predicate, None if it isn't a comparison between a
+        column and literals
+    """
+    if isinstance(conjunct, ra.In):
+        column, items = conjunct.operands
+        if not isinstance(column, ra.Column):
+            return None
+        if isinstance(items, ra.ValueSet):
+            return Predicate(column.operands[1].name, 'in', tuple(items.values))
+        if not isinstance(items, ra.List):
+            return None
+        try:
+            values = tuple(_literal(item, tables) for item in items.operands)
+        except ValueError:
+            return None
+        return Predicate(column.operands[1].name, 'in', values)
+
+    try:
+        operator = _push_down_operators[type(conjunct)]
+    except KeyError:
+        return None
+
+    column, value = conjunct.operands
+    if not isinstance(column, ra.Column):
+        column, value = value, column
+        operator = _flipped_operators[operator]
+    if not isinstance(column, ra.Column):
+        return None
+
+    try:
+        return Predicate(column.operands[1].name, operator, _literal(value, tables))
+    except ValueError:
+        return None
+
+
+def _push_down(a, tables):
+    """
+    Let the table filter its own rows and only filter on what it couldn't
+    handle.
+
+    Returns:
+        None if the table didn't handle any of the Select's predicates
+    """
+    relation, condition = a.operands
+    tabl = tables[relation.table_identifier]
+
+    # Other scans share the rows of a Tee'd table
+    if hasattr(tabl, 'tee') or type(tabl).push_down is AbstractTable.push_down:
+        return None
+
+    if isinstance(condition, ra.And):
+        conjuncts = condition.operands
+    else:
+        conjuncts = [condition]
+
+    predicates = [_table_predicate(c, tables) for c in conjuncts]
+    candidates = [p for p in predicates if p is not None]
+    if not candidates:
+        return None
+
+    # The registry's table might still be scanned by another statement
+    tabl = copy.copy(tabl)
+    _push_down_hints(tabl, relation.table_identifier, tables)
+    handled = tabl.push_down(candidates)
+    if not handled:
+        return None
+
+    # Every row the table produces is kept, so a LIMIT above us applies
+    rows = getattr(a, '_row_budget', None)
+    if rows is not None and hasattr(tabl, 'push_down_limit') and \
+            all(p is not None and p in handled for p in predicates):
+        tabl.push_down_limit(rows)
+
+    # One Select for each conjunct, so that their functions are compiled once
+    try:
+        selects = a._conjunct_selects
+    except AttributeError:
+        selects = a._conjunct_selects = [ra.Select(relation, c) for c in conjuncts]
+
+    source = iterator.Tee(tabl)
+    for select, predicate in zip(selects, predicates):
+        if predicate is None or predicate not in handled:
+            py_func = partial(_compile(select, tables, row=source.columns), params=tables.params)
+            source = iterator.JittedIterator(source, py_func)
+    return source
+
+
+def _contradicts(a, tables):
+    """
+    Returns:
+        True if no row can pass the Select's condition with these params,
+        eg. val > ? AND val < ? with 5 and 3. The optimizer already found the
+        contradictions between literals.
+    """
+    condition = a.operands[1]
+    conjuncts = condition.operands if isinstance(condition, ra.And) else [condition]
+    found = intervals.column_intervals(conjuncts, partial(_literal, tables=tables))
+    return any(interval.empty for interval, _ in found.values())
+
+
 @ra2iter.register
 def _(a: ra.Select, tables):
+    if isinstance(a.operands[0], ra.Table):
+        if tables.params and _contradicts(a, tables):
+            return iterator.EmptySet(tables[a.operands[0].table_identifier].columns.clone())
+
+        source = _push_down(a, tables)
+        if source is not None:
+            return source
+
     source = ra2iter(a.operands[0], tables)
-    ast = ra2ast.convert(a, ra2ast.Context(tables))
-    py_func = ra2ast.ast2pyfunc(ast)
+    py_func = partial(_compile(a, tables, row=source.columns), params=tables.params)
     return iterator.JittedIterator(source, py_func)
 
 
+# The sides of each join whose unmatched rows are kept
+_outer_sides = {
+    ra.Join: (False, False),
+    ra.LeftJoin: (True, False),
+    ra.RightJoin: (False, True),
+    ra.FullJoin: (True, True),
+}
+
+
+def _hash_build(a):
+    """
+    Returns:
+        The operand to build the join's hash table from, None to merge join.
+        join_order.choose_join_methods decides, otherwise the right side.
+    """
+    return getattr(a, '_hash_build', 1)
+
+
+def _hash_join(a, tables, build):
+    keep_left, keep_right = _outer_sides[type(a)]
+    col_identifiers = a.get_column_identifiers()
+    return iterator.HashJoin(
+        ra2iter(a.operands[0].operands[0], tables),
+        ra2iter(a.operands[1].operands[0], tables),
+        col_identifiers[0],
+        col_identifiers[1],
+        build=build,
+        keep_left=keep_left,
+        keep_right=keep_right,
+        )
+
+
 @ra2iter.register
 def _(a: ra.Join, tables):
-    ast = ra2ast.convert(a, ra2ast.Context(tables))
-    py_func = ra2ast.ast2pyfunc(ast)
+    build = _hash_build(a)
+    if build is not None:
+        return _hash_join(a, tables, build)
 
     col_identifiers = a.get_column_identifiers()
 
     source1 = ra2iter(a.operands[0].operands[0], tables)
-    source1 = iterator.OrderBy(source1, [col_identifiers[0]])
+    source1 = _order_by(source1, [col_identifiers[0]])
 
     source2 = ra2iter(a.operands[1].operands[0], tables)
-    source2 = iterator.OrderBy(source2, [col_identifiers[1]])
+    source2 = _order_by(source2, [col_identifiers[1]])
 
-    return iterator.JittedIterator([source1, source2], py_func)
+    py_func = _compile(a, tables, left=source1.columns, right=source2.columns)
+
+    join = iterator.JittedIterator([source1, source2], py_func)
+    join.ordering = source1.sort_keys([col_identifiers[0]])
+    return join
 
 
 @ra2iter.register
 def _(a: ra.LeftJoin, tables):
+    build = _hash_build(a)
+    if build is not None:
+        return _hash_join(a, tables, build)
     return _do_join(a, tables, iterator.LeftMerge)
 
 
 @ra2iter.register
 def _(a: ra.RightJoin, tables):
+    build = _hash_build(a)
+    if build is not None:
+        return _hash_join(a, tables, build)
     return _do_join(a, tables, iterator.RightMerge)
 
 
+@ra2iter.register
+def _(a: ra.FullJoin, tables):
+    # There's no merge join for these
+    return _hash_join(a, tables, _hash_build(a) or 0)
+
+
 @ra2iter.register
 def _(a: ra.Cross, tables):
     return reduce(
@@ -94,29 +458,37 @@ def _(a: ra.Intersection, tables):
 
 @ra2iter.register
 def _(a: ra.Union, tables):
-    assert(len(a.operands) == 2)
-    return iterator.DistinctMerge(
-        iterator.SortedById(ra2iter(a.operands[0], tables)),
-        iterator.SortedById(ra2iter(a.operands[1], tables))
-    )
-    # return functools.reduce(
-    #     lambda a, b: iterator.DistinctMerge(a, iterator.SortedById(ra2iter(b, tables))),
-    #     a.operands[1:],
-    #     iterator.SortedById(ra2iter(a.operands[0], tables)))
+    return reduce(
+        lambda a, b: iterator.DistinctMerge(a, iterator.SortedById(ra2iter(b, tables))),
+        a.operands[1:],
+        iterator.SortedById(ra2iter(a.operands[0], tables)))
 
 
 @ra2iter.register
 def _(a: ra.GroupBy, tables):
     col_identifiers = list(a.get_column_identifiers())
-    return iterator.GroupByHash(ra2iter(a.operands[0], tables), col_identifiers)
-    # source = iterator.OrderBy(ra2iter(a.operands[0], tables), col_identifiers)
-    # return iterator.GroupBy(source, col_identifiers)
+    aggregates = [
+        iterator.AggregateCall(
+            aggregate.function_name,
+            aggregate.column.column_identifier.replace('`', '') if aggregate.column else None,
+            aggregate.distinct,
+            aggregate.column_identifier)
+        for aggregate in a.aggregates]
+    source = ra2iter(a.operands[0], tables)
+    # Stream the groups if each one's rows come out together
+    if source.grouped_by(key.index for key in source.sort_keys(col_identifiers)):
+        return iterator.GroupBy(source, col_identifiers, aggregates)
+    return iterator.GroupByHash(source, col_identifiers, aggregates)
 
 
 @ra2iter.register
 def _(a: ra.Distinct, tables):
-    # TODO: we should only put Sorted in when the source needs it
-    return iterator.Distinct(iterator.Sorted(ra2iter(a.operands[0], tables)))
+    source = ra2iter(a.operands[0], tables)
+    # Duplicates of grouped rows come out together, so only the previous row
+    # has to be remembered
+    if source.grouped_by(range(len(source.columns))):
+        return iterator.Distinct(source)
+    return iterator.HashDistinct(source)
 
 
 @ra2iter.register
@@ -143,9 +515,45 @@ def _(a: ra.Project, tables):
     # iterator.Distinct(col_identifiers[0]),
 
 
+@ra2iter.register
+def _(a: ra.OrderBy, tables):
+    source = ra2iter(a.operands[0], tables)
+
+    # eg. WHERE FALSE, which might not know its columns
+    if isinstance(source, iterator.EmptySet):
+        return source
+
+    sort_keys = a.operands[1:]
+    column_identifiers = [key.operands[0].column_identifier.replace('`', '') for key in sort_keys]
+    descending = [key.descending for key in sort_keys]
+    nulls_first = [key.nulls_first for key in sort_keys]
+
+    # Rows that are already in order are only assumed to have their NULLs
+    # where they'd be by default
+    keys = source.sort_keys(column_identifiers)
+    if source.ordered_by(tuple(iterator.SortKey(k.index, d) for k, d in zip(keys, descending))) and \
+            nulls_first == [not d for d in descending]:
+        return source
+
+    limit = getattr(a, '_row_budget', None)
+    if limit is not None:
+        return iterator.TopN(source, column_identifiers, limit, descending, nulls_first)
+    return iterator.OrderBy(source, column_identifiers, descending, nulls_first)
+
+
 @ra2iter.register
 def _(a: ra.EmptySet, tables):
-    return iterator.EmptySet()
+    if a.relation is None:
+        return iterator.EmptySet()
+
+    # The columns of the relation the optimizer found to be empty, without
+    # scanning its tables
+    columns = [
+        tables[node.table_identifier].columns
+        for node, _ in a.relation.preorder_iter()
+        if isinstance(node, ra.Table)
+    ]
+    return iterator.EmptySet(reduce(lambda a, b: a + b, columns).clone())
 
 
 @ra2iter.register
@@ -155,9 +563,9 @@ def _(a: ra.OneRowSet, tables):
 
 @ra2iter.register
 def _(a: ra.Offset, tables):
-    return iterator.Offset(ra2iter(a.operands[0], tables), a.operands[1].val)
+    return iterator.Offset(ra2iter(a.operands[0], tables), _literal(a.operands[1], tables))
 
 
 @ra2iter.register
 def _(a: ra.Limit, tables):
-    return iterator.Limit(ra2iter(a.operands[0], tables), a.operands[1].val)
+    return iterator.Limit(ra2iter(a.operands[0], tables), _literal(a.operands[1], tables))
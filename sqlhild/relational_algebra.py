@@ -10,13 +10,12 @@ References:
     * http://www.cs.toronto.edu/~faye/343/f07/lectures/wk3/03_RAlgebra.pdf
 """
 
-import autopep8
 import logging
 import re
 
+import matchpy
 from matchpy import (
     Arity,
-    Operation,
     Symbol,
 )
 
@@ -33,6 +32,19 @@ class QueryContext(object):
         return ctx
 
 
+class Operation(matchpy.Operation):
+    """
+    Operands aren't changed once an operation is created, so only hash the
+    whole subexpression once. The optimizer hashes subexpressions a lot.
+    """
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = super().__hash__()
+            return self._hash
+
+
 class Relation(object):
     pass
 
@@ -46,18 +58,28 @@ class Table(Symbol):
 
 
 class EmptySet(Symbol, Relation):
-    def __init__(self):
-        super().__init__(name='∅')
+    """
+    The relation this replaced, if any, is kept for its columns
+    """
+    # matchpy copies symbols with their name and variable name
+    def __init__(self, name='∅', variable_name=None, relation=None):
+        super().__init__(name=name, variable_name=variable_name)
+        self.relation = relation
+
+    def __copy__(self):
+        return type(self)(self.name, variable_name=self.variable_name, relation=self.relation)
 
 
 class UniverseSet(Symbol, Relation):
-    def __init__(self):
-        super().__init__(name='𝕌')
+    # matchpy copies symbols with their name and variable name
+    def __init__(self, name='𝕌', variable_name=None):
+        super().__init__(name=name, variable_name=variable_name)
 
 
 class OneRowSet(Symbol, Relation):
-    def __init__(self):
-        super().__init__(name='∅*')
+    # matchpy copies symbols with their name and variable name
+    def __init__(self, name='∅*', variable_name=None):
+        super().__init__(name=name, variable_name=variable_name)
 
 
 class Select(Operation, Relation):
@@ -115,6 +137,31 @@ class Offset(Operation):
     arity = Arity.binary
 
 
+class OrderBy(Operation):
+    """
+    The relation's rows in the order of its SortKeys
+    """
+    name = 'τ'
+    arity = Arity.polyadic
+
+
+class SortKey(Operation):
+    """
+    A Column, Value('ASC') or Value('DESC') and Value('NULLS FIRST') or
+    Value('NULLS LAST')
+    """
+    name = 'SortKey'
+    arity = Arity.ternary
+
+    @property
+    def descending(self):
+        return self.operands[1].val == 'DESC'
+
+    @property
+    def nulls_first(self):
+        return self.operands[2].val == 'NULLS FIRST'
+
+
 class Join(Operation, Relation):
     name = 'Join'
     arity = Arity.binary
@@ -151,6 +198,18 @@ class RightJoin(Operation, Relation):
         )
 
 
+class FullJoin(Operation, Relation):
+    name = 'FullJoin'
+    arity = Arity.binary
+    commutative = False
+
+    def get_column_identifiers(self):
+        return (
+            self.operands[0].operands[1].operands[0].name + '.' + self.operands[0].operands[1].operands[1].name,
+            self.operands[1].operands[1].operands[0].name + '.' + self.operands[1].operands[1].operands[1].name,
+        )
+
+
 class Union(Operation, Relation):
     name = '⋃'
     arity = Arity.variadic
@@ -179,7 +238,42 @@ class GroupBy(Operation, Relation):
 
     def get_column_identifiers(self):
         for operand in self.operands[1:]:
-            yield operand.operands[0].name + '.' + operand.operands[1].name
+            if isinstance(operand, Column):
+                yield operand.operands[0].name + '.' + operand.operands[1].name
+
+    @property
+    def aggregates(self):
+        return [operand for operand in self.operands[1:] if isinstance(operand, Aggregate)]
+
+
+class Aggregate(Operation):
+    """
+    An aggregate function of each group's rows: Value(function name),
+    Value('DISTINCT') or Value('ALL'), the Column or Value('*'), and
+    Value(the identifier of its column in the GroupBy's rows)
+    """
+    name = 'agg'
+    arity = Arity(4, True)
+
+    @property
+    def function_name(self):
+        return self.operands[0].val
+
+    @property
+    def distinct(self):
+        return self.operands[1].val == 'DISTINCT'
+
+    @property
+    def column(self):
+        """
+        None for COUNT(*)
+        """
+        column = self.operands[2]
+        return column if isinstance(column, Column) else None
+
+    @property
+    def column_identifier(self):
+        return self.operands[3].val
 
 
 # class Difference(Operation, Relation):
@@ -308,6 +402,78 @@ class In(Operation):
     one_identity = False
 
 
+class ValueSet(Symbol):
+    """
+    The literals of an IN list, eg. val IN (1, 2, 3). They're kept as one
+    set so that a long list is a single membership test.
+    """
+    # Longest set that is written out in full when printed
+    SHOWN = 10
+
+    def __init__(self, values, variable_name=None):
+        self.values = frozenset(values)
+        self.types = frozenset(map(type, self.values))
+        if len(self.values) <= self.SHOWN:
+            name = '{{{}}}'.format(', '.join(sorted(repr(v) for v in self.values)))
+        else:
+            name = '{{{} values}}'.format(len(self.values))
+        super().__init__(name, variable_name=variable_name)
+
+    def __copy__(self):
+        return type(self)(self.values, variable_name=self.variable_name)
+
+    def __eq__(self, other):
+        if not isinstance(other, ValueSet):
+            return NotImplemented
+        return self.values == other.values and self.variable_name == other.variable_name
+
+    def __hash__(self):
+        return hash((ValueSet, self.values, self.variable_name))
+
+
+def value_set(items):
+    """
+    Returns:
+        A ValueSet of the Number and String literals, None if some of the
+        items aren't literals
+    """
+    values = []
+    for item in items:
+        if not isinstance(item, (Number, String)) or not isinstance(item.operands[0], Value):
+            return None
+        if isinstance(item, Number):
+            values.append(int(item.operands[0].val))
+        else:
+            values.append(item.operands[0].val)
+    return ValueSet(values)
+
+
+def literal(value):
+    """
+    The Number or String literal of a Python value
+    """
+    if isinstance(value, int):
+        return Number(Value(str(value)))
+    return String(Value(value))
+
+
+def combine_selects(logical, left, right):
+    """
+    Combine the conditions of two Selects of the same relation, so the
+    relation is filtered in one pass rather than with set operations.
+
+    Args:
+        logical: And or Or
+    Returns:
+        None if they don't select from the same relation
+    """
+    if not isinstance(left, Select) or not isinstance(right, Select):
+        return None
+    if left.operands[0] != right.operands[0]:
+        return None
+    return Select(left.operands[0], logical(left.operands[1], right.operands[1]))
+
+
 class LessThan(Operation):
     name = '<'
     arity = Arity.binary
@@ -321,7 +487,7 @@ class LessThanEqual(Operation):
 
 
 class GreaterThanEqual(Operation):
-    name = '<='
+    name = '>='
     arity = Arity.binary
     infix = True
 
@@ -366,6 +532,15 @@ class Value(Symbol):
         self.val = val
 
 
+class Param(Symbol):
+    """
+    A literal whose value is bound when the query is run (see parameterize)
+    """
+    def __init__(self, index):
+        super().__init__('?{0}'.format(index))
+        self.index = index
+
+
 class String(Operation):
     name = 'S'
     arity = Arity.unary
@@ -443,6 +618,8 @@ def exp2op(exp):
 
 
 def pretty_print(ra):
+    import autopep8
+
     ra_string = str(ra)
 
     # TestA . val -> TestA.val
@@ -1,10 +1,18 @@
 """Relational Algebra optimizers.
 
 This module uses pattern matching to optimize relational algebra.
+
+The rules are compiled once into a many-to-one matcher, which tries all of
+them against a subexpression in a single pass. Subexpressions are rewritten
+outermost first until no rule matches, and each distinct subexpression is
+only rewritten once per query.
 """
 
 import logging
+import threading
+import time
 
+from . import intervals
 from .relational_algebra import (
     And,
     BoolFalse,
@@ -28,14 +36,19 @@ from .relational_algebra import (
     Union,
     UniverseSet,
     Value,
+    ValueSet,
+    literal,
     pretty_print,
 )
 
 from matchpy import (
     CustomConstraint,
+    ManyToOneMatcher,
+    Operation,
     Pattern,
     ReplacementRule,
     Wildcard,
+    create_operation_expression,
     replace_all,
 )
 
@@ -47,6 +60,8 @@ logger = logging.getLogger(__name__)
 # a_false = Wildcard.dot('a_false', BoolFalse)
 a_num = Wildcard.symbol('a_num', Value)
 b_num = Wildcard.symbol('b_num', Value)
+a_set = Wildcard.symbol('a_set', ValueSet)
+b_set = Wildcard.symbol('b_set', ValueSet)
 a = Wildcard.dot('a')
 b = Wildcard.dot('b')
 c = Wildcard.dot('c')
@@ -77,9 +92,22 @@ remove_empty_select = ReplacementRule(
     lambda a: a
 )
 
+"""
+σB(A)⋃σC(A) = σB∨C(A)
+One pass over A with a short-circuiting condition, rather than a pass per
+Select that then has to be sorted and merged.
+"""
 convert_union_into_select = ReplacementRule(
-    Pattern(Union(Select(a, b), Select(a, c))),
-    lambda a, b, c: Select(a, Or(b, c))
+    Pattern(Union(Select(a, b), Select(a, c), star)),
+    lambda a, b, c, star: Union(Select(a, Or(b, c)), *star)
+)
+
+"""
+σB(A)⋂σC(A) = σB⋀C(A)
+"""
+convert_intersection_into_select = ReplacementRule(
+    Pattern(Intersection(Select(a, b), Select(a, c), star)),
+    lambda a, b, c, star: Intersection(Select(a, And(b, c)), *star)
 )
 
 
@@ -143,13 +171,32 @@ join3 = ReplacementRule(
         Join(θ(a, Column(c, d)), θ(b, Column(e, f)))
 )
 
+
+def constraint_relation_in(a, star_a):
+    return a in star_a
+
+
+def without(operands, a):
+    """
+    The operands with one occurrence of a removed
+    """
+    operands = list(operands)
+    operands.remove(a)
+    return operands
+
+
 """
 σA(B)⋂B = σA(B)
-"""
 
+B is matched with a constraint rather than a wildcard operand, as a wildcard
+could also match any combination of the other operands (the operation is
+associative) which is exponential in the number of operands.
+"""
 intersection_select_of_same_relation = ReplacementRule(
-    Pattern(Intersection(a, Select(a, b), star_a)),
-    lambda a, b, star_a: Intersection(Select(a, b), *star_a)
+    Pattern(
+        Intersection(Select(a, b), star_a),
+        CustomConstraint(constraint_relation_in)),
+    lambda a, b, star_a: Intersection(Select(a, b), *without(star_a, a))
 )
 
 intersection_of_same_relation = ReplacementRule(
@@ -158,8 +205,10 @@ intersection_of_same_relation = ReplacementRule(
 )
 
 union_of_same_relation = ReplacementRule(
-    Pattern(Union(a, Select(a, b), star_a)),
-    lambda a, b, star_a: Union(a, *star_a)
+    Pattern(
+        Union(Select(a, b), star_a),
+        CustomConstraint(constraint_relation_in)),
+    lambda a, b, star_a: Union(*star_a)
 )
 
 """
@@ -218,21 +267,24 @@ combine_selects = ReplacementRule(
 #     lambda a, b, c, d: And(LessThan(Column(a, b), Number(c)))
 # )
 
-merge_less_thans = ReplacementRule(
-    Pattern(And(LessThan(a, Number(a_num)), LessThan(a, Number(b_num)), star)),
-    lambda a, a_num, b_num, star: And(LessThan(a, Number(a_num) if a_num < b_num else Number(b_num)), *star)
-)
-
 """
- x.y > a ⋀ x.y > b = x.y > a
-Combine comparators if one is superseded
-This is useful for removing redundant filters.
+Combine the comparisons of each column with literals into one interval, eg.
+x > 1 ⋀ x > 3 = x > 3, and σ(x > 5 ⋀ x < 3)(A) = ∅. See intervals.
 """
-merge_greater_thans = ReplacementRule(
-    Pattern(And(GreaterThan(a, Number(a_num)), GreaterThan(a, Number(b_num)), star)),
-    lambda a, a_num, b_num, star: And(GreaterThan(a, Number(a_num) if a_num > b_num else Number(b_num)), *star)
+merge_intervals = ReplacementRule(
+    Pattern(
+        Select(a, b),
+        CustomConstraint(lambda b: intervals.simplify(b) is not b)),
+    lambda a, b: simplified_select(a, intervals.simplify(b))
 )
 
+
+def simplified_select(a, condition):
+    if condition is None:
+        return EmptySet(relation=a)
+    return Select(a, condition)
+
+
 """
 """
 
@@ -281,7 +333,7 @@ a ∨ False = a
 """
 logic_or_false = ReplacementRule(
     Pattern(Or(BoolFalse(), plus_a)),
-    lambda plus_a: And(*plus_a)
+    lambda plus_a: Or(*plus_a)
 )
 
 """
@@ -327,8 +379,16 @@ push_select_down_cross = ReplacementRule(
 Convert X in (1 .. 9) to X = 1 or ... or X = 9
 """
 in_statement_2_ors = ReplacementRule(
-    Pattern(In(a, List(b, star_a))),
-    lambda a, b, star_a: Or(Equal(a, b), In(a, List(*star_a)))
+    Pattern(In(a, List(b, plus_a))),
+    lambda a, b, plus_a: Or(Equal(a, b), In(a, List(*plus_a)))
+)
+
+"""
+X in (1) is X = 1
+"""
+in_statement_single = ReplacementRule(
+    Pattern(In(a, List(b))),
+    lambda a, b: Equal(a, b)
 )
 
 """
@@ -340,6 +400,46 @@ in_statement_false = ReplacementRule(
 )
 
 
+"""
+X in {1} is X = 1
+Equalities can be pushed down, and joined on.
+"""
+in_set_single = ReplacementRule(
+    Pattern(
+        In(a, a_set),
+        CustomConstraint(lambda a_set: len(a_set.values) == 1)),
+    lambda a, a_set: Equal(a, literal(next(iter(a_set.values))))
+)
+
+"""
+X in {} is False
+"""
+in_set_false = ReplacementRule(
+    Pattern(
+        In(a, a_set),
+        CustomConstraint(lambda a_set: not a_set.values)),
+    lambda a, a_set: BoolFalse()
+)
+
+"""
+X in A ⋀ X in B = X in A⋂B
+"""
+and_in_sets = ReplacementRule(
+    Pattern(And(In(a, a_set), In(a, b_set), star)),
+    lambda a, a_set, b_set, star:
+        And(In(a, ValueSet(a_set.values & b_set.values)), *star)
+)
+
+"""
+X in A ∨ X in B = X in A⋃B
+"""
+or_in_sets = ReplacementRule(
+    Pattern(Or(In(a, a_set), In(a, b_set), star)),
+    lambda a, a_set, b_set, star:
+        Or(In(a, ValueSet(a_set.values | b_set.values)), *star)
+)
+
+
 """
 a ⋀ a = a
 """
@@ -371,6 +471,26 @@ false_becomes_emptyset = ReplacementRule(
     lambda: EmptySet()
 )
 
+"""
+False conditions have become ∅ by the time the Select, And or Or holding
+them is looked at again, eg. the intersection of disjoint IN lists:
+σ∅(A) = ∅, a ⋀ ∅ = ∅ and a ∨ ∅ = a
+"""
+select_empty_set = ReplacementRule(
+    Pattern(Select(a, EmptySet())),
+    lambda a: EmptySet(relation=a)
+)
+
+and_empty_set = ReplacementRule(
+    Pattern(And(EmptySet(), plus_a)),
+    lambda plus_a: EmptySet()
+)
+
+or_empty_set = ReplacementRule(
+    Pattern(Or(EmptySet(), plus_a)),
+    lambda plus_a: Or(*plus_a)
+)
+
 """
 ∅⋃A = A
 """
@@ -421,57 +541,303 @@ coerce_to_int = ReplacementRule(
 )
 
 
-def optimize(algebra):
-    rules = [
-        # cross_reduction,
-        # tautology,
-        # and_tautology,
-        cross_with_universe,
-        remove_empty_select,
-        convert_union_into_select,
-
-        logic_and_true,
-        logic_or_true,
-        logic_or_false,
-        intersect_true,
-
-        select_tautology,
-        equal_column_tautology,
-        intersection_select_of_same_relation,
-        intersection_of_same_relation,
-        union_of_same_relation,
-        union_of_equilvalent_selects,
-        intersection_of_equilvalent_selects,
-        union_of_same_relation_over_intersection,
-        combine_selects,
-        cross_plus_select_2_join,
-        join2,
-        # join3,
-
-        # Convenience
-        swap_comparison,
-
-        merge_greater_thans,
-        merge_less_thans,
-
-        # set
-        false_becomes_emptyset,
-        union_of_empty_set_is_ignored,
-        intersection_of_empty_set_is_empty_set,
-
-        push_select_down_cross,
-        # empty_union,
-        # shift_joins,
-
-        # IN (...)
-        in_statement_2_ors,
-        in_statement_false,
-
-        coerce_to_int,
-    ]
-    new_algebra = replace_all(algebra, rules)
+def constraint_is_int_column_with_strings(a, b, a_set):
+    if str not in a_set.types:
+        return False
+    return constraint_is_int_column(a, b, None)
+
+
+coerce_set_to_int = ReplacementRule(
+    Pattern(
+        In(Column(a, b), a_set),
+        CustomConstraint(constraint_is_int_column_with_strings)
+        ),
+    lambda a, b, a_set:
+        In(Column(a, b), ValueSet(map(int, a_set.values)))
+)
+
+
+# The matcher tries every rule at once, so they have no order of preference
+RULES = [
+    # cross_reduction,
+    # tautology,
+    # and_tautology,
+    cross_with_universe,
+    remove_empty_select,
+    convert_union_into_select,
+    convert_intersection_into_select,
+
+    logic_and_true,
+    logic_or_true,
+    logic_or_false,
+    intersect_true,
+
+    select_tautology,
+    equal_column_tautology,
+    intersection_select_of_same_relation,
+    intersection_of_same_relation,
+    union_of_same_relation,
+    union_of_equilvalent_selects,
+    # Covered by intersection_of_same_relation, and slow to match
+    # intersection_of_equilvalent_selects,
+    union_of_same_relation_over_intersection,
+    combine_selects,
+    cross_plus_select_2_join,
+    join2,
+    # join3,
+
+    # Convenience
+    swap_comparison,
+
+    merge_intervals,
+
+    # set
+    false_becomes_emptyset,
+    select_empty_set,
+    and_empty_set,
+    or_empty_set,
+    union_of_empty_set_is_ignored,
+    intersection_of_empty_set_is_empty_set,
+
+    push_select_down_cross,
+    # empty_union,
+    # shift_joins,
+
+    # IN (...)
+    in_statement_2_ors,
+    in_statement_single,
+    in_statement_false,
+    in_set_single,
+    in_set_false,
+    and_in_sets,
+    or_in_sets,
+
+    coerce_to_int,
+    coerce_set_to_int,
+]
+
+# Most rules applied to a query before giving up on reaching a fixed point
+MAX_REWRITES = 10000
+
+
+def compile_rules(rules):
+    """
+    Compile the rules' patterns into one matcher, so each subexpression is
+    matched against every rule in a single pass
+    """
+    matcher = ManyToOneMatcher()
+    for rule in rules:
+        matcher.add(rule.pattern, rule.replacement)
+    return matcher
+
+
+def size(expression):
+    """
+    Number of nodes in the expression
+    """
+    return sum(1 for _ in expression.preorder_iter())
+
+
+class Trace(object):
+    """
+    What the optimizer did to a query: each rewrite in order, with the rule
+    that made it, the size of the subexpression before and after and how long
+    finding the match took.
+
+    Every rule is matched at once (see compile_rules), so the time spent on
+    subexpressions that no rule matches can't be put down to any one rule.
+    """
+    def __init__(self, query=None):
+        self.query = query
+
+        # The plan came from the plan cache, so it wasn't optimized
+        self.cached = False
+
+        self.rewrites = []
+        self.unmatched = 0
+        self.unmatched_seconds = 0
+        self.seconds = 0
+
+    def rewrote(self, rule, before, after, seconds):
+        self.rewrites.append({
+            'rule': rule,
+            'before': size(before),
+            'after': size(after),
+            'match_ms': seconds * 1000,
+        })
+
+    def missed(self, seconds):
+        self.unmatched += 1
+        self.unmatched_seconds += seconds
+
+    def to_dict(self):
+        return {
+            'query': self.query,
+            'cached': self.cached,
+            'ms': self.seconds * 1000,
+            'rewrites': self.rewrites,
+            'unmatched': self.unmatched,
+            'unmatched_ms': self.unmatched_seconds * 1000,
+        }
+
+
+class RuleStats(object):
+    """
+    Totals of the Traces of every query optimized by a long running process,
+    eg. a server
+    """
+    def __init__(self):
+        self.queries = 0
+        self.rules = {}
+        self.unmatched = 0
+        self.unmatched_seconds = 0
+
+    def add(self, trace):
+        self.queries += 1
+        self.unmatched += trace.unmatched
+        self.unmatched_seconds += trace.unmatched_seconds
+        for rewrite in trace.rewrites:
+            counters = self.rules.setdefault(rewrite['rule'], {'hits': 0, 'match_ms': 0})
+            counters['hits'] += 1
+            counters['match_ms'] += rewrite['match_ms']
+
+    def stats(self):
+        return {
+            'queries': self.queries,
+            'rules': self.rules,
+            'unmatched': self.unmatched,
+            'unmatched_ms': self.unmatched_seconds * 1000,
+        }
+
+
+class Rewriter(object):
+    """
+    Apply the rules, outermost subexpressions first, until none match
+    """
+    def __init__(self, matcher, max_rewrites=MAX_REWRITES, trace=None):
+        self.matcher = matcher
+        self.max_rewrites = max_rewrites
+        self.rewrites = 0
+        self.trace = trace
+
+        # Operation to its rewritten form. Symbols aren't memoized because
+        # equal Tables can carry different relations.
+        self.memo = {}
+
+    def match(self, expression):
+        """
+        Returns:
+            The (replacement, substitution) of a rule that matches, None if
+            none do
+        """
+        for match in self.matcher.match(expression):
+            return match
+        return None
+
+    def rewrite(self, expression):
+        if isinstance(expression, Operation):
+            try:
+                return self.memo[expression]
+            except KeyError:
+                pass
+
+        result = expression
+        while True:
+            if self.max_rewrites <= self.rewrites:
+                logger.warning('Stopped optimizing after {} rewrites'.format(self.rewrites))
+                break
+
+            if self.trace is None:
+                match = self.match(result)
+            else:
+                start = time.perf_counter()
+                match = self.match(result)
+                seconds = time.perf_counter() - start
+
+            if match is not None:
+                replacement, substitution = match
+                before, result = result, replacement(**substitution)
+                self.rewrites += 1
+                if self.trace is not None:
+                    self.trace.rewrote(rule_name(replacement), before, result, seconds)
+                continue
+            elif self.trace is not None:
+                self.trace.missed(seconds)
+
+            if not isinstance(result, Operation):
+                break
+
+            # The operands might now match rules, and then so might we
+            operands = [self.rewrite(o) for o in result.operands]
+            if all(new is old for new, old in zip(operands, result.operands)):
+                break
+            result = create_operation_expression(result, operands)
+
+        if isinstance(expression, Operation):
+            self.memo[expression] = result
+        if isinstance(result, Operation):
+            self.memo[result] = result
+        return result
+
+
+# The name of each rule, by its replacement
+_rule_names = {
+    rule.replacement: name
+    for name, rule in list(globals().items())
+    if isinstance(rule, ReplacementRule)
+}
+
+
+def rule_name(replacement):
+    return _rule_names.get(replacement) or getattr(replacement, '__name__', repr(replacement))
+
+
+_matcher = compile_rules(RULES)
+
+# The matcher keeps the subjects of the match in progress, so queries are
+# matched one at a time
+_matcher_lock = threading.Lock()
+
+# RuleStats of every query optimized, see collect_rule_stats()
+rule_stats = None
+
+
+def collect_rule_stats():
+    """
+    Keep totals of the rules' rewrites from now on, eg. for a server
+    """
+    global rule_stats
+    if rule_stats is None:
+        rule_stats = RuleStats()
+    return rule_stats
+
+
+def optimize(algebra, trace=None):
+    """
+    Args:
+        trace: Trace to record the rewrites in
+    """
+    if trace is None and rule_stats is not None:
+        trace = Trace()
+
+    start = time.perf_counter()
+
+    with _matcher_lock:
+        try:
+            new_algebra = Rewriter(_matcher, trace=trace).rewrite(algebra)
+        finally:
+            # Matching commutative operations remembers every operand it has
+            # seen, keyed by equality. That would grow forever, and Tables are
+            # equal by name even when they carry a different query's relation.
+            _matcher.clear()
     new_algebra._tables = algebra._tables
 
-    logger.debug("Optimized RA:\n{}".format(pretty_print(new_algebra)))
+    if trace is not None:
+        trace.seconds = time.perf_counter() - start
+        if rule_stats is not None:
+            rule_stats.add(trace)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Optimized RA:\n{}".format(pretty_print(new_algebra)))
 
     return new_algebra
@@ -1,19 +1,20 @@
+import itertools
 import logging
 import re
 
-from antlr4 import CommonTokenStream, InputStream, Token
-from antlr4.error.ErrorListener import ErrorListener
 from functools import singledispatch
 
+from . import fastparse
 from .exception import (
     AmbiguousColumn,
     JoinHasNoOnClause,
+    NotGrouped,
     TableDoesNotExist,
     UnknownColumn,
 )
-from .grammar.mysql.MySqlLexer import MySqlLexer
-from .grammar.mysql.MySqlParser import MySqlParser
 from .relational_algebra import (
+    Aggregate,
+    And,
     BoolFalse,
     BoolTrue,
     Column,
@@ -22,29 +23,33 @@ from .relational_algebra import (
     Cross,
     Distinct,
     EmptySet,
-    Equal,
+    FullJoin,
     Function,
+    GroupBy,
     Intersection,
     Join,
     In,
     LeftJoin,
-    Like,
     Limit,
     List,
-    Null,
     Number,
     Offset,
     OneRowSet,
+    Or,
+    OrderBy,
     Project,
     QueryContext,
     RightJoin,
     Select,
+    SortKey,
     String,
     Table,
     TableMetaData,
     Theta,
     Union,
     UniverseSet,
+    ValueSet,
+    combine_selects,
     exp2op,
     pretty_print,
 )
@@ -54,43 +59,45 @@ from .relational_algebra import Value as V
 logger = logging.getLogger(__name__)
 
 
-class MyErrorListener(ErrorListener):
-    def __init__(self):
-        super(MyErrorListener, self).__init__()
-
-    def syntaxError(self, recognizer, offendingSymbol, line, column, msg, e):
-        logger.error('{} {} {} {}'.format(line, column, msg, e))
-        raise SyntaxError('{line}:{column}\n\t{msg}\n\t{sql}\n\t{error_cursor}'.format(
-            line=line,
-            column=column,
-            msg=msg,
-            sql=e.input.getText(),
-            error_cursor=' ' * column + '^',
-            ))
-
-    # def reportAmbiguity(self, recognizer, dfa, startIndex, stopIndex, exact, ambigAlts, configs):
-    #     raise Exception()
+def string_value(text):
+    """
+    The value of a string literal
+    """
+    if 2 <= len(text) and text[0] == "'" and text[-1] == "'":
+        return text[1:-1]
+    return text
 
-    # def reportAttemptingFullContext(self, recognizer, dfa, startIndex, stopIndex, conflictingAlts, configs):
-    #     raise Exception()
 
-    # def reportContextSensitivity(self, recognizer, dfa, startIndex, stopIndex, prediction, configs):
-    #     raise Exception()
+_statement_token_re = re.compile(r"""
+    '(?:[^'\\]|\\.|'')*'        # 'string'
+    |"(?:[^"\\]|\\.|"")*"       # "string"
+    |`[^`]*`                    # `identifier`
+    |(?P<comment>--(?=\s)[^\n]*|\#[^\n]*|/\*.*?\*/)
+    |(?P<end>;)
+    |[^'"`;#/-]+                # everything else
+    |.
+    """, re.VERBOSE | re.DOTALL)
 
 
-class CaseChangingCharStream(InputStream):
+def split_statements(sql_text):
     """
-    Allows grammar to parse case-insensitively
+    Split a SQL script into its statements. Comments are dropped.
+
+    Returns:
+        A list of statements without the trailing ;
     """
-    def LA(self, offset: int):
-        if offset == 0:
-            return 0  # undefined
-        if offset < 0:
-            offset += 1  # e.g., translate LA(-1) to use offset=0
-        pos = self._index + offset - 1
-        if pos < 0 or pos >= self._size:  # invalid
-            return Token.EOF
-        return ord(chr(self.data[pos]).upper())
+    statements = []
+    statement = []
+    for match in _statement_token_re.finditer(sql_text):
+        if match.group('comment'):
+            statement.append(' ')
+        elif match.group('end'):
+            statements.append(''.join(statement).strip())
+            statement = []
+        else:
+            statement.append(match.group())
+    statements.append(''.join(statement).strip())
+    return [s for s in statements if s]
 
 
 @singledispatch
@@ -102,122 +109,88 @@ def convert_where(ra, ctx):
 
 
 @convert_where.register
-def _(where: MySqlParser.BinaryComparasionPredicateContext, ctx):
-    left, op, right = where.getChildren()
-    func = exp2op(op.getText())
-    func = func(
-        convert_where(left, ctx),
-        convert_where(right, ctx),
-    )
-    return Select(ctx.relation, func)
-
-
-@convert_where.register
-def _(where: MySqlParser.PredicateExpressionContext, ctx):
-    return convert_where(where.predicate(), ctx)
+def _(where: fastparse.ColumnRef, ctx):
+    # HAVING can refer to the aliases of aggregates
+    if ctx.aggregates and where.text in ctx.aggregates:
+        return ctx.aggregates[where.text]
+    return ctx.instance._parse_column(where.text, ctx.relation)
 
 
 @convert_where.register
-def _(where: MySqlParser.ExpressionAtomPredicateContext, ctx):
-    return convert_where(where.expressionAtom(), ctx)
+def _(where: fastparse.AggregateRef, ctx):
+    if ctx.aggregates is None:
+        raise Exception('Invalid use of group function')
+    return ctx.instance._aggregate(where.function, where.distinct, where.column)
 
 
 @convert_where.register
-def _(where: MySqlParser.FullColumnNameExpressionAtomContext, ctx):
-    column = where.fullColumnName()
-    assert(isinstance(column, MySqlParser.FullColumnNameContext))
-    return ctx.instance._parse_column(column.getText(), ctx.relation)
-
-
-@convert_where.register
-def _(where: MySqlParser.ConstantExpressionAtomContext, ctx):
-    constant = where.constant()
-    if constant.decimalLiteral():
-        return Number(V(constant.getText()))
-
-    elif constant.stringLiteral():
-        text = re.sub(r"^'(.*)'$", r'\1', constant.getText())
-        return String(V(text))
-
-    elif constant.booleanLiteral():
-        if constant.booleanLiteral().FALSE():
-            return BoolFalse()
-        elif constant.booleanLiteral().TRUE():
-            return BoolTrue()
-        else:
-            raise NotImplementedError
-
-    elif constant.nullLiteral:
-        return Null()
+def _(where: fastparse.Constant, ctx):
+    if where.kind == 'number':
+        return Number(V(where.text))
+    elif where.kind == 'string':
+        return String(V(string_value(where.text)))
+    elif where.kind == 'bool':
+        return BoolTrue() if where.text == 'TRUE' else BoolFalse()
     else:
         raise NotImplementedError
 
 
 @convert_where.register
-def _(where: MySqlParser.LogicalExpressionContext, ctx):
-    if where.orLogicalOperator():
-        left, right = where.expression()
-        return Union(
-            convert_where(left, ctx),
-            convert_where(right, ctx),
-        )
-    elif where.andLogicalOperator():
-        left, right = where.expression()
-        return Intersection(
-            convert_where(left, ctx),
-            convert_where(right, ctx),
-        )
-    else:
-        raise NotImplementedError
+def _(where: fastparse.Comparison, ctx):
+    func = exp2op(where.op)
+    func = func(
+        convert_where(where.left, ctx),
+        convert_where(where.right, ctx),
+    )
+    return Select(ctx.relation, func)
 
 
 @convert_where.register
-def _(where: MySqlParser.NestedExpressionAtomContext, ctx):
-    expression = where.expression()
-    assert(len(expression) == 1)
-    return convert_where(expression[0], ctx)
+def _(where: fastparse.InList, ctx):
+    left = convert_where(where.left, ctx)
+    right = List(*[convert_where(item, ctx) for item in where.items])
+    return Select(ctx.relation, In(left, right))
 
 
 @convert_where.register
-def _(where: MySqlParser.InPredicateContext, ctx):
-    """
-    X in (...)
-    """
-    left = convert_where(where.predicate(), ctx)
-    right = List(*[
-        convert_where(exp, ctx)
-        for exp in where.expressions().expression()
-    ])
+def _(where: fastparse.InValues, ctx):
+    left = convert_where(where.left, ctx)
+    right = ValueSet(itertools.chain(where.numbers, map(string_value, where.strings)))
     return Select(ctx.relation, In(left, right))
 
 
-@convert_where.register
-def _(where: MySqlParser.LikePredicateContext, ctx):
+def logical(op, left, right):
     """
-    eg. relname like '%'
+    OR or AND two relations.
+    Selects of the same relation become one Select, so that its rows are
+    filtered in a single pass. Set operations are only needed otherwise.
     """
-
-    left = convert_where(where.predicate()[0], ctx)
-    right = convert_where(where.predicate()[1], ctx)
-
-    # Optimization: If the right has no wildcard convert to Equal
-    if '%' not in right.val:
-        return Select(ctx.relation, Equal(left, right))
-
-    return Select(ctx.relation, Like(left, right))
+    if op == 'OR':
+        select = combine_selects(Or, left, right)
+        return Union(left, right) if select is None else select
+    elif op == 'AND':
+        select = combine_selects(And, left, right)
+        return Intersection(left, right) if select is None else select
+    else:
+        raise NotImplementedError
 
 
 @convert_where.register
-def _(where: MySqlParser.ScalarFunctionCallContext, ctx):
-    func_name = where.scalarFunctionName().getText()
-    # TODO: parse args
-    return Function(String(V(func_name)))
+def _(where: fastparse.Logical, ctx):
+    return logical(
+        where.op,
+        convert_where(where.left, ctx),
+        convert_where(where.right, ctx),
+    )
 
 
 class RelationalAlgebraParser(object):
-    def __init__(self, sql_txt, available_tables):
+    def __init__(self, sql_txt, available_tables, fast_path=True):
         self.sql_txt = sql_txt
 
+        # Try fastparse before falling back to ANTLR
+        self.fast_path = fast_path
+
         self.available_tables = available_tables
 
         # Track the tables in the SQL query
@@ -227,6 +200,10 @@ class RelationalAlgebraParser(object):
 
         self.table_order = []
 
+        # The Aggregate of each (function, distinct, column) and of each alias
+        self.aggregates = {}
+        self.aggregate_aliases = {}
+
     def _parse_table_source(self, node):
         if node.tableSourceItem().alias:
             table_alias = node.tableSourceItem().alias.getText()
@@ -234,8 +211,10 @@ class RelationalAlgebraParser(object):
             table_alias = ''
 
         table_name = node.tableSourceItem().tableName().getText()
-        table_name = table_name.replace('`', '')
+        return self._table_source(table_name, table_alias)
 
+    def _table_source(self, table_name, table_alias):
+        table_name = table_name.replace('`', '')
         return self._register_table(table_name, table_alias)
 
     def _parse_function_call(self, node):
@@ -244,6 +223,8 @@ class RelationalAlgebraParser(object):
         # node.functionArgs()
 
     def _parse_SELECT(self, select, ctx):
+        from .grammar.mysql.MySqlParser import MySqlParser
+
         from_ = select.querySpecification().fromClause()
 
         if from_:
@@ -259,8 +240,15 @@ class RelationalAlgebraParser(object):
 
             # TODO: move into dispatch
 
+            # Aggregates: SELECT COUNT(*)
+            if isinstance(element, MySqlParser.SelectFunctionElementContext) and \
+                    isinstance(element.functionCall(), MySqlParser.AggregateFunctionCallContext):
+                alias = element.uid().getText() if element.uid() else ''
+                aggregate = self._parse_aggregate_call(element.functionCall(), alias)
+                select_columns.append(ColumnName(aggregate.column_identifier))
+
             # Functions: SELECT ABS(1)
-            if isinstance(element, MySqlParser.SelectFunctionElementContext):
+            elif isinstance(element, MySqlParser.SelectFunctionElementContext):
 
                 if isinstance(relation, EmptySet):
                     relation = OneRowSet()
@@ -269,18 +257,13 @@ class RelationalAlgebraParser(object):
 
             # Constants: SELECT '1'
             elif isinstance(element, MySqlParser.SelectExpressionElementContext):
-                # TODO: replace with actual constant
-                func = Function(String(V("constant")), convert_where(element.expression(), ctx))
-                select_columns.append(func)
+                select_columns.append(self._constant_column(element.expression(), ctx))
                 if isinstance(relation, EmptySet):
                     relation = OneRowSet()
 
             # Star: SELECT a.*
             elif isinstance(element, MySqlParser.SelectStarElementContext):
-                table_alias = element.fullId().getText()
-                table = self.table_aliases[table_alias]
-                table = self.available_tables.get(table.name)
-                select_columns.extend(map(ColumnName, [c.identifier for c in table.columns.columns]))
+                select_columns.extend(self._star_columns(element.fullId().getText()))
 
             else:
                 try:
@@ -295,41 +278,262 @@ class RelationalAlgebraParser(object):
 
                 select_columns.append(ColumnName(column_name))
 
-        if select_columns:
-            relation = Project(relation, *select_columns)
-        else:
-            # If there are no columns specified in SELECT then we want to base
-            # the order of the columns on the table order.
-            select_columns = []
-            for table in self.table_order:
-                table = self.available_tables.get(table.name)
-                select_columns.extend([c.identifier for c in table.columns.columns])
-
-            assert(select_columns)
-
-            relation = Project(relation, *map(ColumnName, select_columns))
-
-        # Apply DISTINCT
+        distinct = False
         if select.querySpecification().selectSpec():
             assert(len(select.querySpecification().selectSpec()) == 1)
-            if select.querySpecification().selectSpec()[0].getText().upper() == 'DISTINCT':
-                relation = Distinct(relation)
+            distinct = select.querySpecification().selectSpec()[0].getText().upper() == 'DISTINCT'
+
+        group_by = []
+        having = None
+        if from_:
+            group_by = [self._parse_column_expression(item.expression(), 'GROUP BY') for item in from_.groupByItem()]
+            if from_.havingExpr:
+                having = self._having(from_.havingExpr, ctx)
 
-        # select.querySpecification().orderByClause
+        sort_keys = []
+        order_by_clause = select.querySpecification().orderByClause()
+        if order_by_clause:
+            for expression in order_by_clause.orderByExpression():
+                column = self._parse_column_expression(expression.expression(), 'ORDER BY')
+                sort_keys.append(self._sort_key(column, bool(expression.DESC()), None))
+
+        relation = self._group(relation, select_columns, group_by, having)
+        relation = self._order_and_project(relation, select_columns, distinct, sort_keys)
 
         # LIMIT
         limit_clause = select.querySpecification().limitClause()
         if limit_clause:
-            try:
-                offset, limit = map(lambda x: int(x.getText()), limit_clause.decimalLiteral())
-            except ValueError:
-                limit = int(limit_clause.decimalLiteral()[0].getText())
+            literals = (limit_clause.offset, limit_clause.limit)
+            relation = self._limit(relation, [x.getText() for x in literals if x is not None])
+
+        return relation
+
+    def _parse_column_expression(self, expression, clause):
+        """
+        The name of a column, or the Aggregate of an aggregate function call
+        """
+        from .grammar.mysql.MySqlParser import MySqlParser
+
+        try:
+            atom = expression.predicate().expressionAtom()
+            if isinstance(atom, MySqlParser.FunctionCallExpressionAtomContext) and \
+                    isinstance(atom.functionCall(), MySqlParser.AggregateFunctionCallContext):
+                return self._parse_aggregate_call(atom.functionCall())
+            return atom.fullColumnName().getText()
+        except AttributeError:
+            raise NotImplementedError('{} {}'.format(clause, expression.getText()))
+
+    def _parse_aggregate_call(self, node, alias=''):
+        from .grammar.mysql.MySqlParser import MySqlParser
+
+        function = node.aggregateWindowedFunction()
+        function_name = function.getChild(0).getText().upper()
+        if function_name not in fastparse._aggregate_functions:
+            raise NotImplementedError(function_name)
+        if function.starArg:
+            return self._aggregate(function_name, False, None, alias)
+
+        distinct = function.aggregator is not None and function.aggregator.text.upper() == 'DISTINCT'
+        args = function.functionArg() or function.functionArgs()
+        if args.getChildCount() != 1 or not isinstance(args.getChild(0), MySqlParser.FullColumnNameContext):
+            raise NotImplementedError(node.getText())
+        return self._aggregate(function_name, distinct, args.getChild(0).getText(), alias)
+
+    def _parse_fast_SELECT(self, query, ctx):
+        """
+        Convert a fastparse.Query into RA
+        """
+        if query.tables:
+            relation = self._parse_fast_FROM(query, ctx)
+        else:
+            relation = EmptySet()
+
+        select_columns = []
+        for element in query.elements:
+            if isinstance(element, fastparse.Constant):
+                select_columns.append(self._constant_column(element, ctx))
+                if isinstance(relation, EmptySet):
+                    relation = OneRowSet()
+            elif isinstance(element, fastparse.StarElement):
+                select_columns.extend(self._star_columns(element.alias))
+            elif isinstance(element, fastparse.AggregateElement):
+                aggregate = self._aggregate(*element.aggregate, alias=element.alias)
+                select_columns.append(ColumnName(aggregate.column_identifier))
             else:
-                relation = Offset(relation, Number(V(offset)))
-            relation = Limit(relation, Number(V(limit)))
+                select_columns.append(ColumnName(element.text))
+
+        having = None
+        if query.having is not None:
+            having = self._having(query.having, ctx)
+
+        sort_keys = []
+        for column, descending, nulls_first in query.order_by:
+            if isinstance(column, fastparse.AggregateRef):
+                column = self._aggregate(*column)
+            sort_keys.append(self._sort_key(column, descending, nulls_first))
+
+        relation = self._group(relation, select_columns, query.group_by, having)
+        relation = self._order_and_project(relation, select_columns, query.distinct, sort_keys)
+
+        if query.limit:
+            relation = self._limit(relation, query.limit)
 
         return relation
 
+    def _constant_column(self, expression, ctx):
+        # TODO: replace with actual constant
+        return Function(String(V("constant")), convert_where(expression, ctx))
+
+    def _star_columns(self, table_alias):
+        table = self.table_aliases[table_alias]
+        table = self.available_tables.get(table.name)
+        return list(map(ColumnName, [c.identifier for c in table.columns.columns]))
+
+    def _all_columns(self):
+        """
+        The columns of SELECT *, in the order of the tables
+        """
+        select_columns = []
+        for table in self.table_order:
+            table = self.available_tables.get(table.name)
+            select_columns.extend([c.identifier for c in table.columns.columns])
+        return select_columns
+
+    def _project(self, relation, select_columns):
+        if select_columns:
+            return Project(relation, *select_columns)
+
+        # If there are no columns specified in SELECT then we want to base
+        # the order of the columns on the table order.
+        select_columns = self._all_columns()
+
+        assert(select_columns)
+
+        return Project(relation, *map(ColumnName, select_columns))
+
+    def _aggregate(self, function_name, distinct, column_name, alias=''):
+        """
+        The same Aggregate for each call of a function on a column, so it's
+        only computed once. Its column is named by the first call's alias,
+        otherwise like the call, eg. SUM(val).
+
+        Args:
+            column_name: None for COUNT(*)
+        """
+        function_name = function_name.upper()
+        column = V('*') if column_name is None else self._parse_column(column_name, None)
+        key = (function_name, distinct, column)
+        try:
+            aggregate = self.aggregates[key]
+        except KeyError:
+            name = alias or '{}({}{})'.format(
+                function_name,
+                'DISTINCT ' if distinct else '',
+                '*' if column_name is None else column.operands[1].name)
+
+            # eg. SUM(a.val) and SUM(b.val)
+            names = {a.column_identifier for a in self.aggregates.values()}
+            identifier = name
+            for i in itertools.count(2):
+                if identifier not in names:
+                    break
+                identifier = '{}_{}'.format(name, i)
+
+            aggregate = Aggregate(
+                V(function_name),
+                V('DISTINCT' if distinct else 'ALL'),
+                column,
+                V(identifier))
+            self.aggregates[key] = aggregate
+
+        if alias:
+            self.aggregate_aliases[alias] = aggregate
+        return aggregate
+
+    def _having(self, having, ctx):
+        """
+        The condition of HAVING, which can use aggregates and their aliases
+        """
+        ctx = ctx.clone()
+        ctx.instance = self
+        ctx.aggregates = self.aggregate_aliases
+        select = convert_where(having, ctx)
+        if not isinstance(select, Select):
+            raise NotImplementedError('HAVING {}'.format(select))
+        return select.operands[1]
+
+    def _group(self, relation, select_columns, group_by, having):
+        """
+        Group the rows by the GROUP BY columns and compute the aggregates of
+        each group. With aggregates but no GROUP BY all rows are one group.
+        The other selected columns have to be grouped by.
+        """
+        if not group_by and not self.aggregates:
+            if having is not None:
+                relation = Select(relation, having)
+            return relation
+
+        keys = [self._parse_column(column_name, None) for column_name in group_by]
+        grouped = {key.column_identifier for key in keys}
+        aggregated = {a.column_identifier for a in self.aggregates.values()}
+        if select_columns:
+            names = [c.name for c in select_columns if isinstance(c, ColumnName)]
+        else:
+            names = self._all_columns()
+        for name in names:
+            if name not in aggregated and self._parse_column(name, None).column_identifier not in grouped:
+                raise NotGrouped(name)
+
+        relation = GroupBy(relation, *keys, *self.aggregates.values())
+        if having is not None:
+            relation = Select(relation, having)
+        return relation
+
+    def _sort_key(self, column, descending, nulls_first):
+        """
+        NULLs are smaller than any value unless NULLS FIRST/LAST says otherwise
+
+        Args:
+            column: A column's name, an aggregate's alias or an Aggregate
+        """
+        if nulls_first is None:
+            nulls_first = not descending
+        if isinstance(column, str):
+            column = self.aggregate_aliases.get(column) or self._parse_column(column, None)
+        return SortKey(
+            column,
+            V('DESC' if descending else 'ASC'),
+            V('NULLS FIRST' if nulls_first else 'NULLS LAST'))
+
+    def _order_and_project(self, relation, select_columns, distinct, sort_keys):
+        """
+        Rows are ordered before they're projected, so that they can be
+        ordered by columns that aren't selected. DISTINCT rows are ordered
+        afterwards, they can only be ordered by the selected columns.
+        """
+        if sort_keys and not distinct:
+            relation = OrderBy(relation, *sort_keys)
+
+        relation = self._project(relation, select_columns)
+
+        if distinct:
+            relation = Distinct(relation)
+            if sort_keys:
+                relation = OrderBy(relation, *sort_keys)
+        return relation
+
+    def _limit(self, relation, literals):
+        """
+        Apply LIMIT [offset,] limit
+        """
+        try:
+            offset, limit = map(int, literals)
+        except ValueError:
+            limit = int(literals[0])
+        else:
+            relation = Offset(relation, Number(V(offset)))
+        return Limit(relation, Number(V(limit)))
+
     def _parse_JOIN(self, node, ctx):
         # alias_obj.simpleId().getText()
 
@@ -342,11 +546,14 @@ class RelationalAlgebraParser(object):
             raise NotImplementedError('{} operator unsupported for joins'.format(
                 join_on_expr.comparisonOperator().getText()))
 
-        column_identifier = join_on_expr.left.expressionAtom().fullColumnName().getText()
-        col1 = self._parse_column(column_identifier, None)
+        return self._join_columns(
+            join_on_expr.left.expressionAtom().fullColumnName().getText(),
+            join_on_expr.right.expressionAtom().fullColumnName().getText(),
+            ctx)
 
-        column_identifier = join_on_expr.right.expressionAtom().fullColumnName().getText()
-        col2 = self._parse_column(column_identifier, None)
+    def _join_columns(self, left_identifier, right_identifier, ctx):
+        col1 = self._parse_column(left_identifier, None)
+        col2 = self._parse_column(right_identifier, None)
 
         if hasattr(ctx.relation, 'table_identifier'):
             if col1.table_identifier != ctx.relation.table_identifier:
@@ -355,6 +562,8 @@ class RelationalAlgebraParser(object):
         return col1, col2
 
     def _parse_FROM(self, node, ctx):
+        from .grammar.mysql.MySqlParser import MySqlParser
+
         # Get FROM  tables
 
         relation = UniverseSet()
@@ -367,67 +576,30 @@ class RelationalAlgebraParser(object):
         ctx.relation = relation
 
         # Parse JOINs
-        joins = node.tableSources().tableSource()[0].joinPart()
-        if joins:
-            for join in joins:
-                if isinstance(join, MySqlParser.OuterJoinContext):
-                    if join.LEFT():
-                        join_relation = self._parse_table_source(join)
-                        try:
-                            col1, col2 = self._parse_JOIN(join, ctx)
-                        except JoinHasNoOnClause:
-                            ctx.relation = Cross(relation, join_relation)
-                        else:
-                            relation = LeftJoin(
-                                Theta(relation, col1),
-                                Theta(join_relation, col2))
-                            ctx.relation = relation
-                    elif join.RIGHT():
-                        join_relation = self._parse_table_source(join)
-                        try:
-                            col1, col2 = self._parse_JOIN(join, ctx)
-                        except JoinHasNoOnClause:
-                            ctx.relation = Cross(relation, join_relation)
-                        else:
-                            relation = RightJoin(
-                                Theta(relation, col1),
-                                Theta(join_relation, col2))
-                            ctx.relation = relation
-                    else:
-                        raise NotImplementedError()
-                elif isinstance(join, MySqlParser.InnerJoinContext):
-                    if join.INNER() or join.JOIN():
-                        join_relation = self._parse_table_source(join)
-                        try:
-                            col1, col2 = self._parse_JOIN(join, ctx)
-                        except JoinHasNoOnClause:
-                            ctx.relation = Cross(relation, join_relation)
-                        else:
-                            if col1.table_identifier == join_relation.table_identifier:
-                                col1, col2 = col2, col1
-                            relation = Join(
-                                Theta(relation, col1),
-                                Theta(join_relation, col2))
-                            ctx.relation = relation
-
-                    elif join.CROSS():
-                        join_relation = self._parse_table_source(join)
-                        try:
-                            col1, col2 = self._parse_JOIN(join, ctx)
-                        except JoinHasNoOnClause:
-                            ctx.relation = Cross(relation, join_relation)
-                        else:
-                            relation = Join(
-                                Theta(relation, col1),
-                                Theta(join_relation, col2))
-                            ctx.relation = relation
-                    else:
-                        raise NotImplementedError(join.getText())
+        for join in node.tableSources().tableSource()[0].joinPart():
+            if isinstance(join, MySqlParser.OuterJoinContext):
+                if join.LEFT():
+                    kind = 'LEFT'
+                elif join.RIGHT():
+                    kind = 'RIGHT'
                 else:
-                    raise NotImplementedError(join.getText())
+                    raise NotImplementedError()
+            elif isinstance(join, MySqlParser.InnerJoinContext):
+                kind = 'INNER'
+            else:
+                raise NotImplementedError(join.getText())
+
+            join_relation = self._parse_table_source(join)
+            self.table_order.append(join_relation)
+            try:
+                col1, col2 = self._parse_JOIN(join, ctx)
+            except JoinHasNoOnClause:
+                ctx.relation = Cross(relation, join_relation)
+            else:
+                relation = self._join(kind, relation, join_relation, col1, col2)
+                ctx.relation = relation
 
-            # TODO: multiple joins
-            # TODO: LEFT OUTER JOIN
+        # TODO: multiple joins
 
         # Do WHERE
         if not node.whereExpr:
@@ -435,6 +607,55 @@ class RelationalAlgebraParser(object):
 
         return self._parse_WHERE(node.whereExpr, ctx)
 
+    def _parse_fast_FROM(self, query, ctx):
+        relation = UniverseSet()
+
+        for table_ref in query.tables:
+            table = self._table_source(table_ref.name, table_ref.alias)
+            self.table_order.append(table)
+            relation = Cross(relation, table)
+
+        ctx.relation = relation
+
+        for join in query.joins:
+            join_relation = self._table_source(join.table.name, join.table.alias)
+            self.table_order.append(join_relation)
+            col1, col2 = self._join_columns(join.left, join.right, ctx)
+            relation = self._join(join.kind, relation, join_relation, col1, col2)
+            ctx.relation = relation
+
+        if query.where is None:
+            return ctx.relation
+
+        return self._parse_WHERE(query.where, ctx)
+
+    def _join(self, kind, relation, join_relation, col1, col2):
+        """
+        Join on col1 = col2
+
+        A CROSS JOIN with an ON clause is an INNER JOIN
+        """
+        if kind == 'LEFT':
+            return LeftJoin(
+                Theta(relation, col1),
+                Theta(join_relation, col2))
+        elif kind == 'RIGHT':
+            return RightJoin(
+                Theta(relation, col1),
+                Theta(join_relation, col2))
+        elif kind == 'FULL':
+            return FullJoin(
+                Theta(relation, col1),
+                Theta(join_relation, col2))
+        elif kind in ('INNER', 'CROSS'):
+            if col1.table_identifier == join_relation.table_identifier:
+                col1, col2 = col2, col1
+            return Join(
+                Theta(relation, col1),
+                Theta(join_relation, col2))
+        else:
+            raise NotImplementedError(kind)
+
     def _parse_WHERE(self, where, ctx):
         ctx.instance = self
         return convert_where(where, ctx)
@@ -443,19 +664,21 @@ class RelationalAlgebraParser(object):
         """
         Convert AST into RA
         """
-        sql_txt = self.sql_txt
-
-        input = CaseChangingCharStream(sql_txt)
-        lexer = MySqlLexer(input)
-        stream = CommonTokenStream(lexer)
-        parser = MySqlParser(stream)
-        parser._listeners = [MyErrorListener()]
-
-        tree = parser.root()
-
         ctx = QueryContext()
         self.ctx = ctx
 
+        if self.fast_path:
+            try:
+                query = fastparse.parse(self.sql_txt)
+            except fastparse.Unsupported as e:
+                logger.debug('Not using fast path: {}'.format(e))
+            else:
+                return self._parse_fast_SELECT(query, ctx)
+
+        # ANTLR is slow to import, so only import it when we need it
+        from . import antlr2ra
+        tree = antlr2ra.parse_tree(self.sql_txt)
+
         select = tree.sqlStatements().sqlStatement()[0].dmlStatement().selectStatement()
         return self._parse_SELECT(select, ctx)
 
@@ -539,14 +762,15 @@ class RelationalAlgebraParser(object):
         return Column(_table, ColumnName(col.name))
 
 
-def sql2ra(antlr, available_tables):
+def sql2ra(antlr, available_tables, fast_path=True):
     from .relational_algebra_optimizers import remove_universe_set
 
-    parser = RelationalAlgebraParser(antlr, available_tables)
+    parser = RelationalAlgebraParser(antlr, available_tables, fast_path)
     ra = parser.parse()
     ra = remove_universe_set(ra)
     ra._tables = parser._tables_encountered
 
-    logger.debug("RA:\n{}".format(pretty_print(ra)))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("RA:\n{}".format(pretty_print(ra)))
 
     return ra
@@ -0,0 +1,232 @@
+"""Table statistics.
+
+Row count and, for each column, the number of distinct values, the smallest
+and largest value and the fraction of NULLs.
+
+Tables can declare these cheaply with a `statistics()` method that returns
+TableStatistics, or with `row_count` and `distinct_counts` ({column name:
+count}) attributes. Anything a table declares is taken at its word.
+
+Tables that are cheap to scan more than once can set `collect_statistics =
+True` to have their statistics collected by sampling the first SAMPLE_SIZE
+rows of a scan, these are cached for TTL seconds. Any other table would be
+read once by the planner and again by the query, so nothing is known about it
+and the planner falls back to its default estimates.
+"""
+
+import itertools
+import logging
+import time
+
+from . import table
+
+
+logger = logging.getLogger(__name__)
+
+# Rows read when collecting statistics
+SAMPLE_SIZE = 10000
+
+# Seconds that collected statistics are trusted for
+TTL = 300
+
+
+class ColumnStatistics(object):
+    def __init__(self, distinct_count=None, min=None, max=None, null_fraction=None):
+        self.distinct_count = distinct_count
+        self.min = min
+        self.max = max
+        self.null_fraction = null_fraction
+
+    def __eq__(self, other):
+        return vars(self) == vars(other)
+
+    def __repr__(self):
+        return 'ColumnStatistics({})'.format(
+            ', '.join('{}={!r}'.format(k, v) for k, v in vars(self).items() if v is not None))
+
+
+class TableStatistics(object):
+    """
+    Unknown values are None
+    """
+    def __init__(self, row_count=None, columns=None, sampled=False):
+        self.row_count = row_count
+        self.columns = columns or {}
+
+        # True if row_count is only a lower bound because the sample didn't
+        # reach the end of the table
+        self.sampled = sampled
+
+    def column(self, name):
+        return self.columns.get(name) or ColumnStatistics()
+
+    def __repr__(self):
+        return 'TableStatistics(row_count={!r}, columns={!r}, sampled={!r})'.format(
+            self.row_count, self.columns, self.sampled)
+
+    def __str__(self):
+        if self.row_count is None:
+            return 'rows: ?'
+        return 'rows: {}{}'.format(self.row_count, '+' if self.sampled else '')
+
+
+def declared(tabl):
+    """
+    Returns:
+        The statistics the table declares, None if it doesn't declare any
+    """
+    if callable(getattr(tabl, 'statistics', None)):
+        return tabl.statistics()
+
+    row_count = getattr(tabl, 'row_count', None)
+    distinct_counts = getattr(tabl, 'distinct_counts', None)
+    if row_count is None and distinct_counts is None:
+        return None
+    return TableStatistics(
+        row_count=row_count,
+        columns={
+            name: ColumnStatistics(distinct_count=count)
+            for name, count in (distinct_counts or {}).items()
+        })
+
+
+def row_values(row):
+    """
+    LMDB tables produce pointers to ctypes structs rather than tuples
+    """
+    if hasattr(row, 'contents'):
+        row = row.contents
+        return [getattr(row, name) for name, _ in row._fields_]
+    return row
+
+
+def collect(tabl, sample_size=SAMPLE_SIZE):
+    """
+    Scan up to sample_size rows of the table
+    """
+    names = [name for name, _ in tabl.column_metadata]
+    distinct = [set() for _ in names]
+    nulls = [0 for _ in names]
+    mins = [None for _ in names]
+    maxs = [None for _ in names]
+
+    # Columns whose values we can't hash or order
+    unhashable = set()
+    unordered = set()
+
+    rows = 0
+    it = iter(tabl.produce())
+    try:
+        for row in itertools.islice(it, sample_size):
+            rows += 1
+            for i, value in enumerate(row_values(row)):
+                if value is None:
+                    nulls[i] += 1
+                    continue
+
+                if i not in unhashable:
+                    try:
+                        distinct[i].add(value)
+                    except TypeError:
+                        unhashable.add(i)
+
+                if i not in unordered:
+                    try:
+                        if mins[i] is None or value < mins[i]:
+                            mins[i] = value
+                        if maxs[i] is None or maxs[i] < value:
+                            maxs[i] = value
+                    except TypeError:
+                        unordered.add(i)
+    finally:
+        close = getattr(it, 'close', None)
+        if close:
+            close()
+
+    columns = {}
+    for i, name in enumerate(names):
+        columns[name] = ColumnStatistics(
+            distinct_count=None if i in unhashable else len(distinct[i]),
+            min=None if i in unordered else mins[i],
+            max=None if i in unordered else maxs[i],
+            null_fraction=nulls[i] / rows if rows else None,
+        )
+
+    stats = TableStatistics(row_count=rows, columns=columns, sampled=rows == sample_size)
+    logger.debug('Collected statistics for {}: {}'.format(tabl.name, stats))
+    return stats
+
+
+class StatisticsCache(object):
+    """
+    Collected statistics by table name, each trusted for ttl seconds
+    """
+    def __init__(self, ttl=TTL, sample_size=SAMPLE_SIZE, clock=time.monotonic):
+        self.ttl = ttl
+        self.sample_size = sample_size
+        self.clock = clock
+        self.entries = {}
+        self.tables_version = table._tables_version
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _check_tables_version(self):
+        """
+        A re-registered table may hold different data
+        """
+        if self.tables_version != table._tables_version:
+            self.clear()
+            self.tables_version = table._tables_version
+
+    def peek(self, tabl):
+        """
+        Statistics without collecting them
+
+        Returns:
+            None if the table doesn't declare any and none are cached
+        """
+        stats = declared(tabl)
+        if stats is not None:
+            return stats
+
+        self._check_tables_version()
+        try:
+            expires, stats = self.entries[tabl.name]
+        except KeyError:
+            return None
+        if expires <= self.clock():
+            return None
+        return stats
+
+    def get(self, tabl):
+        """
+        Statistics for the table, collecting them if the table allows it
+        """
+        stats = self.peek(tabl)
+        if stats is not None:
+            return stats
+
+        if not getattr(tabl, 'collect_statistics', False):
+            return TableStatistics()
+
+        stats = collect(tabl, self.sample_size)
+        self.entries[tabl.name] = (self.clock() + self.ttl, stats)
+        return stats
+
+    def invalidate(self, name):
+        self.entries.pop(name, None)
+
+    def clear(self):
+        self.entries.clear()
+
+
+statistics_cache = StatisticsCache()
+
+
+def get(tabl):
+    return statistics_cache.get(tabl)
+
+
+def peek(tabl):
+    return statistics_cache.peek(tabl)
@@ -1,9 +1,7 @@
+import collections
 import ctypes
 import importlib
-import lmdb
-import numpy
 import re
-import sqlalchemy
 
 from . import column
 from . import iterator
@@ -15,6 +13,22 @@ from .exception import (
 
 _tables = {}
 
+# A condition on one of a table's columns, eg. Predicate('region', '=', 'x').
+# The operator is one of =, !=, <, <=, >, >= or in (the value is a tuple).
+Predicate = collections.namedtuple('Predicate', ['column', 'operator', 'value'])
+
+# Bumped whenever a table is registered so that cached plans can tell when a
+# table name might refer to something else
+_tables_version = 0
+
+
+def open_db():
+    """
+    Open our LMDB database
+    """
+    import lmdb
+    return lmdb.open('sqlhild.lmdb', max_dbs=255)
+
 
 # FIXME: replace with setup tools
 class TableWatcher(type):
@@ -23,7 +37,9 @@ class TableWatcher(type):
     """
 
     def __init__(cls, name, bases, clsdict):
+        global _tables_version
         # logging.debug("Registering table: {0}".format(name))
+        _tables_version += 1
         try:
             _tables[cls._name] = cls
         except AttributeError:
@@ -34,6 +50,10 @@ class TableWatcher(type):
 class AbstractTable(iterator.Iterator):
     tuples = False
 
+    # The columns produce() yields rows in the order of, eg. ['id', 'name DESC'].
+    # The planner doesn't sort rows that are already in the order it needs.
+    sort_order = ()
+
     """
     Used in FROM and JOIN clauses
     """
@@ -52,6 +72,12 @@ class AbstractTable(iterator.Iterator):
             self.columns.append(
                 column_identifier=self.identifier + '.' + c[0],
                 data_type=c[1] if isinstance(c[1], column.DataType) else column.DataType(c[1]))
+        self.ordering = tuple(self._sort_key(spec) for spec in self.sort_order)
+
+    def _sort_key(self, spec):
+        name, _, direction = spec.partition(' ')
+        index = self.columns.get_column_idx_from_identifier(self.identifier + '.' + name)
+        return iterator.SortKey(index, direction.strip().upper() == 'DESC')
 
     @property
     def name(self):
@@ -75,14 +101,55 @@ class AbstractTable(iterator.Iterator):
         """
         raise NotImplementedError()
 
+    def push_down(self, predicates):
+        """
+        Optional hook to filter rows at the source, eg. with an API's own
+        query parameters. Called on a copy of the table before produce().
+
+        Args:
+            predicates: Predicates on this table's columns that are ANDed
+                together in the WHERE clause
+        Returns:
+            The predicates that produce() fully handles. sqlhild filters the
+            rows on the rest.
+        intervals.predicate_intervals() combines the range predicates of
+        each column, eg. for seeking through sorted rows.
+        """
+        return []
+
+    def push_down_columns(self, columns):
+        """
+        Optional hook to skip computing columns that the query doesn't read,
+        eg. expensive attribute lookups or API fields. Called before produce().
+
+        Args:
+            columns: Names of the columns the query reads
+        Rows still have every column, produce() can put anything (eg. None)
+        in the positions of the other columns.
+        """
+
+    def push_down_limit(self, rows):
+        """
+        Optional hook to avoid fetching rows that won't be read, eg. by asking
+        an API for a single page. Called before produce().
+
+        Args:
+            rows: The most rows that will be read, None if there's no limit
+        produce() can still yield more, and is closed once enough are read.
+        """
+
     @property
     def numpy_dtype(self):
+        import numpy
         return numpy.dtype([
             ('{}.{}'.format(self.name, name), datatype)
             for name, datatype in self.column_metadata
             ])
 
     def to_sqlalchemy(self, metadata):
+        import numpy
+        import sqlalchemy
+
         columns = []
         for name, datatype in self.column_metadata:
             # FIXME: needs a generic number type
@@ -103,12 +170,15 @@ class Table(AbstractTable, metaclass=TableWatcher):
 
 
 class LMDBTable(AbstractTable):
+    # Local, so sampling statistics is cheap
+    collect_statistics = True
+
     def __init__(self, identifier, name, metadata):
         self.column_registry = column.ColumnRegistry(table_meta=metadata)
         self.table_name = name
         super(LMDBTable, self).__init__(identifier)
         self.metadata = metadata
-        self.db = lmdb.open('sqlhild.lmdb', max_dbs=255)
+        self.db = open_db()
 
     @property
     def name(self):
@@ -139,7 +209,7 @@ class SQLHildTable(Table):
         for c in self.column_metadata:
             self.column_registry.append(*c)
         super().__init__()
-        self.db = lmdb.open('sqlhild.lmdb', max_dbs=255)
+        self.db = open_db()
 
     @property
     def column_metadata(self):
@@ -164,7 +234,7 @@ class SQLHildColumn(Table):
         for c in self.column_metadata:
             self.column_registry.append(*c)
         super().__init__()
-        self.db = lmdb.open('sqlhild.lmdb', max_dbs=255)
+        self.db = open_db()
 
     @property
     def column_metadata(self):
@@ -184,6 +254,30 @@ class SQLHildColumn(Table):
                 yield ctypes.pointer(self.column_registry.row_struct.from_buffer_copy(v))
 
 
+class SQLHildOptimizerRule(Table):
+    """
+    How often each optimizer rule has rewritten a query, since the process
+    started collecting rule stats (eg. as a server)
+    """
+    @property
+    def column_metadata(self):
+        return [
+            ('rule', str),
+            ('hits', int),
+            ('match_ms', float),
+        ]
+
+    def produce(self):
+        from . import relational_algebra_optimizers
+        if relational_algebra_optimizers.rule_stats is None:
+            return []
+        rules = relational_algebra_optimizers.rule_stats.rules
+        return [
+            (rule, counters['hits'], counters['match_ms'])
+            for rule, counters in sorted(rules.items())
+        ]
+
+
 class __Table(Table):
     """
     All the tables contained within LMDB
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from sqlhild import iterator
+from sqlhild import table
+from sqlhild.exception import NotGrouped
+from sqlhild.query import QueryPlan, go
+
+
+ROWS = [('n', 'a', 3), ('s', 'a', 5), ('n', 'b', None), ('n', 'a', 4), ('e', 'c', 1)]
+
+
+class Sales(table.Table):
+    @property
+    def column_metadata(self):
+        return [('region', str), ('item', str), ('amount', int)]
+
+    def produce(self):
+        return iter(ROWS)
+
+
+class SalesByRegion(table.Table):
+    sort_order = ['region']
+
+    @property
+    def column_metadata(self):
+        return [('region', str), ('item', str), ('amount', int)]
+
+    def produce(self):
+        return iter(sorted(ROWS, key=lambda row: row[0]))
+
+
+def group_by_iterator(sql_text):
+    q = QueryPlan()
+    q.process(sql_text)
+    source = q.source
+    while not isinstance(source, iterator.GroupBy):
+        source = source.sources[0]
+    return source
+
+
+class AggregateTests(unittest.TestCase):
+    def test_group_by(self):
+        self.assertEqual(
+            go("SELECT region, COUNT(*), COUNT(amount), SUM(amount), AVG(amount), MIN(item), MAX(amount) "
+               "FROM Sales GROUP BY region"),
+            [['n', 3, 2, 7, 3.5, 'a', 4], ['s', 1, 1, 5, 5.0, 'a', 5], ['e', 1, 1, 1, 1.0, 'c', 1]])
+
+    def test_without_group_by(self):
+        self.assertEqual(go("SELECT COUNT(*), SUM(amount), MIN(region) FROM Sales"), [[5, 13, 'e']])
+        self.assertEqual(go("SELECT COUNT(*), SUM(amount) FROM Sales WHERE region > 'x'"), [[0, None]])
+        self.assertEqual(go("SELECT region, COUNT(*) FROM Sales WHERE region > 'x' GROUP BY region"), [])
+
+    def test_distinct(self):
+        self.assertEqual(
+            go("SELECT region, COUNT(DISTINCT item), SUM(DISTINCT amount) FROM Sales GROUP BY region"),
+            [['n', 2, 7], ['s', 1, 5], ['e', 1, 1]])
+
+    def test_having(self):
+        self.assertEqual(
+            go("SELECT region, COUNT(DISTINCT item) AS items FROM Sales GROUP BY region HAVING items > 1"),
+            [['n', 2]])
+        self.assertEqual(
+            go("SELECT region, SUM(amount) total FROM Sales GROUP BY region "
+               "HAVING COUNT(*) > 1 OR total < 2 ORDER BY total DESC"),
+            [['n', 7], ['e', 1]])
+
+    def test_order_by_aggregate(self):
+        self.assertEqual(
+            go("SELECT item FROM Sales GROUP BY item ORDER BY COUNT(*) DESC, item LIMIT 2"), [['a'], ['b']])
+
+    def test_sorted_rows_are_streamed(self):
+        sql_text = "SELECT region, SUM(amount), COUNT(DISTINCT item) FROM {} GROUP BY region"
+        self.assertIs(type(group_by_iterator(sql_text.format('SalesByRegion'))), iterator.GroupBy)
+        self.assertIs(type(group_by_iterator(sql_text.format('Sales'))), iterator.GroupByHash)
+        self.assertEqual(
+            go(sql_text.format('SalesByRegion')),
+            sorted(go(sql_text.format('Sales'))))
+
+    def test_columns_must_be_grouped(self):
+        with self.assertRaises(NotGrouped):
+            go("SELECT item, COUNT(*) FROM Sales GROUP BY region")
+        with self.assertRaises(NotGrouped):
+            go("SELECT * FROM Sales GROUP BY region")
+
+    def test_not_in_where(self):
+        with self.assertRaisesRegex(Exception, 'group function'):
+            go("SELECT region FROM Sales WHERE COUNT(*) > 1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import ctypes
+import random
+import unittest
+
+from sqlhild import iterator
+from sqlhild import table
+from sqlhild.query import QueryPlan
+
+
+class ManyGroups(table.Table):
+    @property
+    def column_metadata(self):
+        return [('grp', int), ('val', int)]
+
+    def produce(self):
+        keys = [i % 300 for i in range(3000)]
+        random.Random(2).shuffle(keys)
+        return ((key, i) for i, key in enumerate(keys))
+
+
+AGGREGATES = [
+    iterator.AggregateCall('COUNT', None, False, 'COUNT(*)'),
+    iterator.AggregateCall('SUM', 'ManyGroups.val', False, 'SUM(val)'),
+    iterator.AggregateCall('MIN', 'ManyGroups.val', False, 'MIN(val)'),
+]
+
+
+def aggregate(max_groups):
+    group_by = iterator.GroupByHash(
+        iterator.Tee(table.get('ManyGroups')), ['ManyGroups.grp'], AGGREGATES, max_groups=max_groups)
+    group_by.finalize()
+    return group_by
+
+
+class AggregateSpillTests(unittest.TestCase):
+    def setUp(self):
+        batch_rows = iterator.RUN_BATCH_ROWS
+        iterator.RUN_BATCH_ROWS = 10
+        self.addCleanup(setattr, iterator, 'RUN_BATCH_ROWS', batch_rows)
+
+    def test_same_groups_when_spilled(self):
+        expected = sorted(aggregate(None).produce())
+        self.assertEqual(len(expected), 300)
+
+        for max_groups in (100, 5):
+            group_by = aggregate(max_groups)
+            self.assertEqual(sorted(group_by.produce()), expected)
+            self.assertLessEqual(iterator.AGGREGATE_PARTITIONS, group_by.spilled_partitions)
+            self.assertIn('spilled partitions: {}'.format(group_by.spilled_partitions), group_by.pretty_print())
+
+        # Partitions that still have too many groups are split again
+        self.assertLess(iterator.AGGREGATE_PARTITIONS, group_by.spilled_partitions)
+
+    def test_query_spills_past_budget(self):
+        groups = iterator.AGGREGATE_GROUPS
+        iterator.AGGREGATE_GROUPS = 50
+        try:
+            q = QueryPlan()
+            q.process("SELECT grp, COUNT(*) FROM ManyGroups GROUP BY grp")
+            rows = list(q.produce())
+        finally:
+            iterator.AGGREGATE_GROUPS = groups
+        self.assertEqual(sorted(rows), [[key, 10] for key in range(300)])
+
+    def test_not_spilled_within_budget(self):
+        group_by = aggregate(300)
+        self.assertEqual(len(list(group_by.produce())), 300)
+        self.assertEqual(group_by.spilled_partitions, 0)
+        self.assertNotIn('spilled', group_by.pretty_print())
+
+    def test_files_closed_when_stopped_early(self):
+        created = []
+        partitions_class = iterator.SpilledPartitions
+
+        def recording_partitions(*args):
+            partitions = partitions_class(*args)
+            created.append(partitions)
+            return partitions
+        iterator.SpilledPartitions = recording_partitions
+        try:
+            rows = aggregate(5).produce()
+            next(rows)
+            files = [f for partitions in created for f in partitions.files if f is not None]
+            rows.close()
+        finally:
+            iterator.SpilledPartitions = partitions_class
+        self.assertTrue(files)
+        self.assertTrue(all(f.closed for f in files))
+
+    def test_unpicklable_rows_stay_in_memory(self):
+        partitions = iterator.SpilledPartitions(2, 0)
+        for i in range(100):
+            partitions.add((i % 7,), (i % 7, ctypes.pointer(ctypes.c_int(i))))
+        self.assertFalse(partitions.spillable)
+        self.assertEqual(partitions.spilled, 0)
+        rows = [row for partition in partitions.partitions() for row in partition]
+        self.assertEqual(sorted(row[1].contents.value for row in rows), list(range(100)))
+
+
+if __name__ == "__main__":
+    unittest.main()
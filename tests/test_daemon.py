@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import contextlib
+import io
+import os
+import tempfile
+import time
+import unittest
+
+from sqlhild import daemon
+
+
+TABLES = '''
+from sqlhild.table import Table
+
+
+class DaemonNumbers(Table):
+    @property
+    def column_metadata(self):
+        return [('val', int)]
+
+    def produce(self):
+        return [(i,) for i in range({})]
+'''
+
+
+class DaemonTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'sqlhild.sock')
+        self.module = os.path.join(self.tmp_dir.name, 'tables.py')
+        self.write_module(3)
+
+    def tearDown(self):
+        self.stop()
+        self.tmp_dir.cleanup()
+
+    def stop(self):
+        stopped = daemon.stop(self.path)
+        for _ in range(100):
+            if not os.path.exists(self.path):
+                break
+            time.sleep(0.05)
+        return stopped
+
+    def write_module(self, rows):
+        with open(self.module, 'w') as f:
+            f.write(TABLES.format(rows))
+
+    def request(self, idle_timeout=30, **kwargs):
+        request = {
+            'cwd': self.tmp_dir.name,
+            'modules': [self.module],
+            'optimization_level': 5,
+            'query': None,
+        }
+        request.update(kwargs)
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            status = daemon.request(request, path=self.path, idle_timeout=idle_timeout)
+        return status, stdout.getvalue(), stderr.getvalue()
+
+    def test_query(self):
+        status, stdout, stderr = self.request(
+            query='SELECT val FROM DaemonNumbers WHERE val > 1', csv=True)
+        self.assertEqual(status, 0)
+        self.assertEqual(stdout, 'val\n2\n')
+
+    def test_script(self):
+        status, stdout, stderr = self.request(
+            script='SELECT * FROM DaemonNumbers WHERE val = 0; SELECT * FROM DaemonNumbers WHERE val = 2',
+            csv=True)
+        self.assertEqual(status, 0)
+        self.assertEqual(stdout, 'val\n0\n\nval\n2\n')
+
+    def test_error(self):
+        status, stdout, stderr = self.request(query='SELECT * FROM DaemonMissing')
+        self.assertEqual(status, 1)
+        self.assertIn('TableDoesNotExist', stderr)
+
+    def test_changed_module_is_reloaded(self):
+        self.request(query='SELECT * FROM DaemonNumbers')
+
+        self.write_module(5)
+        mtime = os.path.getmtime(self.module) + 1
+        os.utime(self.module, (mtime, mtime))
+
+        status, stdout, stderr = self.request(
+            query='SELECT val FROM DaemonNumbers WHERE val > 1', csv=True)
+        self.assertEqual(stdout, 'val\n2\n3\n4\n')
+
+    def test_rule_stats(self):
+        self.request(query='SELECT * FROM DaemonNumbers WHERE 1 IN (val, 2)')
+        status, stdout, stderr = self.request(
+            query='SELECT rule, hits FROM SQLHildOptimizerRule', csv=True)
+        self.assertEqual(status, 0)
+        self.assertIn('in_statement_2_ors,1\n', stdout)
+
+    def test_stop(self):
+        self.request(query='SELECT * FROM DaemonNumbers')
+        self.assertTrue(self.stop())
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(self.stop())
+
+    def test_idle_shutdown(self):
+        self.request(query='SELECT * FROM DaemonNumbers', idle_timeout=0.2)
+        for _ in range(100):
+            if not os.path.exists(self.path):
+                break
+            time.sleep(0.05)
+        self.assertFalse(os.path.exists(self.path))
+
+
+class PrivateDirTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_created_for_this_user_only(self):
+        path = daemon.private_dir(os.path.join(self.tmp_dir.name, 'run'))
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o700)
+        self.assertEqual(daemon.private_dir(path), path)
+
+    def test_symlink_is_rejected(self):
+        path = os.path.join(self.tmp_dir.name, 'run')
+        os.symlink(self.tmp_dir.name, path)
+        with self.assertRaises(PermissionError):
+            daemon.private_dir(path)
+
+    def test_lock_symlink_is_not_followed(self):
+        target = os.path.join(self.tmp_dir.name, 'target')
+        with open(target, 'w') as f:
+            f.write('keep')
+        path = os.path.join(self.tmp_dir.name, 'sqlhild.sock')
+        os.symlink(target, path + '.lock')
+        with self.assertRaises(OSError):
+            daemon.serve(None, path=path)
+        with open(target) as f:
+            self.assertEqual(f.read(), 'keep')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import os
+import pickle
+import tempfile
+import unittest
+
+from sqlhild import dfa_cache
+from sqlhild.antlr2ra import parse_tree
+from sqlhild.grammar.mysql.MySqlParser import MySqlParser
+
+
+class ParseTreeTests(unittest.TestCase):
+    def test_parses(self):
+        tree = parse_tree("SELECT * FROM t WHERE a > 1 AND b = 'x'")
+        self.assertEqual(len(tree.sqlStatements().sqlStatement()), 1)
+
+    def test_syntax_error_is_reported(self):
+        with self.assertRaises(SyntaxError):
+            parse_tree("SELECT * FROM WHERE")
+
+
+class DFACacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'dfa.pickle')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        dfa_cache.warm(["SELECT a FROM t WHERE a IN (1, 2)"])
+        dfa_cache.save(self.path)
+        states = sum(len(dfa._states) for dfa in MySqlParser.decisionsToDFA)
+
+        self.assertTrue(dfa_cache.load(self.path))
+        self.assertEqual(
+            sum(len(dfa._states) for dfa in MySqlParser.decisionsToDFA),
+            states)
+
+        # The loaded DFA still refers to the parser's ATN
+        for dfa in MySqlParser.decisionsToDFA:
+            self.assertIs(dfa.atnStartState, MySqlParser.atn.decisionToState[dfa.decision])
+
+        parse_tree("SELECT a FROM t WHERE a IN (1, 2)")
+        with self.assertRaises(SyntaxError):
+            parse_tree("SELECT a FROM t WHERE")
+
+    def test_missing_cache(self):
+        self.assertFalse(dfa_cache.load(self.path))
+
+    def test_stale_cache_is_ignored(self):
+        with open(self.path, 'wb') as f:
+            pickle.dump(('old grammar', [], []), f)
+        self.assertFalse(dfa_cache.load(self.path))
+        self.assertTrue(len(MySqlParser.decisionsToDFA) > 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
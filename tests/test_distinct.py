@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from sqlhild import iterator
+from sqlhild import table
+from sqlhild.query import QueryPlan, go
+
+
+class Repeats(table.Table):
+    """
+    Counts how many rows it's been asked for
+    """
+    produced = 0
+
+    @property
+    def column_metadata(self):
+        return [('val', int), ('tags', list)]
+
+    def produce(self):
+        for i in range(1000):
+            Repeats.produced += 1
+            yield ([3, 1, 3, 2, 1][i % 5] + i // 500 * 10, [i % 2])
+
+
+def plan(sql_text):
+    q = QueryPlan()
+    q.process(sql_text)
+    return q
+
+
+def iterators(source):
+    yield source
+    for s in getattr(source, 'sources', []):
+        yield from iterators(s)
+
+
+class DistinctTests(unittest.TestCase):
+    def setUp(self):
+        Repeats.produced = 0
+
+    def test_rows_come_out_as_first_seen(self):
+        q = plan("SELECT DISTINCT val FROM Repeats")
+        kinds = [type(s) for s in iterators(q.source)]
+        self.assertIn(iterator.HashDistinct, kinds)
+        self.assertNotIn(iterator.Sorted, kinds)
+
+        rows = q.produce()
+        self.assertEqual(next(rows), [3])
+        self.assertEqual(Repeats.produced, 1)
+        self.assertEqual(list(rows), [[1], [2], [13], [11], [12]])
+
+    def test_limit_stops_reading(self):
+        self.assertEqual(go("SELECT DISTINCT val FROM Repeats LIMIT 3"), [[3], [1], [2]])
+        self.assertEqual(Repeats.produced, 4)
+
+        Repeats.produced = 0
+        self.assertEqual(go("SELECT DISTINCT val FROM Repeats LIMIT 1, 3"), [[1], [2], [13]])
+        self.assertEqual(Repeats.produced, 501)
+
+    def test_unhashable_values(self):
+        self.assertEqual(go("SELECT DISTINCT tags FROM Repeats"), [[[0]], [[1]]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import ctypes
+import random
+import unittest
+
+from sqlhild import iterator
+from sqlhild import table
+from sqlhild.query import go
+
+
+class Shuffled(table.Table):
+    @property
+    def column_metadata(self):
+        return [('id', int), ('val', int)]
+
+    def produce(self):
+        vals = list(range(500)) * 2
+        random.Random(1).shuffle(vals)
+        return ((i, None if i % 100 == 0 else val) for i, val in enumerate(vals))
+
+
+class ExternalSortTests(unittest.TestCase):
+    def setUp(self):
+        self.runs = []
+        write_run = iterator._write_run
+
+        def recording_write_run(rows):
+            run = write_run(rows)
+            self.runs.append(run)
+            return run
+        iterator._write_run = recording_write_run
+        self.addCleanup(setattr, iterator, '_write_run', write_run)
+
+    def rows(self):
+        return [(random.Random(i).randrange(50), i) for i in range(1000)]
+
+    def test_same_as_sorted(self):
+        rows = self.rows()
+        self.assertEqual(list(iterator.external_sort(iter(rows), max_rows=64)), sorted(rows))
+        self.assertEqual(len(self.runs), 15)
+        self.assertTrue(all(run.closed for run in self.runs))
+
+    def test_stable(self):
+        rows = self.rows()
+        key = lambda row: row[0]  # noqa: E731
+        for reverse in (False, True):
+            self.assertEqual(
+                list(iterator.external_sort(iter(rows), key=key, reverse=reverse, max_rows=64)),
+                sorted(rows, key=key, reverse=reverse))
+
+    def test_merges_runs_when_there_are_many(self):
+        merge_runs = iterator.SORT_MERGE_RUNS
+        iterator.SORT_MERGE_RUNS = 4
+        try:
+            rows = self.rows()
+            self.assertEqual(list(iterator.external_sort(iter(rows), max_rows=10)), sorted(rows))
+        finally:
+            iterator.SORT_MERGE_RUNS = merge_runs
+        self.assertTrue(all(run.closed for run in self.runs))
+
+    def test_files_closed_when_stopped_early(self):
+        rows = iterator.external_sort(iter(self.rows()), max_rows=64)
+        self.assertEqual(next(rows)[0], 0)
+        self.assertTrue(self.runs)
+        self.assertFalse(any(run.closed for run in self.runs))
+        rows.close()
+        self.assertTrue(all(run.closed for run in self.runs))
+
+    def test_files_closed_on_error(self):
+        def failing():
+            yield from self.rows()
+            raise ValueError('source failed')
+
+        with self.assertRaises(ValueError):
+            list(iterator.external_sort(failing(), max_rows=64))
+        self.assertTrue(self.runs)
+        self.assertTrue(all(run.closed for run in self.runs))
+
+    def test_unpicklable_rows_stay_in_memory(self):
+        rows = [(i % 7, ctypes.pointer(ctypes.c_int(i))) for i in range(100)]
+        key = lambda row: row[0]  # noqa: E731
+        self.assertEqual(
+            [row[1].contents.value for row in iterator.external_sort(iter(rows), key=key, max_rows=10)],
+            [row[1].contents.value for row in sorted(rows, key=key)])
+        self.assertEqual(self.runs, [])
+
+    def test_order_by_spills(self):
+        expected = go("SELECT id, val FROM Shuffled ORDER BY val DESC, id")
+        sort_buffer_rows = iterator.SORT_BUFFER_ROWS
+        iterator.SORT_BUFFER_ROWS = 100
+        try:
+            self.assertEqual(go("SELECT id, val FROM Shuffled ORDER BY val DESC, id"), expected)
+        finally:
+            iterator.SORT_BUFFER_ROWS = sort_buffer_rows
+        self.assertEqual(len(self.runs), 10)
+        self.assertEqual(expected[0][1], 499)
+        self.assertEqual([row[1] for row in expected[-11:]], [0] + [None] * 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
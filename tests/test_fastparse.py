@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from hypothesis import given, settings
+
+from sqlhild import fastparse
+from sqlhild import table
+from sqlhild.exception import UnknownColumn
+from sqlhild.sql2ra import sql2ra
+import sqlhild.example  # NOQA: register tables
+
+from test_fuzzer import sqlhose
+
+
+def assert_same_ra(testcase, sql_text):
+    # Make sure the fast path is actually used
+    fastparse.parse(sql_text)
+
+    antlr_ra = sql2ra(sql_text, table, fast_path=False)
+    fast_ra = sql2ra(sql_text, table)
+    testcase.assertEqual(fast_ra, antlr_ra)
+    testcase.assertEqual(
+        {k: vars(v) for k, v in fast_ra._tables.items()},
+        {k: vars(v) for k, v in antlr_ra._tables.items()})
+
+
+class FastParseTests(unittest.TestCase):
+    def test_same_ra(self):
+        for sql_text in [
+            "SELECT * FROM OneToTen",
+            "SELECT 1, 'a' AS b",
+            "SELECT DISTINCT val FROM OneToTen a WHERE a.val <= 5",
+            "SELECT a.* FROM OneToTen a WHERE val IN (1, 2, '3');",
+            "SELECT * FROM OneToTen WHERE val IN ( 1 ,2\n) AND val in (3)",
+            "SELECT * FROM OneToTen WHERE val IN ('a,b', 'c''d)', 4) OR val IN (val, 5)",
+            "SELECT * FROM OneToTen WHERE val = 1 OR val > 3 AND (val < 8 OR FALSE)",
+            "SELECT * FROM `OneToTen`, `ThreeToSeven` WHERE `OneToTen`.val = `ThreeToSeven`.val",
+            "SELECT * FROM OneToTen INNER JOIN ThreeToSeven ON ThreeToSeven.val = OneToTen.val",
+            "SELECT * FROM OneToTen a LEFT OUTER JOIN ThreeToSeven b ON a.val = b.val",
+            "SELECT * FROM OneToTen a RIGHT JOIN ThreeToSeven b ON a.val = b.val "
+            "JOIN TwoToTwentyInTwos c ON c.val = b.val WHERE c.val != 2",
+            "SELECT * FROM OneToTen WHERE val > 1 ORDER BY val DESC LIMIT 3",
+            "SELECT DISTINCT a.val FROM OneToTen a JOIN ThreeToSeven b ON a.val = b.val ORDER BY b.val, a.val ASC",
+            "SELECT val, COUNT(*), SUM(val) AS total FROM OneToTen WHERE val > 2 GROUP BY val HAVING total > 4 "
+            "ORDER BY COUNT(*) DESC",
+            "SELECT COUNT(DISTINCT a.val), MAX(b.val) m FROM OneToTen a JOIN ThreeToSeven b ON a.val = b.val "
+            "HAVING m < 7",
+        ]:
+            assert_same_ra(self, sql_text)
+
+    def test_same_error(self):
+        with self.assertRaises(UnknownColumn):
+            sql2ra("SELECT * FROM OneToTen WHERE nope = 1", table, fast_path=False)
+        with self.assertRaises(UnknownColumn):
+            sql2ra("SELECT * FROM OneToTen WHERE nope = 1", table)
+
+    def test_unsupported(self):
+        for sql_text in [
+            "SELECT * FROM OneToTen ORDER BY 1",
+            "SELECT COUNT(DISTINCT val, id) FROM OneToTen",
+            "SELECT STD(val) FROM OneToTen",
+            "SELECT * FROM OneToTen WHERE NOT val = 1",
+            "SELECT * FROM OneToTen WHERE val LIKE '1%'",
+            "SELECT * FROM OneToTen WHERE val = 1.5",
+            "SELECT * FROM OneToTen WHERE val IN (1,,2)",
+            "SELECT * FROM OneToTen WHERE val IN (1 2)",
+            "SELECT * FROM OneToTen -- comment",
+            "SELECT name FROM Process",
+            "SELECT * FROM OneToTen JOIN ThreeToSeven",
+            "SELECT * FROM",
+        ]:
+            with self.assertRaises(fastparse.Unsupported):
+                fastparse.parse(sql_text)
+
+    def test_syntax_error_falls_back(self):
+        with self.assertRaises(SyntaxError):
+            sql2ra("SELECT * FROM OneToTen WHERE", table)
+
+    # The ANTLR path is slow until its DFA warms up
+    @settings(deadline=None)
+    @given(sqlhose.strategy())
+    def test_fuzzed_where(self, query):
+        assert_same_ra(self, str(query).replace('"', '`'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from sqlhild import example  # noqa: F401
+from sqlhild import iterator
+from sqlhild import join_order
+from sqlhild import relational_algebra_optimizers
+from sqlhild import sql2ra
+from sqlhild import table
+from sqlhild.query import go
+from sqlhild.relational_algebra import FullJoin, Join, LeftJoin
+
+
+class HashOrders(table.Table):
+    """
+    Unsorted, with duplicate and NULL customer ids
+    """
+    row_count = 1000
+
+    @property
+    def column_metadata(self):
+        return [('id', int), ('customer', int)]
+
+    def produce(self):
+        return iter([(1, 3), (2, 1), (3, None), (4, 3), (5, 9), (6, 2)])
+
+
+class HashCustomers(table.Table):
+    row_count = 10
+
+    @property
+    def column_metadata(self):
+        return [('customer', int), ('name', str)]
+
+    def produce(self):
+        return iter([(3, 'c'), (1, 'a'), (4, 'd'), (2, 'b')])
+
+
+def plan(sql):
+    ra = sql2ra.sql2ra(sql, table)
+    ra = relational_algebra_optimizers.optimize(ra)
+    return join_order.reorder(ra, table)
+
+
+def the_join(ra):
+    [join] = [node for node, _ in ra.preorder_iter() if isinstance(node, (Join, LeftJoin, FullJoin))]
+    return join
+
+
+SQL = "SELECT * FROM HashOrders o {} JOIN HashCustomers c ON o.customer = c.customer"
+
+INNER = [[1, 3, 3, 'c'], [2, 1, 1, 'a'], [4, 3, 3, 'c'], [6, 2, 2, 'b']]
+LEFT = [[1, 3, 3, 'c'], [2, 1, 1, 'a'], [3, None, None, None], [4, 3, 3, 'c'], [5, 9, None, None], [6, 2, 2, 'b']]
+RIGHT = INNER + [[None, None, 4, 'd']]
+FULL = LEFT + [[None, None, 4, 'd']]
+
+
+def key(row):
+    return [(v is None, v) for v in row]
+
+
+class HashJoinTests(unittest.TestCase):
+    def test_builds_on_smaller_side(self):
+        self.assertEqual(the_join(plan(SQL.format('LEFT')))._hash_build, 1)
+        self.assertEqual(the_join(plan(SQL.format('FULL OUTER')))._hash_build, 1)
+
+    def test_merge_join_when_too_big(self):
+        rows = join_order.HASH_JOIN_ROWS
+        join_order.HASH_JOIN_ROWS = 5
+        try:
+            self.assertIsNone(the_join(plan(SQL.format('LEFT')))._hash_build)
+            self.assertEqual(the_join(plan(SQL.format('FULL')))._hash_build, 1)
+        finally:
+            join_order.HASH_JOIN_ROWS = rows
+
+    def test_probe_order_is_kept(self):
+        self.assertEqual(go(SQL.format('INNER')), INNER)
+        self.assertEqual(go(SQL.format('LEFT OUTER')), LEFT)
+
+    def test_outer_joins(self):
+        self.assertEqual(sorted(go(SQL.format('RIGHT')), key=key), sorted(RIGHT, key=key))
+        self.assertEqual(sorted(go(SQL.format('FULL OUTER')), key=key), sorted(FULL, key=key))
+
+    def test_either_build_side(self):
+        for build in (0, 1):
+            for keep_left in (False, True):
+                for keep_right in (False, True):
+                    join = iterator.HashJoin(
+                        iterator.Tee(table.get('HashOrders')),
+                        iterator.Tee(table.get('HashCustomers')),
+                        'HashOrders.customer',
+                        'HashCustomers.customer',
+                        build=build,
+                        keep_left=keep_left,
+                        keep_right=keep_right)
+                    expected = {
+                        (False, False): INNER,
+                        (True, False): LEFT,
+                        (False, True): RIGHT,
+                        (True, True): FULL,
+                    }[keep_left, keep_right]
+                    rows = [list(row) for row in join.produce()]
+                    self.assertEqual(sorted(rows, key=key), sorted(expected, key=key))
+
+    def test_same_results_as_merge_join(self):
+        rows = join_order.HASH_JOIN_ROWS
+        sql = "SELECT * FROM ThreeToSeven a {} JOIN TwoToTwentyInTwos b ON a.val = b.val"
+        for kind in ('INNER', 'LEFT', 'RIGHT'):
+            hashed = go(sql.format(kind))
+            join_order.HASH_JOIN_ROWS = 0
+            try:
+                merged = go(sql.format(kind))
+            finally:
+                join_order.HASH_JOIN_ROWS = rows
+            self.assertEqual(sorted(hashed, key=key), sorted(merged, key=key))
+
+
+if __name__ == "__main__":
+    unittest.main()
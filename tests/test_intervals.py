@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import bisect
+import unittest
+
+from sqlhild import example  # noqa: F401
+from sqlhild import relational_algebra_optimizers
+from sqlhild import sql2ra
+from sqlhild import table
+from sqlhild.intervals import Interval, predicate_intervals
+from sqlhild.query import go
+from sqlhild.relational_algebra import EmptySet, Select, Table
+
+
+class SortedIds(table.Table):
+    """
+    Rows sorted by id, that seeks to the ids a query wants
+    """
+    rows = [(i, 'name{}'.format(i)) for i in range(1000)]
+    scans = []
+
+    @property
+    def column_metadata(self):
+        return [('id', int), ('name', str)]
+
+    def push_down(self, predicates):
+        handled = [p for p in predicates if p.column == 'id' and p.operator in ('<', '<=', '>', '>=')]
+        self.interval = predicate_intervals(handled).get('id', Interval())
+        return handled
+
+    def produce(self):
+        interval = getattr(self, 'interval', Interval())
+        start = 0
+        if interval.low is not None:
+            seek = bisect.bisect_left if interval.low_closed else bisect.bisect_right
+            start = seek([row[0] for row in self.rows], interval.low)
+        read = 0
+        for row in self.rows[start:]:
+            if row[0] not in interval:
+                break
+            read += 1
+            yield row
+        SortedIds.scans.append(read)
+
+
+def plan(sql):
+    ra = sql2ra.sql2ra(sql, table)
+    return relational_algebra_optimizers.optimize(ra)
+
+
+def condition(ra):
+    [select] = [node for node, _ in ra.preorder_iter() if isinstance(node, Select)]
+    return str(select.operands[1])
+
+
+class IntervalTests(unittest.TestCase):
+    def setUp(self):
+        SortedIds.scans = []
+
+    def test_interval(self):
+        self.assertTrue(Interval(5, 3).empty)
+        self.assertTrue(Interval(3, 3, low_closed=False).empty)
+        self.assertFalse(Interval(3, 3).empty)
+        self.assertEqual(Interval(1, 8).intersection(Interval(5, None, False)), Interval(5, 8, False))
+        self.assertEqual(Interval(1, 5).union(Interval(5, 9, False)), Interval(1, 9))
+        self.assertIsNone(Interval(1, 5, high_closed=False).union(Interval(5, 9, False)))
+        self.assertIn('b', Interval('a', 'c'))
+        self.assertNotIn(3, Interval(3, None, False))
+
+    def test_contradiction(self):
+        self.assertIsInstance(plan("SELECT * FROM OneToTen WHERE val > 5 AND val < 3").operands[0], EmptySet)
+        self.assertIsInstance(plan("SELECT * FROM OneToTen WHERE val = 3 AND val != 3").operands[0], EmptySet)
+        self.assertIsInstance(plan("SELECT * FROM SortedIds WHERE name > 'm' AND name < 'b'").operands[0], EmptySet)
+
+    def test_contradiction_keeps_columns(self):
+        self.assertEqual(go("SELECT val FROM OneToTen WHERE val < 7 AND val = 7 ORDER BY val"), [])
+        self.assertEqual(
+            go("SELECT val, COUNT(*) FROM OneToTen WHERE val < 7 AND val = 12 GROUP BY val"), [])
+        self.assertEqual(
+            go("SELECT val, COUNT(*) FROM OneToTen WHERE val < 7 AND val = 12 "
+               "GROUP BY val HAVING COUNT(*) > 0"), [])
+        self.assertEqual(
+            go("SELECT OneToTen.val, SortedIds.name FROM OneToTen "
+               "JOIN SortedIds ON OneToTen.val = SortedIds.id "
+               "WHERE OneToTen.val > 5 AND OneToTen.val < 3 ORDER BY SortedIds.name"), [])
+
+    def test_bounds_are_merged(self):
+        self.assertEqual(
+            condition(plan("SELECT * FROM OneToTen WHERE val > 2 AND val > 4 AND val <= 8 AND val != 9")),
+            '(((OneToTen . val) > N(4)) ⋀ ((OneToTen . val) <= N(8)))')
+        self.assertEqual(
+            condition(plan("SELECT * FROM OneToTen WHERE val >= 3 AND val <= 3")),
+            '((OneToTen . val) == N(3))')
+
+    def test_disjunctions_are_merged(self):
+        sql_text = "SELECT * FROM OneToTen WHERE val < 3 OR (val > 2 AND val < 5) OR val = 9 OR (val > 5 AND val < 1)"
+        self.assertEqual(
+            condition(plan(sql_text)),
+            '(((OneToTen . val) == N(9)) ∨ ((OneToTen . val) < N(5)))')
+        self.assertEqual(sorted(go(sql_text)), [[1], [2], [3], [4], [9]])
+
+    def test_tautology(self):
+        sql_text = "SELECT * FROM OneToTen WHERE val > 7 OR val < 7 OR val = 7"
+        self.assertEqual(plan(sql_text).operands[0], Table('OneToTen'))
+        self.assertEqual(len(go(sql_text)), 10)
+        self.assertEqual(
+            condition(plan("SELECT * FROM OneToTen WHERE val != 2 AND (val > 3 OR val <= 3)")),
+            '((OneToTen . val) != N(2))')
+
+    def test_tautology_on_join(self):
+        sql_text = """
+            SELECT OneToTen.val FROM OneToTen
+            JOIN TwoToTwentyInTwos ON OneToTen.val = TwoToTwentyInTwos.val
+            WHERE (OneToTen.val > 7 OR TwoToTwentyInTwos.val > 3) OR TwoToTwentyInTwos.val < 7
+        """
+        self.assertFalse([node for node, _ in plan(sql_text).preorder_iter() if isinstance(node, Select)])
+        self.assertEqual(sorted(go(sql_text)), [[2], [4]])
+
+    def test_range_check(self):
+        rows = go("SELECT * FROM OneToTen WHERE 2 < val AND val <= 5 AND val != 4")
+        self.assertEqual(sorted(rows), [[3], [5]])
+
+    def test_contradicting_params_are_not_scanned(self):
+        self.assertEqual(go("SELECT id FROM SortedIds WHERE id > 500 AND id < 10"), [])
+        self.assertEqual(SortedIds.scans, [])
+
+    def test_seek(self):
+        rows = go("SELECT id FROM SortedIds WHERE id >= 500 AND id < 503")
+        self.assertEqual(rows, [[500], [501], [502]])
+        self.assertEqual(SortedIds.scans, [3])
+
+    def test_predicate_intervals(self):
+        self.assertEqual(
+            predicate_intervals([
+                table.Predicate('id', '>', 1),
+                table.Predicate('id', '<=', 5),
+                table.Predicate('id', 'in', (1, 2)),
+                table.Predicate('name', '=', 'x'),
+            ]),
+            {'id': Interval(1, 5, low_closed=False), 'name': Interval('x', 'x')})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from sqlhild import join_order
+from sqlhild import relational_algebra_optimizers
+from sqlhild import sql2ra
+from sqlhild import table
+from sqlhild.query import go
+from sqlhild.relational_algebra import Join, Select, Table
+
+
+class JoinHuge(table.Table):
+    row_count = 100000
+    distinct_counts = {'id': 1000, 'dim': 1000}
+
+    @property
+    def column_metadata(self):
+        return [('id', int), ('dim', int)]
+
+    def produce(self):
+        return ((i, i % 10) for i in range(50))
+
+
+class JoinLarge(table.Table):
+    row_count = 100000
+    distinct_counts = {'id': 1000, 'other': 1000}
+
+    @property
+    def column_metadata(self):
+        return [('id', int), ('other', int)]
+
+    def produce(self):
+        return ((i, i * 2) for i in range(0, 50, 2))
+
+
+class JoinTiny(table.Table):
+    row_count = 10
+
+    @property
+    def column_metadata(self):
+        return [('dim', int), ('label', str)]
+
+    def produce(self):
+        return ((i, 'dim{}'.format(i)) for i in range(3))
+
+
+class JoinSmall(table.Table):
+    row_count = 10
+
+    @property
+    def column_metadata(self):
+        return [('other', int), ('size', int)]
+
+    def produce(self):
+        return ((i, i + 100) for i in range(0, 100, 3))
+
+
+def plan(sql):
+    ra = sql2ra.sql2ra(sql, table)
+    ra = relational_algebra_optimizers.optimize(ra)
+    return ra, join_order.reorder(ra, table)
+
+
+def joins(ra):
+    return [node for node, _ in ra.preorder_iter() if isinstance(node, Join)]
+
+
+def join_tables(join):
+    return [join_order.tables_of(theta.operands[0]) for theta in join.operands]
+
+
+class JoinOrderTests(unittest.TestCase):
+    def test_small_tables_are_joined_first(self):
+        original, reordered = plan("""
+            SELECT JoinHuge.id, JoinTiny.label
+            FROM JoinHuge
+            JOIN JoinLarge ON JoinHuge.id = JoinLarge.id
+            JOIN JoinTiny ON JoinHuge.dim = JoinTiny.dim
+        """)
+        self.assertNotEqual(original, reordered)
+
+        # JoinHuge ⋈ JoinTiny is much smaller than JoinHuge ⋈ JoinLarge
+        inner = joins(reordered)[1]
+        self.assertEqual(
+            sorted(map(sorted, join_tables(inner))),
+            [['JoinHuge'], ['JoinTiny']])
+
+    def test_bushy(self):
+        original, reordered = plan("""
+            SELECT JoinHuge.id
+            FROM JoinHuge
+            JOIN JoinTiny ON JoinHuge.dim = JoinTiny.dim
+            JOIN JoinLarge ON JoinHuge.id = JoinLarge.id
+            JOIN JoinSmall ON JoinLarge.other = JoinSmall.other
+        """)
+        top = joins(reordered)[0]
+        self.assertEqual(
+            sorted(map(sorted, join_tables(top))),
+            [['JoinHuge', 'JoinTiny'], ['JoinLarge', 'JoinSmall']])
+
+    def test_greedy(self):
+        limit = join_order.DP_LIMIT
+        join_order.DP_LIMIT = 2
+        try:
+            original, reordered = plan("""
+                SELECT JoinHuge.id
+                FROM JoinHuge
+                JOIN JoinLarge ON JoinHuge.id = JoinLarge.id
+                JOIN JoinTiny ON JoinHuge.dim = JoinTiny.dim
+            """)
+        finally:
+            join_order.DP_LIMIT = limit
+        inner = joins(reordered)[1]
+        self.assertEqual(
+            sorted(map(sorted, join_tables(inner))),
+            [['JoinHuge'], ['JoinTiny']])
+
+    def test_two_relations_are_not_reordered(self):
+        original, reordered = plan("""
+            SELECT JoinHuge.id
+            FROM JoinTiny
+            JOIN JoinHuge ON JoinHuge.dim = JoinTiny.dim
+        """)
+        self.assertEqual(original, reordered)
+
+    def test_no_joins(self):
+        original, reordered = plan("SELECT * FROM JoinTiny WHERE dim = 1")
+        self.assertIs(original, reordered)
+
+    def test_filters_stay_with_their_table(self):
+        original, reordered = plan("""
+            SELECT JoinHuge.id
+            FROM JoinHuge
+            JOIN JoinLarge ON JoinHuge.id = JoinLarge.id
+            JOIN JoinTiny ON JoinHuge.dim = JoinTiny.dim
+            WHERE JoinHuge.id > 10
+        """)
+        self.assertIsInstance(reordered, type(original))
+        self.assertEqual(len(joins(reordered)), 2)
+        self.assertEqual(
+            len([n for n, _ in reordered.preorder_iter() if isinstance(n, Select)]),
+            len([n for n, _ in original.preorder_iter() if isinstance(n, Select)]))
+
+    def test_same_results(self):
+        sql = """
+            SELECT JoinHuge.id, JoinHuge.dim, JoinTiny.label, JoinSmall.size
+            FROM JoinHuge
+            JOIN JoinTiny ON JoinHuge.dim = JoinTiny.dim
+            JOIN JoinLarge ON JoinHuge.id = JoinLarge.id
+            JOIN JoinSmall ON JoinLarge.other = JoinSmall.other
+        """
+        expected = []
+        for i in range(0, 50, 2):
+            if i % 10 < 3 and (i * 2) % 3 == 0:
+                expected.append([i, i % 10, 'dim{}'.format(i % 10), i * 2 + 100])
+        self.assertEqual(sorted(go(sql)), expected)
+
+    def test_estimates(self):
+        stats = join_order.Statistics(sql2ra.sql2ra("SELECT * FROM JoinHuge", table), table)
+        self.assertEqual(join_order.estimate_rows(Table('JoinHuge'), stats), 100000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import json
+import subprocess
+import sys
+import unittest
+
+
+SCRIPT = '''
+import json
+import sys
+
+from sqlhild.query import go
+from sqlhild.table import Table
+
+
+class Numbers(Table):
+    @property
+    def column_metadata(self):
+        return [('val', int)]
+
+    def produce(self):
+        return [(i,) for i in range(10)]
+
+
+rows = list(go('SELECT val FROM Numbers WHERE val > 7'))
+print(json.dumps({'rows': rows, 'modules': sorted(sys.modules)}))
+'''
+
+# Only needed for some queries/features
+HEAVY_MODULES = [
+    'antlr4',
+    'autopep8',
+    'lmdb',
+    'numba',
+    'numpy',
+    'sqlalchemy',
+    'sqlhild.grammar.mysql.MySqlLexer',
+    'sqlhild.grammar.mysql.MySqlParser',
+    'terminaltables',
+    'yaml',
+]
+
+
+class LazyImportTests(unittest.TestCase):
+    def test_simple_query_skips_heavy_modules(self):
+        output = subprocess.check_output([sys.executable, '-c', SCRIPT])
+        result = json.loads(output.decode())
+        self.assertEqual(result['rows'], [[8], [9]])
+        self.assertEqual(
+            [module for module in HEAVY_MODULES if module in result['modules']],
+            [])
+
+
+if __name__ == "__main__":
+    unittest.main()
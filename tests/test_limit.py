@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from sqlhild import ra2iter
+from sqlhild import relational_algebra_optimizers
+from sqlhild import sql2ra
+from sqlhild import table
+from sqlhild.query import go, go_script
+
+
+PAGE_SIZE = 5
+
+
+class LimitPaged(table.Table):
+    """
+    Pretends to be an API that returns rows a page at a time
+    """
+    hints = []
+    pages = 0
+    closed = False
+
+    @property
+    def column_metadata(self):
+        return [('id', int), ('kind', str)]
+
+    def push_down(self, predicates):
+        self.kinds = [p.value for p in predicates if p.column == 'kind' and p.operator == '=']
+        return [p for p in predicates if p.column == 'kind' and p.operator == '=']
+
+    def push_down_limit(self, rows):
+        LimitPaged.hints.append(rows)
+
+    def produce(self):
+        kinds = getattr(self, 'kinds', None)
+        try:
+            for page in range(10):
+                LimitPaged.pages += 1
+                for i in range(page * PAGE_SIZE, (page + 1) * PAGE_SIZE):
+                    kind = 'even' if i % 2 == 0 else 'odd'
+                    if not kinds or kind in kinds:
+                        yield (i, kind)
+        finally:
+            LimitPaged.closed = True
+
+
+def plan(sql):
+    ra = sql2ra.sql2ra(sql, table)
+    return relational_algebra_optimizers.optimize(ra)
+
+
+class LimitTests(unittest.TestCase):
+    def setUp(self):
+        LimitPaged.hints = []
+        LimitPaged.pages = 0
+        LimitPaged.closed = False
+
+    def test_limit(self):
+        rows = go("SELECT id FROM LimitPaged LIMIT 3")
+        self.assertEqual(rows, [[0], [1], [2]])
+        self.assertEqual(LimitPaged.hints, [3])
+        self.assertEqual(LimitPaged.pages, 1)
+        self.assertTrue(LimitPaged.closed)
+
+    def test_limit_at_page_boundary(self):
+        go("SELECT id FROM LimitPaged LIMIT 5")
+        self.assertEqual(LimitPaged.pages, 1)
+
+    def test_offset(self):
+        rows = go("SELECT id FROM LimitPaged LIMIT 6, 2")
+        self.assertEqual(rows, [[6], [7]])
+        self.assertEqual(LimitPaged.hints, [8])
+        self.assertEqual(LimitPaged.pages, 2)
+
+    def test_offset_keyword(self):
+        rows = go("SELECT id FROM LimitPaged LIMIT 2 OFFSET 6")
+        self.assertEqual(rows, [[6], [7]])
+        self.assertEqual(LimitPaged.hints, [8])
+
+    def test_offset_keyword_without_fast_path(self):
+        ra = sql2ra.sql2ra("SELECT id FROM LimitPaged LIMIT 2 OFFSET 6", table, fast_path=False)
+        self.assertEqual(
+            ra, sql2ra.sql2ra("SELECT id FROM LimitPaged LIMIT 6, 2", table, fast_path=False))
+
+    def test_filter_is_not_limited(self):
+        rows = go("SELECT id FROM LimitPaged WHERE id > 6 LIMIT 2")
+        self.assertEqual(rows, [[7], [8]])
+        self.assertEqual(set(LimitPaged.hints), {None})
+        self.assertEqual(LimitPaged.pages, 2)
+        self.assertTrue(LimitPaged.closed)
+
+    def test_pushed_down_filter_is_limited(self):
+        rows = go("SELECT id FROM LimitPaged WHERE kind = 'odd' LIMIT 2")
+        self.assertEqual(rows, [[1], [3]])
+        self.assertEqual(LimitPaged.hints[-1], 2)
+        self.assertTrue(LimitPaged.closed)
+
+    def test_shared_scan(self):
+        results = go_script("""
+            SELECT id FROM LimitPaged LIMIT 1;
+            SELECT id FROM LimitPaged WHERE id > 47
+        """)
+        self.assertEqual(results, [[[0]], [[48], [49]]])
+        self.assertEqual(LimitPaged.hints[-1], None)
+        self.assertEqual(LimitPaged.pages, 10)
+
+    def test_row_budgets(self):
+        self.assertEqual(
+            ra2iter.row_budgets(plan("SELECT id FROM LimitPaged LIMIT 4")),
+            {'LimitPaged': 4})
+        self.assertEqual(
+            ra2iter.row_budgets(plan("SELECT DISTINCT id FROM LimitPaged LIMIT 4")),
+            {'LimitPaged': None})
+        self.assertEqual(
+            ra2iter.row_budgets(plan("SELECT id FROM LimitPaged")),
+            {'LimitPaged': None})
+
+
+if __name__ == "__main__":
+    unittest.main()
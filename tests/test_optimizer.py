@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+import concurrent.futures
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from sqlhild import example  # noqa: F401
+from sqlhild import relational_algebra_optimizers
+from sqlhild import sql2ra
+from sqlhild import table
+from sqlhild.query import go
+from sqlhild.relational_algebra import And, EmptySet, Intersection, Or, Select, Union, ValueSet
+
+
+def plan(sql):
+    ra = sql2ra.sql2ra(sql, table)
+    return relational_algebra_optimizers.optimize(ra)
+
+
+def predicates(predicates):
+    return 'SELECT val FROM OneToTen WHERE ' + ' AND '.join(
+        ['val > {}', 'val < {}', 'val != {}'][i % 3].format([i, 1000 - i, 500 + i][i % 3])
+        for i in range(predicates))
+
+
+def selects(ra):
+    return [node for node, _ in ra.preorder_iter() if isinstance(node, Select)]
+
+
+class OptimizerTests(unittest.TestCase):
+    def test_fixed_point(self):
+        ra = plan(predicates(6))
+        self.assertEqual(relational_algebra_optimizers.optimize(ra), ra)
+
+    def test_many_predicates(self):
+        ra = plan(predicates(30))
+        [select] = selects(ra)
+        condition = select.operands[1]
+        self.assertIsInstance(condition, And)
+        # All but the largest > and the smallest < are redundant
+        self.assertEqual(len(condition.operands), 2 + 10)
+
+    def test_bounded(self):
+        ra = sql2ra.sql2ra("SELECT * FROM OneToTen WHERE 3 IN (val, 4, 5, 6)", table)
+        matcher = relational_algebra_optimizers.compile_rules(relational_algebra_optimizers.RULES)
+        rewriter = relational_algebra_optimizers.Rewriter(matcher, max_rewrites=2)
+        with self.assertLogs(relational_algebra_optimizers.logger, 'WARNING'):
+            rewriter.rewrite(ra)
+        self.assertEqual(rewriter.rewrites, 2)
+
+    def test_or_is_one_select(self):
+        sql_text = "SELECT * FROM OneToTen WHERE val = 1 OR val = 3 OR val = 5 OR val > 8"
+        ra = sql2ra.sql2ra(sql_text, table)
+        self.assertFalse([node for node, _ in ra.preorder_iter() if isinstance(node, Union)])
+        [select] = selects(ra)
+        self.assertIsInstance(select.operands[1], Or)
+        self.assertEqual(len(select.operands[1].operands), 4)
+        self.assertEqual(sorted(go(sql_text)), [[1], [3], [5], [9], [10]])
+
+    def test_and_is_one_select(self):
+        sql_text = "SELECT * FROM OneToTen WHERE val > 1 AND val < 5 AND val != 3"
+        ra = sql2ra.sql2ra(sql_text, table)
+        self.assertFalse([node for node, _ in ra.preorder_iter() if isinstance(node, Intersection)])
+        [select] = selects(ra)
+        self.assertEqual(len(select.operands[1].operands), 3)
+        self.assertEqual(sorted(go(sql_text)), [[2], [4]])
+
+    def test_nested_and_or(self):
+        sql_text = "SELECT * FROM OneToTen WHERE (val > 1 AND val < 4) OR (val > 7 AND val != 9)"
+        [select] = selects(sql2ra.sql2ra(sql_text, table))
+        self.assertIsInstance(select.operands[1], Or)
+        self.assertEqual(sorted(go(sql_text)), [[2], [3], [8], [10]])
+
+    def test_in_is_a_set(self):
+        [select] = selects(plan("SELECT * FROM OneToTen WHERE val IN (1, 2, 3)"))
+        self.assertEqual(select.operands[1].operands[1], ValueSet([1, 2, 3]))
+        rows = go("SELECT * FROM OneToTen WHERE val IN (2, 5, 11)")
+        self.assertEqual(sorted(rows), [[2], [5]])
+
+    def test_in_columns_becomes_or(self):
+        [select] = selects(plan("SELECT * FROM OneToTen WHERE 3 IN (val, 4)"))
+        self.assertIsInstance(select.operands[1], Or)
+        self.assertEqual(go("SELECT * FROM OneToTen WHERE 3 IN (val, 4)"), [[3]])
+
+    def test_in_single_value_is_equal(self):
+        [select] = selects(plan("SELECT * FROM OneToTen WHERE val IN (7)"))
+        self.assertEqual(str(select.operands[1]), '((OneToTen . val) == N(7))')
+
+    def test_in_sets_are_combined(self):
+        [select] = selects(plan("SELECT * FROM OneToTen WHERE val IN (1, 2, 3) AND val IN (3, 4)"))
+        self.assertEqual(str(select.operands[1]), '((OneToTen . val) == N(3))')
+        [select] = selects(plan("SELECT * FROM OneToTen WHERE val IN (1, 2) OR val IN (3, 4)"))
+        self.assertEqual(select.operands[1].operands[1], ValueSet([1, 2, 3, 4]))
+        self.assertEqual(
+            sorted(go("SELECT * FROM OneToTen WHERE val IN (1, 2) OR val IN (3, 11)")),
+            [[1], [2], [3]])
+
+    def test_disjoint_in_sets(self):
+        ra = plan("SELECT val FROM OneToTen WHERE val IN (2, 3) AND val IN (4, 5)")
+        self.assertIsInstance(ra.operands[0], EmptySet)
+        for sql_text in (
+            "SELECT val FROM OneToTen WHERE val IN (2, 3) AND val IN (4, 5)",
+            "SELECT val FROM OneToTen WHERE val IN (2, 3) AND val IN (4, 5) AND val != 7",
+            "SELECT val FROM OneToTen WHERE val IN (2, 3) AND val IN (4, 5) ORDER BY val",
+        ):
+            self.assertEqual(go(sql_text), [])
+        self.assertEqual(
+            go("SELECT val FROM OneToTen WHERE val IN (2, 3) AND val IN (4, 5) OR val = 1"),
+            [[1]])
+
+    def test_in_strings_are_coerced(self):
+        [select] = selects(plan("SELECT * FROM OneToTen WHERE val IN ('2', '5')"))
+        self.assertEqual(select.operands[1].operands[1], ValueSet([2, 5]))
+        self.assertEqual(sorted(go("SELECT * FROM OneToTen WHERE val IN ('2', '5')")), [[2], [5]])
+
+    def test_long_in_list(self):
+        sql_text = 'SELECT * FROM OneToTen WHERE val IN ({})'.format(
+            ', '.join(str(i * 3) for i in range(100000)))
+        [select] = selects(plan(sql_text))
+        self.assertEqual(len(select.operands[1].operands[1].values), 100000)
+        self.assertEqual(sorted(go(sql_text)), [[3], [6], [9]])
+
+    def test_matches_are_not_remembered_between_queries(self):
+        plan("SELECT * FROM OneToTen as a WHERE a.val = 5")
+        [select] = selects(plan("SELECT * FROM OneToTen WHERE OneToTen.val = '1'"))
+        self.assertEqual(str(select.operands[1]), '((OneToTen . val) == N(1))')
+
+    def test_concurrent_queries(self):
+        queries = [predicates(i) for i in range(1, 9)]
+        expected = [plan(sql_text) for sql_text in queries]
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            self.assertEqual(list(executor.map(plan, queries * 4)), expected * 4)
+
+    def test_trace(self):
+        trace = relational_algebra_optimizers.Trace()
+        ra = sql2ra.sql2ra("SELECT * FROM OneToTen WHERE 3 IN (val, 4, 5)", table)
+        relational_algebra_optimizers.optimize(ra, trace)
+        self.assertEqual(
+            [r['rule'] for r in trace.rewrites],
+            ['in_statement_2_ors', 'in_statement_2_ors', 'in_statement_single'])
+        self.assertEqual(trace.rewrites[0]['before'], 11)
+        self.assertEqual(trace.rewrites[0]['after'], 15)
+        self.assertLess(0, trace.unmatched)
+
+    def test_trace_json(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = os.path.join(tmp_dir, 'trace.json')
+            sql_text = "SELECT * FROM OneToTen WHERE 4 IN (val, 5)"
+            for _ in range(2):
+                go(sql_text, trace_optimizer=filename)
+                with open(filename) as f:
+                    [trace] = json.load(f)
+            self.assertEqual(trace['query'], sql_text)
+            self.assertTrue(trace['cached'])
+            self.assertEqual(trace['rewrites'], [])
+
+    def test_rule_stats(self):
+        stats = relational_algebra_optimizers.RuleStats()
+        patcher = mock.patch.object(relational_algebra_optimizers, 'rule_stats', stats)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        plan("SELECT * FROM OneToTen WHERE 3 IN (val, 4, 5)")
+        plan("SELECT * FROM OneToTen WHERE 3 IN (val, 4)")
+        self.assertEqual(stats.queries, 2)
+        self.assertEqual(stats.rules['in_statement_2_ors']['hits'], 3)
+        rows = go("SELECT rule, hits FROM SQLHildOptimizerRule")
+        self.assertIn(['in_statement_2_ors', 3], rows)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from sqlhild import iterator
+from sqlhild.query import QueryPlan, go
+from sqlhild.table import Table
+
+
+class Scores(Table):
+    @property
+    def column_metadata(self):
+        return [('label', str), ('score', int), ('age', int)]
+
+    def produce(self):
+        return iter([
+            ('d', 3, 30),
+            ('a', None, 20),
+            ('c', 1, 30),
+            ('b', 3, 10),
+            ('e', 2, None),
+        ])
+
+
+class SortedScores(Table):
+    sort_order = ['score']
+
+    @property
+    def column_metadata(self):
+        return [('score', int)]
+
+    def produce(self):
+        return ((i,) for i in range(100))
+
+
+def plan(sql_text):
+    q = QueryPlan()
+    q.process(sql_text)
+    return q
+
+
+def iterators(source):
+    yield source
+    for s in getattr(source, 'sources', []):
+        yield from iterators(s)
+
+
+def labels(sql_text):
+    return [row[0] for row in go(sql_text)]
+
+
+class OrderByTests(unittest.TestCase):
+    def test_nulls_are_smallest(self):
+        self.assertEqual(labels("SELECT label FROM Scores ORDER BY score, label"), ['a', 'c', 'e', 'b', 'd'])
+        self.assertEqual(labels("SELECT label FROM Scores ORDER BY score DESC, label"), ['b', 'd', 'e', 'c', 'a'])
+
+    def test_nulls_first_and_last(self):
+        self.assertEqual(
+            labels("SELECT label FROM Scores ORDER BY score NULLS LAST, label"), ['c', 'e', 'b', 'd', 'a'])
+        self.assertEqual(
+            labels("SELECT label FROM Scores ORDER BY score DESC NULLS FIRST, label DESC"), ['a', 'd', 'b', 'e', 'c'])
+
+    def test_mixed_directions(self):
+        self.assertEqual(
+            labels("SELECT label FROM Scores ORDER BY age DESC, label ASC"), ['c', 'd', 'a', 'b', 'e'])
+
+    def test_order_by_column_that_isnt_selected(self):
+        self.assertEqual(go("SELECT label FROM Scores WHERE label > 'b' ORDER BY age, label"), [['e'], ['c'], ['d']])
+
+    def test_distinct(self):
+        self.assertEqual(go("SELECT DISTINCT age FROM Scores WHERE label < 'e' ORDER BY age DESC"), [[30], [20], [10]])
+
+    def test_empty(self):
+        self.assertEqual(go("SELECT label FROM Scores WHERE FALSE ORDER BY label"), [])
+        self.assertEqual(go("SELECT label FROM Scores WHERE FALSE ORDER BY score DESC LIMIT 2"), [])
+
+    def test_limit_keeps_top_n(self):
+        q = plan("SELECT label FROM Scores ORDER BY score DESC, label LIMIT 1, 2")
+        [top_n] = [s for s in iterators(q.source) if isinstance(s, iterator.OrderBy)]
+        self.assertIsInstance(top_n, iterator.TopN)
+        self.assertEqual(top_n.limit, 3)
+        self.assertEqual(list(q.produce()), [['d'], ['e']])
+
+    def test_without_limit_sorts(self):
+        q = plan("SELECT label FROM Scores ORDER BY label")
+        self.assertIn(iterator.OrderBy, [type(s) for s in iterators(q.source)])
+
+    def test_sorted_rows_arent_sorted_again(self):
+        q = plan("SELECT score FROM SortedScores ORDER BY score LIMIT 3")
+        self.assertFalse([s for s in iterators(q.source) if isinstance(s, iterator.OrderBy)])
+        self.assertEqual(list(q.produce()), [[0], [1], [2]])
+
+        self.assertEqual(go("SELECT score FROM SortedScores ORDER BY score DESC LIMIT 2"), [[99], [98]])
+
+
+if __name__ == "__main__":
+    unittest.main()
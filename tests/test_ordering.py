@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from sqlhild import iterator
+from sqlhild import join_order
+from sqlhild import table
+from sqlhild.query import QueryPlan, TableRegistry
+from sqlhild.ra2iter import ra2iter
+from sqlhild.relational_algebra import Column, ColumnName, GroupBy, Table
+
+
+class OrderedIds(table.Table):
+    sort_order = ['id']
+
+    @property
+    def column_metadata(self):
+        return [('id', int), ('val', int)]
+
+    def produce(self):
+        return ((i, i * 7 % 10) for i in range(1, 10))
+
+
+class OrderedVals(table.Table):
+    sort_order = ['val']
+
+    @property
+    def column_metadata(self):
+        return [('val', int)]
+
+    def produce(self):
+        return ((i,) for i in range(3, 8))
+
+
+class ReversedVals(table.Table):
+    sort_order = ['val DESC']
+
+    @property
+    def column_metadata(self):
+        return [('val', int)]
+
+    def produce(self):
+        return ((i,) for i in range(10, 0, -1))
+
+
+def plan(sql_text):
+    q = QueryPlan()
+    q.process(sql_text)
+    return q
+
+
+def iterators(source):
+    yield source
+    for s in getattr(source, 'sources', []):
+        yield from iterators(s)
+
+
+def kinds(source):
+    return [type(s) for s in iterators(source)]
+
+
+def group_by(name, *columns):
+    tables = TableRegistry()
+    tables.append(name, name, None)
+    return ra2iter(GroupBy(Table(name), *[Column(Table(name), ColumnName(c)) for c in columns]), tables)
+
+
+class OrderingTests(unittest.TestCase):
+    def test_declared(self):
+        source = iterator.Tee(table.get('OrderedIds'))
+        self.assertEqual(source.ordering, (iterator.SortKey(0, False),))
+        self.assertTrue(source.ordered_by(source.sort_keys(['OrderedIds.id'])))
+        self.assertFalse(source.ordered_by(source.sort_keys(['OrderedIds.val'])))
+        self.assertEqual(table.get('ReversedVals').ordering, (iterator.SortKey(0, True),))
+
+    def test_propagated_through_projection(self):
+        source = iterator.SelectColumns(iterator.Tee(table.get('OrderedIds')), ['OrderedIds.val', 'OrderedIds.id'])
+        self.assertEqual(source.ordering, (iterator.SortKey(1, False),))
+        source = iterator.SelectColumns(iterator.Tee(table.get('OrderedIds')), ['OrderedIds.val'])
+        self.assertEqual(source.ordering, ())
+
+    def test_merge_join_skips_sorting_sorted_tables(self):
+        rows = join_order.HASH_JOIN_ROWS
+        join_order.HASH_JOIN_ROWS = 0
+        try:
+            q = plan("SELECT * FROM OrderedIds a LEFT JOIN OrderedVals b ON a.id = b.val")
+            self.assertNotIn(iterator.OrderBy, kinds(q.source))
+            self.assertEqual(
+                [row[::2] for row in q.produce()],
+                [[1, None], [2, None], [3, 3], [4, 4], [5, 5], [6, 6], [7, 7], [8, None], [9, None]])
+
+            q = plan("SELECT * FROM OrderedIds a LEFT JOIN OrderedVals b ON a.val = b.val")
+            self.assertEqual(kinds(q.source).count(iterator.OrderBy), 1)
+        finally:
+            join_order.HASH_JOIN_ROWS = rows
+
+    def test_distinct_skips_sorting_sorted_rows(self):
+        q = plan("SELECT DISTINCT val FROM ReversedVals")
+        self.assertIn(iterator.Distinct, kinds(q.source))
+        self.assertNotIn(iterator.HashDistinct, kinds(q.source))
+        self.assertEqual(len(list(q.produce())), 10)
+
+        q = plan("SELECT DISTINCT val FROM OrderedIds")
+        self.assertIn(iterator.HashDistinct, kinds(q.source))
+
+    def test_group_by_streams_sorted_rows(self):
+        grouped = group_by('OrderedIds', 'id')
+        self.assertIs(type(grouped), iterator.GroupBy)
+        self.assertEqual(grouped.ordering, (iterator.SortKey(0, False),))
+        self.assertIs(type(group_by('OrderedIds', 'val')), iterator.GroupByHash)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from sqlhild import parameterize
+from sqlhild import plan_cache
+from sqlhild import table
+from sqlhild.query import QueryPlan
+from sqlhild.table import Table
+
+
+class CachedOneToFive(Table):
+    sorted = True
+    tuples = True
+
+    @property
+    def column_metadata(self):
+        return [('val', int)]
+
+    def produce(self):
+        return ((i,) for i in range(1, 6))
+
+
+class CachedNames(Table):
+    tuples = True
+
+    @property
+    def column_metadata(self):
+        return [('name', str)]
+
+    def produce(self):
+        return (('sh',), ('bash',), ('zsh',))
+
+
+def run(sql_text, cache):
+    q = QueryPlan(cache=cache)
+    q.process(sql_text)
+    return list(q.produce())
+
+
+class PlanCacheTests(unittest.TestCase):
+    def test_normalize_collapses_whitespace(self):
+        self.assertEqual(
+            plan_cache.normalize("SELECT *\n  FROM  t\tWHERE a = 'x  y' ;"),
+            "SELECT * FROM t WHERE a = 'x  y'")
+
+    def test_repeated_query_hits(self):
+        cache = plan_cache.PlanCache()
+        rows = run("SELECT * FROM CachedOneToFive WHERE val > 3", cache)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hits, 0)
+
+        cached_rows = run("SELECT *   FROM CachedOneToFive\nWHERE val > 3", cache)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(rows, cached_rows)
+        self.assertEqual(cached_rows, [[4], [5]])
+
+    def test_compiled_function_is_reused(self):
+        cache = plan_cache.PlanCache()
+        run("SELECT * FROM CachedOneToFive WHERE val > 3", cache)
+        select = next(cache.entries.values().__iter__()).ra.operands[0]
+        py_func = select._py_func
+        run("SELECT * FROM CachedOneToFive WHERE val > 3", cache)
+        self.assertIs(select._py_func, py_func)
+
+    def test_registering_a_table_invalidates(self):
+        cache = plan_cache.PlanCache()
+        run("SELECT * FROM CachedOneToFive", cache)
+
+        original = table._tables['CachedOneToFive']
+        try:
+            class CachedOneToFive(Table):
+                sorted = True
+
+                @property
+                def column_metadata(self):
+                    return [('id', int), ('val', int)]
+
+                def produce(self):
+                    return ((i, i * 10) for i in range(1, 6))
+
+            rows = run("SELECT * FROM CachedOneToFive", cache)
+        finally:
+            table._tables['CachedOneToFive'] = original
+
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(rows[0], [1, 10])
+
+    def test_evicts_least_recently_used(self):
+        cache = plan_cache.PlanCache(max_entries=2)
+        run("SELECT * FROM CachedOneToFive WHERE val > 1", cache)
+        run("SELECT * FROM CachedOneToFive WHERE val < 2", cache)
+        run("SELECT * FROM CachedOneToFive WHERE val > 1", cache)
+        run("SELECT * FROM CachedOneToFive WHERE val = 3", cache)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+        run("SELECT * FROM CachedOneToFive WHERE val < 2", cache)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_bounded_by_bytes(self):
+        cache = plan_cache.PlanCache(max_bytes=1)
+        run("SELECT * FROM CachedOneToFive", cache)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+
+class ParameterizeTests(unittest.TestCase):
+    def test_scan_only_replaces_where_literals(self):
+        template, literals = parameterize.scan(
+            "SELECT 1 FROM `t1` WHERE val > 3 AND name = 'x' AND n LIKE 'a%' LIMIT 5")
+        self.assertEqual(
+            template,
+            "SELECT 1 FROM `t1` WHERE val > ? AND name = '?' AND n LIKE 'a%' LIMIT 5")
+        self.assertEqual(literals, ['3', 'x'])
+
+    def test_scan_keeps_in_lists(self):
+        template, literals = parameterize.scan(
+            "SELECT * FROM t WHERE a IN (1, 'x,y') AND b = 2 AND c IN (d, 3)")
+        self.assertEqual(
+            template,
+            "SELECT * FROM t WHERE a IN (1, 'x,y') AND b = ? AND c IN (d, ?)")
+        self.assertEqual(literals, ['2', '3'])
+
+    def test_literals_share_plan(self):
+        cache = plan_cache.PlanCache()
+        self.assertEqual(run("SELECT * FROM CachedOneToFive WHERE val > 3", cache), [[4], [5]])
+        self.assertEqual(run("SELECT * FROM CachedOneToFive WHERE val > 1", cache), [[2], [3], [4], [5]])
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(len(cache), 1)
+
+    def test_numbers_and_strings_dont_share_plan(self):
+        number = "SELECT * FROM CachedNames WHERE name = 5"
+        string = "SELECT * FROM CachedNames WHERE name = 'bash'"
+        for queries in ((number, string), (string, number)):
+            cache = plan_cache.PlanCache()
+            rows = dict((sql_text, run(sql_text, cache)) for sql_text in queries)
+            self.assertEqual(rows[number], [])
+            self.assertEqual(rows[string], [['bash']])
+            self.assertEqual(cache.hits, 0)
+            self.assertEqual(len(cache), 2)
+
+    def test_coerced_literal_is_bound_as_int(self):
+        cache = plan_cache.PlanCache()
+        self.assertEqual(run("SELECT * FROM CachedOneToFive WHERE val = '2'", cache), [[2]])
+        self.assertEqual(run("SELECT * FROM CachedOneToFive WHERE val = '4'", cache), [[4]])
+        self.assertEqual(cache.hits, 1)
+
+    def test_value_dependent_rules(self):
+        cache = plan_cache.PlanCache()
+        self.assertEqual(
+            run("SELECT * FROM CachedOneToFive WHERE val < 5 AND val < 3", cache),
+            [[1], [2]])
+        self.assertEqual(
+            run("SELECT * FROM CachedOneToFive WHERE val < 2 AND val < 4", cache),
+            [[1]])
+        self.assertEqual(cache.hits, 1)
+
+    def test_repeated_literal_is_baked_in(self):
+        cache = plan_cache.PlanCache()
+        self.assertEqual(
+            run("SELECT * FROM CachedOneToFive WHERE val > 2 AND val > 2", cache),
+            [[3], [4], [5]])
+        self.assertEqual(
+            run("SELECT * FROM CachedOneToFive WHERE val > 4 AND val > 4", cache),
+            [[5]])
+        self.assertEqual(cache.hits, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from sqlhild import table
+from sqlhild.query import go, go_script
+
+
+class ProjectionWide(table.Table):
+    """
+    Every column is expensive, only compute the ones that are read
+    """
+    scans = []
+
+    # Don't sample the table to plan joins
+    row_count = 5
+
+    @property
+    def column_metadata(self):
+        return [('id', int), ('cpu', int), ('memory', int), ('label', str)]
+
+    def push_down_columns(self, columns):
+        self.columns_read = columns
+
+    def produce(self):
+        names = [name for name, _ in self.column_metadata]
+        columns = getattr(self, 'columns_read', set(names))
+        ProjectionWide.scans.append(columns)
+        for i in range(5):
+            row = {'id': i, 'cpu': i * 10, 'memory': i * 100, 'label': 'p{}'.format(i)}
+            yield tuple(row[name] if name in columns else None for name in names)
+
+
+class ProjectionOther(table.Table):
+    @property
+    def column_metadata(self):
+        return [('wide_id', int), ('owner', str)]
+
+    def produce(self):
+        return iter([(1, 'alice'), (3, 'bob')])
+
+
+class ProjectionTests(unittest.TestCase):
+    def setUp(self):
+        ProjectionWide.scans = []
+
+    def test_only_read_columns(self):
+        rows = go("SELECT cpu FROM ProjectionWide WHERE id < 2")
+        self.assertEqual(sorted(rows), [[0], [10]])
+        self.assertEqual(ProjectionWide.scans, [{'id', 'cpu'}])
+
+    def test_star(self):
+        rows = go("SELECT * FROM ProjectionWide WHERE id = 1")
+        self.assertEqual(rows, [[1, 10, 100, 'p1']])
+        self.assertEqual(ProjectionWide.scans, [{'id', 'cpu', 'memory', 'label'}])
+
+    def test_join(self):
+        rows = go("""
+            SELECT ProjectionWide.memory, ProjectionOther.owner
+            FROM ProjectionWide
+            JOIN ProjectionOther ON ProjectionWide.id = ProjectionOther.wide_id
+        """)
+        self.assertEqual(sorted(rows), [[100, 'alice'], [300, 'bob']])
+        self.assertEqual(ProjectionWide.scans, [{'id', 'memory'}])
+
+    def test_script_reads_the_columns_of_every_statement(self):
+        results = go_script("""
+            SELECT cpu FROM ProjectionWide WHERE id = 1;
+            SELECT memory FROM ProjectionWide WHERE id = 2
+        """)
+        self.assertEqual(results, [[[10]], [[200]]])
+        self.assertEqual(ProjectionWide.scans, [{'id', 'cpu', 'memory'}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from sqlhild import table
+from sqlhild.query import go, go_script
+from sqlhild.table import Predicate
+
+
+ENVIRONMENTS = [
+    (i, 'region{}'.format(i % 3), i * 10)
+    for i in range(30)
+]
+
+
+class PushDownEnvironments(table.Table):
+    """
+    Pretends to be an API that can filter on region and id ranges
+    """
+    calls = []
+
+    @property
+    def column_metadata(self):
+        return [('id', int), ('region', str), ('size', int)]
+
+    def push_down(self, predicates):
+        self.predicates = [
+            p for p in predicates
+            if (p.column, p.operator) in {('region', '='), ('region', 'in'), ('id', '<')}
+        ]
+        return self.predicates
+
+    def produce(self):
+        predicates = getattr(self, 'predicates', [])
+        PushDownEnvironments.calls.append(predicates)
+        for row in ENVIRONMENTS:
+            for column, operator, value in predicates:
+                if operator == '=' and row[1] != value:
+                    break
+                elif operator == 'in' and row[1] not in value:
+                    break
+                elif operator == '<' and not row[0] < value:
+                    break
+            else:
+                yield row
+
+
+class PushDownTests(unittest.TestCase):
+    def setUp(self):
+        PushDownEnvironments.calls = []
+
+    def test_handled(self):
+        rows = go("SELECT id FROM PushDownEnvironments WHERE region = 'region1' AND id < 10")
+        self.assertEqual(sorted(rows), [[1], [4], [7]])
+        self.assertEqual(PushDownEnvironments.calls, [[
+            Predicate('region', '=', 'region1'),
+            Predicate('id', '<', 10),
+        ]])
+
+    def test_residual(self):
+        rows = go("SELECT id FROM PushDownEnvironments WHERE region = 'region2' AND size > 150")
+        self.assertEqual(sorted(rows), [[17], [20], [23], [26], [29]])
+        self.assertEqual(PushDownEnvironments.calls, [[Predicate('region', '=', 'region2')]])
+
+    def test_in(self):
+        rows = go("SELECT id FROM PushDownEnvironments WHERE region IN ('region0', 'region2') AND id < 4")
+        self.assertEqual(sorted(rows), [[0], [2], [3]])
+        [[predicate, _]] = PushDownEnvironments.calls
+        self.assertEqual(predicate.operator, 'in')
+        self.assertEqual(sorted(predicate.value), ['region0', 'region2'])
+
+    def test_literal_on_the_left(self):
+        rows = go("SELECT id FROM PushDownEnvironments WHERE 3 > id")
+        self.assertEqual(sorted(rows), [[0], [1], [2]])
+        self.assertEqual(PushDownEnvironments.calls, [[Predicate('id', '<', 3)]])
+
+    def test_nothing_handled(self):
+        rows = go("SELECT id FROM PushDownEnvironments WHERE size > 270")
+        self.assertEqual(sorted(rows), [[28], [29]])
+        self.assertEqual(PushDownEnvironments.calls, [[]])
+
+    def test_cached_plan_uses_new_literals(self):
+        go("SELECT id FROM PushDownEnvironments WHERE region = 'region0' AND id < 4")
+        rows = go("SELECT id FROM PushDownEnvironments WHERE region = 'region1' AND id < 5")
+        self.assertEqual(sorted(rows), [[1], [4]])
+        self.assertEqual(PushDownEnvironments.calls[-1], [
+            Predicate('region', '=', 'region1'),
+            Predicate('id', '<', 5),
+        ])
+
+    def test_shared_table_is_not_filtered(self):
+        results = go_script("""
+            SELECT id FROM PushDownEnvironments WHERE region = 'region0' AND id < 7;
+            SELECT id FROM PushDownEnvironments WHERE size > 270
+        """)
+        self.assertEqual([sorted(rows) for rows in results], [[[0], [3], [6]], [[28], [29]]])
+
+    def test_default_handles_nothing(self):
+        self.assertEqual(table.AbstractTable.push_down(None, [Predicate('id', '=', 1)]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from sqlhild.query import go, go_script
+from sqlhild.sql2ra import split_statements
+from sqlhild.table import Table
+
+
+class ScannedOneToFive(Table):
+    sorted = True
+    tuples = True
+    scans = 0
+
+    @property
+    def column_metadata(self):
+        return [('val', int)]
+
+    def produce(self):
+        ScannedOneToFive.scans += 1
+        return ((i,) for i in range(1, 6))
+
+
+class SplitStatementsTests(unittest.TestCase):
+    def test_split(self):
+        self.assertEqual(
+            split_statements("SELECT 1; SELECT 2;\n\nSELECT 3"),
+            ['SELECT 1', 'SELECT 2', 'SELECT 3'])
+
+    def test_semicolons_in_strings_and_identifiers(self):
+        self.assertEqual(
+            split_statements("SELECT ';' FROM `a;b`; SELECT \"x;\""),
+            ["SELECT ';' FROM `a;b`", 'SELECT "x;"'])
+
+    def test_comments_are_dropped(self):
+        self.assertEqual(
+            split_statements("-- first;\nSELECT 1 /* ; */;\n# last;\n"),
+            ['SELECT 1'])
+
+
+class ScriptTests(unittest.TestCase):
+    def setUp(self):
+        ScannedOneToFive.scans = 0
+
+    def test_each_statement_has_results(self):
+        results = go_script("""
+            SELECT * FROM ScannedOneToFive WHERE val < 3;
+            SELECT val FROM ScannedOneToFive WHERE val > 3;
+            SELECT * FROM ScannedOneToFive WHERE val = 3;
+        """)
+        self.assertEqual(results, [
+            [[1], [2]],
+            [[4], [5]],
+            [[3]],
+        ])
+
+    def test_tables_are_scanned_once(self):
+        go_script("""
+            SELECT * FROM ScannedOneToFive WHERE val < 3;
+            SELECT * FROM ScannedOneToFive WHERE val = 1 OR val = 5;
+            SELECT * FROM ScannedOneToFive;
+        """)
+        self.assertEqual(ScannedOneToFive.scans, 1)
+
+    def test_same_results_as_separate_queries(self):
+        statements = [
+            "SELECT * FROM ScannedOneToFive WHERE val = 2 OR val = 4",
+            "SELECT * FROM ScannedOneToFive WHERE val > 1 AND val < 4",
+        ]
+        self.assertEqual(
+            go_script(';'.join(statements)),
+            [sorted(go(sql)) for sql in statements])
+
+
+if __name__ == "__main__":
+    unittest.main()
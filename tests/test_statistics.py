@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from sqlhild import join_order
+from sqlhild import relational_algebra_optimizers
+from sqlhild import sql2ra
+from sqlhild import statistics
+from sqlhild import table
+from sqlhild.query import go
+from sqlhild.relational_algebra import Column, ColumnName, Select, Table
+
+
+class StatsSampled(table.Table):
+    collect_statistics = True
+    scans = 0
+
+    @property
+    def column_metadata(self):
+        return [('id', int), ('parity', int), ('name', str)]
+
+    def produce(self):
+        StatsSampled.scans += 1
+        for i in range(20):
+            yield (i, i % 2, None if i % 4 == 0 else 'n{}'.format(i % 3))
+
+
+class StatsDeclared(table.Table):
+    @property
+    def column_metadata(self):
+        return [('id', int)]
+
+    def statistics(self):
+        return statistics.TableStatistics(
+            row_count=5,
+            columns={'id': statistics.ColumnStatistics(distinct_count=5, min=0, max=4)})
+
+    def produce(self):
+        raise AssertionError('Declared statistics must not scan')
+
+
+class StatsNoCollection(table.Table):
+    @property
+    def column_metadata(self):
+        return [('id', int), ('parity', int)]
+
+    def produce(self):
+        raise AssertionError('Statistics collection is opt-in')
+
+
+class StatsBig(table.Table):
+    collect_statistics = True
+
+    @property
+    def column_metadata(self):
+        return [('id', int), ('parity', int)]
+
+    def produce(self):
+        return ((i, i % 2) for i in range(500))
+
+
+class StatsTiny(table.Table):
+    collect_statistics = True
+
+    @property
+    def column_metadata(self):
+        return [('parity', int), ('label', str)]
+
+    def produce(self):
+        return iter([(0, 'even'), (1, 'odd')])
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class StatisticsTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = statistics.StatisticsCache(ttl=10, clock=self.clock)
+        StatsSampled.scans = 0
+
+    def test_collected(self):
+        stats = self.cache.get(StatsSampled())
+        self.assertEqual(stats.row_count, 20)
+        self.assertFalse(stats.sampled)
+        self.assertEqual(
+            stats.column('id'),
+            statistics.ColumnStatistics(distinct_count=20, min=0, max=19, null_fraction=0))
+        self.assertEqual(stats.column('parity').distinct_count, 2)
+        self.assertEqual(
+            stats.column('name'),
+            statistics.ColumnStatistics(distinct_count=3, min='n0', max='n2', null_fraction=0.25))
+
+    def test_sampled(self):
+        cache = statistics.StatisticsCache(sample_size=8)
+        stats = cache.get(StatsSampled())
+        self.assertEqual(stats.row_count, 8)
+        self.assertTrue(stats.sampled)
+        self.assertEqual(stats.column('id').max, 7)
+        self.assertEqual(str(stats), 'rows: 8+')
+
+    def test_cached_until_ttl(self):
+        self.cache.get(StatsSampled())
+        self.cache.get(StatsSampled())
+        self.assertEqual(StatsSampled.scans, 1)
+
+        self.clock.now = 10
+        self.assertIsNone(self.cache.peek(StatsSampled()))
+        self.cache.get(StatsSampled())
+        self.assertEqual(StatsSampled.scans, 2)
+
+    def test_declared(self):
+        stats = self.cache.get(StatsDeclared())
+        self.assertEqual(stats.row_count, 5)
+        self.assertEqual(stats.column('id').max, 4)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_declared_attributes(self):
+        class StatsAttributes(table.Table):
+            row_count = 7
+            distinct_counts = {'id': 3}
+
+            @property
+            def column_metadata(self):
+                return [('id', int)]
+
+        stats = self.cache.get(StatsAttributes())
+        self.assertEqual(stats.row_count, 7)
+        self.assertEqual(stats.column('id').distinct_count, 3)
+        self.assertIsNone(stats.column('other').distinct_count)
+
+    def test_not_collected_by_default(self):
+        stats = self.cache.get(StatsNoCollection())
+        self.assertIsNone(stats.row_count)
+
+    def test_planner_does_not_scan_by_default(self):
+        ra = sql2ra.sql2ra("""
+            SELECT StatsNoCollection.id, StatsTiny.label
+            FROM StatsNoCollection
+            JOIN StatsTiny ON StatsNoCollection.parity = StatsTiny.parity
+        """, table)
+        ra = relational_algebra_optimizers.optimize(ra)
+        join_order.reorder(ra, table)
+
+    def test_registering_a_table_clears_the_cache(self):
+        self.cache.get(StatsSampled())
+
+        class StatsOther(table.Table):
+            pass
+
+        self.assertIsNone(self.cache.peek(StatsSampled()))
+
+    def test_planner_uses_collected_statistics(self):
+        ra = sql2ra.sql2ra("""
+            SELECT StatsBig.id, StatsTiny.label
+            FROM StatsBig
+            JOIN StatsTiny ON StatsBig.parity = StatsTiny.parity
+        """, table)
+        ra = relational_algebra_optimizers.optimize(ra)
+        stats = join_order.Statistics(ra, table)
+        self.assertEqual(stats.row_count('StatsBig'), 500)
+        self.assertEqual(stats.row_count('StatsTiny'), 2)
+        self.assertEqual(stats.distinct_count(Column(Table('StatsBig'), ColumnName('parity'))), 2)
+
+    def test_range_selectivity(self):
+        ra = sql2ra.sql2ra("SELECT * FROM StatsDeclared WHERE id < 1", table)
+        stats = join_order.Statistics(ra, table)
+        select = next(node for node, _ in ra.preorder_iter() if isinstance(node, Select))
+        self.assertEqual(join_order.estimate_rows(select, stats), 5 * 0.25)
+
+    def test_results_unchanged(self):
+        rows = go("""
+            SELECT StatsBig.id, StatsTiny.label
+            FROM StatsBig
+            JOIN StatsTiny ON StatsBig.parity = StatsTiny.parity
+            WHERE StatsBig.id < 4
+        """)
+        self.assertEqual(sorted(rows), [[0, 'even'], [1, 'odd'], [2, 'even'], [3, 'odd']])
+
+
+if __name__ == "__main__":
+    unittest.main()
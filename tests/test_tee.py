@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import ctypes
+import unittest
+
+from sqlhild import iterator
+from sqlhild import table
+from sqlhild.query import go_script
+
+
+class Thousand(table.Table):
+    """
+    Counts how many rows it's been asked for
+    """
+    produced = 0
+
+    @property
+    def column_metadata(self):
+        return [('id', int), ('name', str)]
+
+    def produce(self):
+        for i in range(1000):
+            Thousand.produced += 1
+            yield (i, 'name{}'.format(i))
+
+
+class TeeTests(unittest.TestCase):
+    def setUp(self):
+        Thousand.produced = 0
+
+    def test_drained_branch_spools(self):
+        first = iterator.Tee(table.get('Thousand'), max_rows=10)
+        second = first.tee()
+        self.assertEqual(len(list(first.produce())), 1000)
+        shared = first.shared
+        self.assertIsNotNone(shared.spool)
+        self.assertLessEqual(len(shared.buffer), 10)
+
+        self.assertEqual(list(second.produce()), [(i, 'name{}'.format(i)) for i in range(1000)])
+        self.assertEqual(Thousand.produced, 1000)
+
+    def test_interleaved_branches_dont_spool(self):
+        first = iterator.Tee(table.get('Thousand'), max_rows=10)
+        second = first.tee()
+        rows = list(zip(first.produce(), second.produce()))
+        self.assertEqual(len(rows), 1000)
+        self.assertTrue(all(a == b for a, b in rows))
+        self.assertIsNone(first.shared.spool)
+
+    def test_closed_branch_is_not_waited_for(self):
+        first = iterator.Tee(table.get('Thousand'), max_rows=10)
+        second = first.tee()
+        next(second.produce())
+        second.close()
+        self.assertEqual(len(list(first.produce())), 1000)
+        self.assertIsNone(first.shared.spool)
+
+        first.close()
+        self.assertEqual(first.shared.positions, {})
+
+    def test_unpicklable_rows_stay_in_memory(self):
+        shared = iterator.SharedScan((ctypes.pointer(ctypes.c_int(i)) for i in range(100)), max_rows=10)
+        first, second = shared.reader(), shared.reader()
+        self.assertEqual(len(list(shared.read(first))), 100)
+        self.assertFalse(shared.spillable)
+        self.assertEqual([row.contents.value for row in shared.read(second)], list(range(100)))
+
+    def test_script_shares_spooled_scan(self):
+        buffer_rows = iterator.BUFFER_ROWS
+        iterator.BUFFER_ROWS = 10
+        try:
+            results = go_script(
+                "SELECT id FROM Thousand WHERE id < 500; SELECT name FROM Thousand WHERE id >= 998")
+        finally:
+            iterator.BUFFER_ROWS = buffer_rows
+        self.assertEqual(len(results[0]), 500)
+        self.assertEqual(results[1], [['name998'], ['name999']])
+        self.assertEqual(Thousand.produced, 1000)
+
+
+if __name__ == "__main__":
+    unittest.main()